@@ -0,0 +1,67 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+bytes per event and encoded events/s of the spool formats per batch size
+
+usage: python benchmarks/bench_codec.py [events]
+"""
+
+import sys
+import time
+import uuid
+
+from watcher import codec
+
+
+def create_event(index):
+    return {
+        'typeURI': 'http://schemas.dmtf.org/cloud/audit/1.0/event', 'eventType': 'activity',
+        'id': str(uuid.uuid4()), 'eventTime': '2017-07-14T02:40:{0:02d}.500000+0000'.format(index % 60),
+        'action': 'read/list', 'outcome': 'success', 'reason': {'reasonType': 'HTTP', 'reasonCode': '200'},
+        'initiator': {'id': '4c3b2a1d0e9f8a7b6c5d4e3f2a1b0c9d', 'typeURI': 'service/security/account/user',
+                      'host': {'address': '10.0.0.{0}'.format(index % 8)},
+                      'project_id': 'b206a1900310484f8a9504754c84b06{0}'.format(index % 4), 'domain_id': 'default'},
+        'target': {'id': 'b206a1900310484f8a9504754c84b067', 'typeURI': 'service/compute/servers/detail',
+                   'name': 'service/compute', 'project_id': 'b206a1900310484f8a9504754c84b067'},
+        'observer': {'id': 'target'}, 'requestPath': '/v2.1/servers/detail', 'requestId': 'req-{0}'.format(uuid.uuid4())
+    }
+
+
+def run(encoder, events, batch_size):
+    encoder.reset()
+    size = 0
+    start = time.time()
+    for i in range(0, len(events), batch_size):
+        size += sum(len(record) for record in encoder.encode(events[i:i + batch_size]))
+    return float(size) / len(events), len(events) / (time.time() - start)
+
+
+def main(n=20000):
+    events = [create_event(i) for i in range(n)]
+    formats = [
+        ('json', codec.JsonEncoder()),
+        ('binary', codec.Encoder(compress=False)),
+        ('binary+zlib', codec.Encoder(compress=True)),
+    ]
+    for batch_size in (1, 10, 100):
+        for name, encoder in formats:
+            per_event, rate = run(encoder, events, batch_size)
+            print('{0:<28} {1:>8.1f} bytes/event {2:>10.0f} events/s'.format(
+                '{0}, batch {1}'.format(name, batch_size), per_event, rate
+            ))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
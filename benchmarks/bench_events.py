@@ -0,0 +1,85 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+cost of queueing a CADF event record in the request thread compared to building and writing the event synchronously,
+and the throughput of the background writer per batch size
+
+usage: python benchmarks/bench_events.py [events]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+import warnings
+
+from watcher import events
+
+RECORD = events.EventRecord(
+    1500000000.5, 0.042, 'GET', '/v2.1/servers/detail', '200', 'read/list', 'service/compute/servers/detail',
+    'b206a1900310484f8a9504754c84b067', 'b206a1900310484f8a9504754c84b067', 'default',
+    '4c3b2a1d0e9f8a7b6c5d4e3f2a1b0c9d', '10.0.0.1', 'req-0e8c5a9e-2b4f-4c1d-9a7e-3f6b8d2c1a0e'
+)
+
+
+class NullSink(object):
+    def write(self, events):
+        pass
+
+    def close(self):
+        pass
+
+
+def throughput(sink, n, batch_size):
+    emitter = events.EventEmitter(sink, 'service/compute', batch_size=batch_size, flush_interval=0.1, max_queue=n)
+    emitter.ensure_started()
+    start = time.time()
+    for _ in range(n):
+        emitter.emit(RECORD)
+    emitter.stop()
+    dropped = emitter.writer.dropped
+    return n / (time.time() - start), dropped
+
+
+def main(n=20000):
+    # pycadf warns about ids which are not uuids
+    warnings.simplefilter('ignore')
+    path = tempfile.mkdtemp()
+    try:
+        emitter = events.EventEmitter(NullSink(), 'service/compute', max_queue=n)
+        print('{0:<40} {1:>10.3f} us/op'.format(
+            'enqueue record (request thread)', timeit.timeit(lambda: emitter.emit(RECORD), number=n) / n * 1e6
+        ))
+        file_sink = events.FileSink(os.path.join(path, 'sync.log'))
+        print('{0:<40} {1:>10.3f} us/op'.format(
+            'build and write event synchronously',
+            timeit.timeit(lambda: file_sink.write([events.build_event(RECORD, 'service/compute')]), number=n) / n * 1e6
+        ))
+        file_sink.close()
+
+        for batch_size in (1, 10, 100, 1000):
+            file_sink = events.FileSink(os.path.join(path, 'events-{0}.log'.format(batch_size)))
+            rate, dropped = throughput(file_sink, n, batch_size)
+            print('{0:<40} {1:>10.0f} events/s {2} dropped'.format(
+                'file sink, batch size {0}'.format(batch_size), rate, dropped
+            ))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,60 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+per-increment cost of the shared memory store compared to sending a statsd packet via UDP
+
+usage: python benchmarks/bench_shm.py [iterations]
+"""
+
+import shutil
+import sys
+import tempfile
+import timeit
+
+from datadog.dogstatsd import DogStatsd
+
+from watcher import shm
+
+TAGS = [
+    'service_name:service/compute', 'service:compute', 'action:read/list',
+    'target_type_uri:service/compute/servers', 'status:200'
+]
+
+
+def main(iterations=100000):
+    path = tempfile.mkdtemp()
+    try:
+        registry = shm.SharedRegistry(path, namespace='openstack_watcher')
+        counter = registry.counter('api_requests_total', 'total count of api requests')
+        histogram = registry.histogram('api_requests_duration_seconds', 'request latency in seconds')
+        client = DogStatsd(host='127.0.0.1', port=9125, namespace='openstack_watcher')
+
+        results = [
+            ('shm counter increment', timeit.timeit(lambda: counter.inc(TAGS), number=iterations)),
+            ('shm histogram observe', timeit.timeit(lambda: histogram.observe(TAGS, 0.042), number=iterations)),
+            ('statsd increment (udp)', timeit.timeit(lambda: client.increment('api_requests_total', tags=TAGS),
+                                                     number=iterations)),
+            ('statsd timing (udp)', timeit.timeit(lambda: client.timing('api_requests_duration_seconds', 42, tags=TAGS),
+                                                  number=iterations)),
+            ('shm render merged view', timeit.timeit(registry.render, number=100) / 100 * iterations),
+        ]
+        for name, total in results:
+            print('{0:<28} {1:>10.3f} us/op'.format(name, total / iterations * 1e6))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,81 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+sustained events/s of the spool on local disk per group commit size, with and without fsync, and the read throughput
+
+usage: python benchmarks/bench_spool.py [events] [directory]
+"""
+
+import json
+import shutil
+import sys
+import tempfile
+import time
+
+from watcher import spool
+
+EVENT = json.dumps({
+    'typeURI': 'http://schemas.dmtf.org/cloud/audit/1.0/event', 'eventType': 'activity',
+    'id': '0e8c5a9e-2b4f-4c1d-9a7e-3f6b8d2c1a0e', 'eventTime': '2017-07-14T02:40:00.500000+0000',
+    'action': 'read/list', 'outcome': 'success', 'reason': {'reasonType': 'HTTP', 'reasonCode': '200'},
+    'initiator': {'id': '4c3b2a1d0e9f8a7b6c5d4e3f2a1b0c9d', 'typeURI': 'service/security/account/user',
+                  'host': {'address': '10.0.0.1'}, 'project_id': 'b206a1900310484f8a9504754c84b067',
+                  'domain_id': 'default'},
+    'target': {'id': 'b206a1900310484f8a9504754c84b067', 'typeURI': 'service/compute/servers/detail',
+               'name': 'service/compute', 'project_id': 'b206a1900310484f8a9504754c84b067'},
+    'observer': {'id': 'target'}, 'requestPath': '/v2.1/servers/detail'
+}).encode('utf-8')
+
+
+def write(path, n, group_size, fsync):
+    writer = spool.SpoolWriter(path, fsync=fsync, max_bytes=1 << 40)
+    group = [EVENT] * group_size
+    start = time.time()
+    for _ in range(n // group_size):
+        writer.append(group)
+    elapsed = time.time() - start
+    writer.close()
+    return n // group_size * group_size / elapsed
+
+
+def read(path):
+    reader = spool.SpoolReader(path)
+    count = 0
+    start = time.time()
+    for writer in reader.writers():
+        for sequence in reader.segments(writer):
+            count += len(reader.read(writer, sequence))
+    return count / (time.time() - start)
+
+
+def main(n=100000, directory=None):
+    for fsync in (False, True):
+        for group_size in (1, 10, 100, 1000):
+            # fsync per event is slow, keep the run short
+            events = n if not fsync or group_size >= 100 else n // 100
+            path = tempfile.mkdtemp(dir=directory)
+            try:
+                rate = write(path, events, group_size, fsync)
+                print('{0:<36} {1:>12.0f} events/s'.format(
+                    'append, group {0}, fsync {1}'.format(group_size, 'on' if fsync else 'off'), rate
+                ))
+                if fsync and group_size == 1000:
+                    print('{0:<36} {1:>12.0f} events/s'.format('read via mmap', read(path)))
+            finally:
+                shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]] + sys.argv[2:3])
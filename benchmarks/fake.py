@@ -0,0 +1,54 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+the application the benchmarks wrap with the middleware
+"""
+
+import time
+
+from webob import Response
+
+# per request overrides of the status and latency of the FakeApp, e.g. set by a replay
+STATUS_KEY = 'fake_app.status'
+LATENCY_KEY = 'fake_app.latency'
+
+
+class FakeApp(object):
+    def __init__(self, status=200, latency=0, body=None, request_id=False):
+        """
+        :param status: the default status code
+        :param latency: default seconds to sleep before answering
+        :param body: the body or None for a short JSON message
+        :param request_id: whether to answer with an X-Openstack-Request-Id header
+        """
+        self.status = status
+        self.latency = latency
+        self.body = body
+        self.request_id = request_id
+        self.requests = 0
+
+    def __call__(self, env, start_response):
+        self.requests += 1
+        latency = env.get(LATENCY_KEY, self.latency)
+        if latency:
+            time.sleep(latency)
+        if self.body is None:
+            response = Response(json_body='{"message":"fake app"}')
+        else:
+            response = Response(body=self.body)
+        response.status_int = int(env.get(STATUS_KEY, self.status))
+        if self.request_id:
+            response.headers['X-Openstack-Request-Id'] = 'req-{0}'.format(self.requests)
+        return response(env, start_response)
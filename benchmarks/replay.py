@@ -0,0 +1,320 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+replay a captured corpus (capture_enabled) or a JSON access log (access_log_enabled) against the fake app with and
+without the watcher middleware and report the throughput and latency percentiles.
+
+the requests are sent in-process, calling the WSGI pipeline directly, or over HTTP to a local server. they are paced
+as captured (realtime), accelerated by a factor or as fast as possible (max) by several threads or processes.
+
+usage: PYTHONPATH=. python benchmarks/replay.py <corpus or access log> [--service-type compute]
+           [--config-file etc/nova.yaml] [--option key=value ..] [--mode inprocess|server]
+           [--pacing max|realtime|<factor>] [--workers 4] [--processes] [--app-latency] [--repeat 1]
+"""
+
+import argparse
+import calendar
+import json
+import logging
+import multiprocessing
+import sys
+import threading
+import time
+import warnings
+from wsgiref import simple_server
+
+from six.moves import http_client
+from six.moves import socketserver
+from webob import Request
+
+from benchmarks import fake
+from watcher import capture
+from watcher.watcher import OpenStackWatcherMiddleware
+
+# headers of the initiator synthesized for the lines of an access log
+ACCESS_LOG_HEADERS = {
+    'initiator_project_id': 'X-Project-Id', 'initiator_domain_id': 'X-Domain-Id', 'initiator_user_id': 'X-User-Id'
+}
+
+
+def load_requests(path):
+    """
+    load the requests of a corpus or an access log
+
+    :param path: path of a capture file (gzip) or an access log (JSON lines)
+    :return: list of dicts with time, method, path, query_string, headers, body, status, duration
+    """
+    with open(path, 'rb') as f:
+        is_gzip = f.read(2) == b'\x1f\x8b'
+    if is_gzip:
+        return [
+            dict(time=r['time'], method=r['method'], path=r['path'], query_string=r.get('query_string'),
+                 headers=dict((k, v) for k, v in r.get('headers', {}).items() if v != capture.REDACTED),
+                 body=r.get('body'), status=r.get('status'), duration=r.get('duration') or 0)
+            for r in capture.read_corpus(path)
+        ]
+
+    requests = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            r = json.loads(line)
+            headers = dict(
+                (header, r[key]) for key, header in ACCESS_LOG_HEADERS.items() if r.get(key) not in (None, 'unknown')
+            )
+            requests.append(dict(
+                time=calendar.timegm(time.strptime(r['time'][:19], '%Y-%m-%dT%H:%M:%S')) + float(r['time'][19:26]),
+                method=r['method'], path=r['path'], query_string=None, headers=headers, body=None, status=r.get('status'),
+                duration=r.get('duration') or 0
+            ))
+    return requests
+
+
+def build_app(args, with_middleware):
+    app = fake.FakeApp(request_id=True)
+    if not with_middleware:
+        return app
+    config = {'service_type': args.service_type}
+    if args.config_file:
+        config['config_file'] = args.config_file
+    for option in args.option:
+        key, _, value = option.partition('=')
+        config[key.strip()] = value.strip()
+    return OpenStackWatcherMiddleware(app, config)
+
+
+def build_environ(request, args):
+    req = Request.blank(request['path'], method=request['method'], headers=request['headers'])
+    if request['query_string']:
+        req.query_string = request['query_string']
+    if request['body'] is not None:
+        req.body = request['body']
+    environ = req.environ
+    status = request.get('status')
+    if status and str(status).isdigit():
+        environ[fake.STATUS_KEY] = int(status)
+    if args.app_latency:
+        environ[fake.LATENCY_KEY] = request['duration']
+    return environ
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, simple_server.WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(simple_server.WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def call_inprocess(app, environ):
+    def start_response(status, headers, exc_info=None):
+        return lambda data: None
+
+    result = app(environ, start_response)
+    try:
+        for _ in result:
+            pass
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+
+def call_server(address, environ):
+    connection = http_client.HTTPConnection(address[0], address[1], timeout=30)
+    try:
+        headers = dict(
+            (key[5:].replace('_', '-').title(), value) for key, value in environ.items() if key.startswith('HTTP_')
+        )
+        if environ.get('CONTENT_TYPE'):
+            headers['Content-Type'] = environ['CONTENT_TYPE']
+        # the fake app answers with the captured status and latency
+        headers['X-Replay-Status'] = str(environ.get(fake.STATUS_KEY, 200))
+        headers['X-Replay-Latency'] = str(environ.get(fake.LATENCY_KEY, 0))
+        path = environ['PATH_INFO'] + ('?' + environ['QUERY_STRING'] if environ.get('QUERY_STRING') else '')
+        body = environ['wsgi.input'].read() if environ.get('CONTENT_LENGTH') else None
+        connection.request(environ['REQUEST_METHOD'], path, body, headers)
+        connection.getresponse().read()
+    finally:
+        connection.close()
+
+
+def replay_overrides(app):
+    """
+    wrap the app of a server to take the status and latency of the FakeApp from request headers
+    """
+    def wrapper(environ, start_response):
+        if 'HTTP_X_REPLAY_STATUS' in environ:
+            environ[fake.STATUS_KEY] = int(environ.pop('HTTP_X_REPLAY_STATUS'))
+        if 'HTTP_X_REPLAY_LATENCY' in environ:
+            environ[fake.LATENCY_KEY] = float(environ.pop('HTTP_X_REPLAY_LATENCY'))
+        return app(environ, start_response)
+    return wrapper
+
+
+def run_worker(args, requests, index, with_middleware, app, address, start, results):
+    """
+    send every workers-th request starting at index to the app, a new one per process, or the server
+
+    :return: list of latencies in seconds via results
+    """
+    warnings.simplefilter('ignore')
+    logging.disable(logging.CRITICAL)
+    if app is None and address is None:
+        app = build_app(args, with_middleware)
+    speed = None if args.pacing == 'max' else (1.0 if args.pacing == 'realtime' else float(args.pacing))
+    first = requests[0]['time']
+    latencies = []
+    # all workers start at the same time
+    if start > time.time():
+        time.sleep(start - time.time())
+    for request in requests[index::args.workers]:
+        if speed:
+            delay = start + (request['time'] - first) / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        environ = build_environ(request, args)
+        begin = time.time()
+        if address is None:
+            call_inprocess(app, environ)
+        else:
+            call_server(address, environ)
+        latencies.append(time.time() - begin)
+    results.put(latencies)
+
+
+class _ListQueue(object):
+    """
+    queue of the results of threads
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._items = []
+
+    def put(self, item):
+        with self._condition:
+            self._items.append(item)
+            self._condition.notify()
+
+    def get(self):
+        with self._condition:
+            while not self._items:
+                self._condition.wait()
+            return self._items.pop(0)
+
+
+def run(args, requests, with_middleware):
+    """
+    :return: tuple of the number of requests per second and the sorted latencies
+    """
+    server = None
+    address = None
+    if args.mode == 'server':
+        server = simple_server.make_server(
+            '127.0.0.1', 0, replay_overrides(build_app(args, with_middleware)),
+            server_class=ThreadingWSGIServer, handler_class=QuietHandler
+        )
+        address = server.server_address
+        # never keep the interpreter alive, e.g. after an interrupt
+        server_thread = threading.Thread(target=server.serve_forever, name='replay-server')
+        server_thread.daemon = True
+        server_thread.start()
+
+    try:
+        # threads share the pipeline, processes build their own
+        app = None
+        if args.processes:
+            results = multiprocessing.Queue()
+            worker_class = multiprocessing.Process
+        else:
+            results = _ListQueue()
+            worker_class = threading.Thread
+            if address is None:
+                app = build_app(args, with_middleware)
+
+        start = time.time() + 0.1
+        workers = [
+            worker_class(target=run_worker, args=(args, requests, index, with_middleware, app, address, start, results))
+            for index in range(args.workers)
+        ]
+        for worker in workers:
+            worker.start()
+        latencies = []
+        for _ in workers:
+            latencies.extend(results.get())
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+    return len(latencies) / elapsed, sorted(latencies)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='replay captured requests with and without the watcher middleware')
+    parser.add_argument('path', help='capture file or JSON access log')
+    parser.add_argument('--service-type', default='compute', help='the service type of the middleware')
+    parser.add_argument('--config-file', help='the watcher YAML configuration, e.g. etc/nova.yaml')
+    parser.add_argument('--option', action='append', default=[], help='a middleware option as key=value')
+    parser.add_argument('--mode', choices=['inprocess', 'server'], default='inprocess')
+    parser.add_argument('--pacing', default='max', help="'max', 'realtime' or a factor accelerating the realtime pacing")
+    parser.add_argument('--workers', type=int, default=1, help='number of threads or processes')
+    parser.add_argument('--processes', action='store_true', help='use processes instead of threads')
+    parser.add_argument('--app-latency', action='store_true', help='let the fake app take the captured duration')
+    parser.add_argument('--repeat', type=int, default=1, help='replay the requests this many times')
+    args = parser.parse_args(argv)
+
+    requests = load_requests(args.path)
+    if not requests:
+        sys.stderr.write("no requests in {0}\n".format(args.path))
+        return 1
+    requests.sort(key=lambda request: request['time'])
+    if args.repeat > 1:
+        duration = requests[-1]['time'] - requests[0]['time'] + 1
+        requests = [
+            dict(request, time=request['time'] + i * duration) for i in range(args.repeat) for request in requests
+        ]
+
+    print('{0:<20} {1:>9} {2:>10} {3:>9} {4:>9} {5:>9} {6:>9}'.format(
+        '', 'requests', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'
+    ))
+    results = {}
+    for with_middleware in (False, True):
+        rate, latencies = run(args, requests, with_middleware)
+        name = 'with middleware' if with_middleware else 'without middleware'
+        results[name] = latencies
+        print('{0:<20} {1:>9} {2:>10.0f} {3:>9.3f} {4:>9.3f} {5:>9.3f} {6:>9.3f}'.format(
+            name, len(latencies), rate, *[1000 * percentile(latencies, p) for p in (50, 90, 99, 100)]
+        ))
+    print('{0:<20} {1:>9} {2:>10} {3:>9.3f} {4:>9.3f} {5:>9.3f}'.format(
+        'overhead', '', '', *[
+            1000 * (percentile(results['with middleware'], p) - percentile(results['without middleware'], p))
+            for p in (50, 90, 99)
+        ]
+    ))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
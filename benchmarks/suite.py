@@ -0,0 +1,487 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+benchmark suite of the classification of every service configuration in etc/ with a regression gate.
+
+per service it measures the startup (constructing the middleware with its configuration), the cost per request of
+every stage of the classification, the overhead of the middleware around the fake app and the memory allocated
+per request. the requests are generated from the path keywords of the configuration plus service specific paths
+covering the regex mappings, custom actions and action bodies.
+
+the stages are
+    lexing          normalizing and splitting the path. the complete target type URI of swift
+    regex           the regex path mapping
+    parts           the part by part target type URI of paths not mapped by a regex
+    body_peek       the action of the JSON body of ../action requests
+    custom_actions  the custom action configuration and the fallback to the request method
+    labels          the labels of the metrics
+    emit            the metrics of a request as emitted by the middleware. covers the sampler, the cardinality
+                    governor, the aggregation and the prometheus registry if enabled by an --option
+
+the body_peek, custom_actions, labels and emit stages call the methods used by the middleware. the lexing, regex and
+parts stages follow the generic strategy step by step.
+
+each value is the best of several rounds alternating between the services. compare fails if a value of the current
+run exceeds its baseline by more than the threshold and a minimal absolute difference hiding the noise of tiny values.
+durations depend on the machine. compare runs of the same quiet machine and regenerate the baseline when it changes.
+
+usage: PYTHONPATH=. python benchmarks/suite.py run [--output results.json] [--service nova ..] [--rounds 20] [--repeat 10]
+                                                 [--option prometheus_enabled=true ..]
+       PYTHONPATH=. python benchmarks/suite.py compare <baseline.json> <results.json> [--threshold 0.25]
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import warnings
+
+from webob import Request
+
+from benchmarks import fake
+from watcher import cadf_strategy as strategies
+from watcher import common
+from watcher.watcher import OpenStackWatcherMiddleware
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+ETC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'etc')
+
+UUID = 'b206a1900310484f8a9504754c84b067'
+PROJECT_ID = '4c3b2a1d0e9f8a7b6c5d4e3f2a1b0c9d'
+
+# config -> service type, path prefix of the generated requests or None, service specific requests
+# (method, path, JSON body)
+SERVICES = {
+    'barbican': ('key-manager', '/v1', [
+        ('GET', '/v1/containers/{0}/consumers'.format(UUID), None),
+        ('POST', '/v1/secrets', {'name': 'secret', 'payload': 'payload'}),
+    ]),
+    'cinder': ('volume', '/v3/{0}'.format(PROJECT_ID), [
+        ('POST', '/v3/{0}/volumes/{1}/action'.format(PROJECT_ID, UUID), {'os-extend': {'new_size': 3}}),
+        ('POST', '/v3/{0}/volumes/{1}/action'.format(PROJECT_ID, UUID), {'os-attach': {'mountpoint': '/dev/vdb'}}),
+        ('GET', '/v3/{0}/volumes/detail'.format(PROJECT_ID), None),
+    ]),
+    'designate': ('dns', '/v2', [
+        ('GET', '/v2/reverse/floatingips/RegionOne:{0}'.format(UUID), None),
+        ('GET', '/v2/zones/{0}/recordsets/{0}'.format(UUID), None),
+    ]),
+    'glance': ('image', '/v2', [
+        ('PUT', '/v2/images/{0}/file'.format(UUID), None),
+        ('GET', '/v2/images/{0}/members/{1}'.format(UUID, PROJECT_ID), None),
+    ]),
+    'ironic': ('baremetal', '/v1', [
+        ('GET', '/v1/chassis/{0}'.format(UUID), None),
+        ('PUT', '/v1/nodes/{0}/states/provision'.format(UUID), {'target': 'active'}),
+    ]),
+    'keystone': ('identity', '/v3', [
+        ('POST', '/v3/auth/tokens', {'auth': {'identity': {'methods': ['password'], 'password': {
+            'user': {'id': UUID, 'password': 'secret'}}}, 'scope': {'project': {'id': PROJECT_ID}}}}),
+        ('GET', '/v3/auth/tokens/OS-PKI/revoked', None),
+        ('GET', '/v3/domains/{0}/config/ldap/url'.format(UUID), None),
+        ('GET', '/v3/domains/config/ldap/default', None),
+    ]),
+    'manila': ('share', '/v2/{0}'.format(PROJECT_ID), [
+        ('POST', '/v2/{0}/shares/{1}/action'.format(PROJECT_ID, UUID), {'extend': {'new_size': 2}}),
+        ('GET', '/v2/{0}/shares/detail'.format(PROJECT_ID), None),
+    ]),
+    'neutron': ('network', '/v2.0', [
+        ('GET', '/v2.0/networks/{0}/tags'.format(UUID), None),
+        ('PUT', '/v2.0/ports/{0}/tags/red'.format(UUID), None),
+        ('PUT', '/v2.0/routers/{0}/add_router_interface'.format(UUID), {'subnet_id': UUID}),
+    ]),
+    'nova': ('compute', '/v2.1', [
+        ('POST', '/v2.1/servers/{0}/action'.format(UUID), {'os-start': None}),
+        ('POST', '/v2.1/servers/{0}/action'.format(UUID), {'addFloatingIp': {'address': '10.0.0.1'}}),
+        ('GET', '/v2.1/servers/detail', None),
+        ('GET', '/v2.1', None),
+    ]),
+    'swift': ('object-store', None, [
+        ('GET', '/v1/AUTH_{0}'.format(PROJECT_ID), None),
+        ('POST', '/v1/AUTH_{0}'.format(PROJECT_ID), None),
+        ('GET', '/v1/AUTH_{0}/container'.format(PROJECT_ID), None),
+        ('PUT', '/v1/AUTH_{0}/container/object'.format(PROJECT_ID), None),
+        ('POST', '/v1/AUTH_{0}/container/path/to/object'.format(PROJECT_ID), None),
+        ('GET', '/info', None),
+    ]),
+}
+
+STAGES = ['lexing', 'regex', 'parts', 'body_peek', 'custom_actions', 'labels', 'emit']
+
+# minimal absolute regression per unit, hiding the noise of tiny values
+NOISE_FLOORS = {'_us': 0.5, '_ms': 2.0, '_bytes': 1024}
+
+
+def build_requests(name, config):
+    """
+    :param name: name of the configuration in etc/
+    :param config: the loaded configuration
+    :return: list of (method, path, JSON body)
+    """
+    _, prefix, specific = SERVICES[name]
+    requests = []
+    if prefix is not None:
+        for keyword in config.get('path_keywords') or []:
+            if isinstance(keyword, dict):
+                keyword = list(keyword.keys())[0]
+            path = '{0}/{1}'.format(prefix, keyword)
+            requests.append(('GET', path, None))
+            requests.append(('GET', '{0}/{1}'.format(path, UUID), None))
+            requests.append(('PUT', '{0}/{1}'.format(path, UUID), None))
+            requests.append(('DELETE', '{0}/{1}'.format(path, UUID), None))
+    return requests + specific
+
+
+def create_request(method, path, body):
+    headers = {'X-Project-Id': PROJECT_ID, 'X-Domain-Id': 'default', 'X-User-Id': UUID}
+    if body is None:
+        return Request.blank(path, method=method, headers=headers)
+    return Request.blank(
+        path, method=method, headers=headers, body=json.dumps(body).encode('utf-8'), content_type='application/json'
+    )
+
+
+def create_middleware(name, options=None):
+    """
+    :param name: name of the configuration in etc/
+    :param options: additional options of the middleware
+    """
+    config = {'service_type': SERVICES[name][0], 'config_file': os.path.join(ETC, name + '.yaml')}
+    config.update(options or {})
+    return OpenStackWatcherMiddleware(fake.FakeApp(), config)
+
+
+def timed(function):
+    """
+    :return: the seconds spent calling the function. like timeit, without garbage collections
+    """
+    is_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        begin = _clock()
+        function()
+        return _clock() - begin
+    finally:
+        if is_enabled:
+            gc.enable()
+
+
+def call(app, req):
+    def start_response(status, headers, exc_info=None):
+        return lambda data: None
+
+    result = app(req.environ, start_response)
+    for _ in result:
+        pass
+    if hasattr(result, 'close'):
+        result.close()
+
+
+class Classified(object):
+    """
+    a request and the inputs of every stage as determined by the middleware
+    """
+    def __init__(self, middleware, method, path, body):
+        strategy = middleware.strategy
+        self.req = create_request(method, path, body)
+        # the middleware sets the CADF attributes of the request in the environment
+        call(middleware, self.req)
+        self.environ = self.req.environ
+        self.method = method
+        self.path = self.req.path.lstrip('/').rstrip('/')
+        self.parts = self.path.split('/')
+        # the root and versions are classified while lexing
+        self.is_lexed = self.path == '' or common.endswith_version(self.path)
+        self.by_regex = None
+        if not self.is_lexed and strategy.regex_mapping:
+            self.by_regex = strategy._determine_target_type_uri_by_regex(self.path)
+        self.os_action = strategy.determine_os_action(self.req)
+        self.target_type_uri = self.environ['WATCHER.TARGET_TYPE_URI']
+
+
+class ServiceBenchmark(object):
+    """
+    the requests, middleware and stages of a service configuration
+    """
+    def __init__(self, name, repeat, options=None):
+        """
+        :param name: name of the configuration in etc/
+        :param repeat: passes over the requests per sample
+        :param options: additional options of the middleware
+        """
+        self.name = name
+        self.repeat = repeat
+        self.options = options
+        self.middleware = create_middleware(name, options)
+        self.strategy = self.middleware.strategy
+        self.specs = build_requests(name, self.middleware.watcher_config)
+        self.classified = [Classified(self.middleware, *spec) for spec in self.specs]
+        self.all_labels = [self.get_labels(r) for r in self.classified]
+        # a strategy parsing the path itself, e.g. swift, neither uses regex nor parts
+        self.is_generic = \
+            type(self.strategy).determine_target_type_uri is strategies.BaseCADFStrategy.determine_target_type_uri
+        self.stages = {
+            'lexing': self.lexing, 'regex': self.regex, 'parts': self.parts, 'body_peek': self.body_peek,
+            'custom_actions': self.custom_actions, 'labels': self.labels, 'emit': self.emit
+        }
+
+    def null(self):
+        for _ in range(self.repeat):
+            for r in self.classified:
+                pass
+
+    def lexing(self):
+        for _ in range(self.repeat):
+            for r in self.classified:
+                if self.is_generic:
+                    path = r.req.path.lstrip('/').rstrip('/')
+                    common.endswith_version(path)
+                    path.split('/')
+                else:
+                    self.strategy.determine_target_type_uri(r.req)
+
+    def regex(self):
+        if not self.is_generic or not self.strategy.regex_mapping:
+            return
+        for _ in range(self.repeat):
+            for r in self.classified:
+                if not r.is_lexed:
+                    self.strategy._determine_target_type_uri_by_regex(r.path)
+
+    def parts(self):
+        if not self.is_generic:
+            return
+        for _ in range(self.repeat):
+            for r in self.classified:
+                if not r.is_lexed and r.by_regex is None:
+                    target_type_uri = self.strategy._determine_target_type_uri_by_parts(r.parts)
+                    if not common.is_none_or_unknown(target_type_uri):
+                        self.strategy._add_prefix_target_type_uri(target_type_uri)
+
+    def body_peek(self):
+        for _ in range(self.repeat):
+            for r in self.classified:
+                self.strategy.determine_os_action(r.req)
+
+    def custom_actions(self):
+        for _ in range(self.repeat):
+            for r in self.classified:
+                self.strategy._cadf_action_from_os_action(r.target_type_uri, r.method, r.os_action)
+
+    def get_labels(self, r, status_code='200'):
+        labels, detail_labels = self.middleware.get_labels(r.environ)
+        labels.append("status:{0}".format(status_code))
+        detail_labels.append("status:{0}".format(status_code))
+        return labels, detail_labels
+
+    def labels(self):
+        for _ in range(self.repeat):
+            for r in self.classified:
+                self.get_labels(r)
+
+    def emit(self):
+        middleware = self.middleware
+        client = middleware.metric_client
+        for _ in range(self.repeat):
+            for r, (labels, detail_labels) in zip(self.classified, self.all_labels):
+                client.open_buffer()
+                middleware.emit_request_metrics(r.environ, labels, detail_labels, 0.042, None)
+                client.close_buffer()
+
+    def sample(self):
+        """
+        measure every metric once
+
+        :return: dict of the metrics
+        """
+        count = float(len(self.specs) * self.repeat)
+        null = timed(self.null)
+        metrics = {}
+        for stage in STAGES:
+            metrics[stage + '_us'] = max(0.0, 1e6 * (timed(self.stages[stage]) - null) / count)
+
+        # fresh requests, the middleware adds to the environment
+        elapsed = {}
+        for app in (self.middleware, self.middleware.app):
+            reqs = [create_request(*spec) for _ in range(self.repeat) for spec in self.specs]
+            elapsed[app] = timed(lambda: [call(app, req) for req in reqs])
+        metrics['overhead_us'] = max(0.0, 1e6 * (elapsed[self.middleware] - elapsed[self.middleware.app]) / count)
+
+        begin = _clock()
+        middleware = create_middleware(self.name, self.options)
+        metrics['startup_ms'] = 1000 * (_clock() - begin)
+        middleware.metric_client.close_socket()
+        return metrics
+
+    def allocations(self):
+        """
+        :return: dict of the mean bytes traced per request at the peak and still referenced afterwards, e.g. by the
+                 environment, or an empty dict if tracemalloc is unavailable
+        """
+        if tracemalloc is None:
+            return {}
+        peak = retained = 0
+        for spec in self.specs:
+            req = create_request(*spec)
+            tracemalloc.start()
+            call(self.middleware, req)
+            current, request_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            peak += request_peak
+            retained += current
+        return {
+            'alloc_peak_bytes': peak / float(len(self.specs)), 'alloc_retained_bytes': retained / float(len(self.specs))
+        }
+
+    def close(self):
+        self.middleware.metric_client.close_socket()
+
+
+def command_run(args):
+    warnings.simplefilter('ignore')
+    logging.disable(logging.CRITICAL)
+    configs = sorted(name[:-len('.yaml')] for name in os.listdir(ETC) if name.endswith('.yaml'))
+    unknown = [name for name in configs if name not in SERVICES]
+    if unknown:
+        print('no requests defined for the configurations {0}. add them to SERVICES'.format(', '.join(unknown)))
+        return 1
+    options = dict(args.option or [])
+    benchmarks = [ServiceBenchmark(name, args.repeat, options) for name in args.service or configs]
+
+    # the rounds alternate between the services, so a slow phase of the machine doesn't skew a single service
+    best = dict((benchmark.name, {}) for benchmark in benchmarks)
+    for _ in range(args.rounds):
+        for benchmark in benchmarks:
+            for metric, value in benchmark.sample().items():
+                best[benchmark.name][metric] = min(value, best[benchmark.name].get(metric, value))
+
+    results = {
+        'python': platform.python_version(), 'rounds': args.rounds, 'repeat': args.repeat, 'options': options,
+        'services': {}
+    }
+    print('{0:<10} {1:>8} {2:>10} {3} {4:>12} {5:>10}'.format(
+        'service', 'requests', 'startup ms', ' '.join('{0:>9}'.format(stage[:9]) for stage in STAGES), 'overhead us',
+        'peak KiB'
+    ))
+    for benchmark in benchmarks:
+        metrics = best[benchmark.name]
+        metrics.update(benchmark.allocations())
+        benchmark.close()
+        results['services'][benchmark.name] = {
+            'service_type': SERVICES[benchmark.name][0], 'requests': len(benchmark.specs),
+            'metrics': dict((metric, round(value, 3)) for metric, value in metrics.items())
+        }
+        print('{0:<10} {1:>8} {2:>10.2f} {3} {4:>12.2f} {5:>10.1f}'.format(
+            benchmark.name, len(benchmark.specs), metrics['startup_ms'],
+            ' '.join('{0:>9.2f}'.format(metrics[stage + '_us']) for stage in STAGES), metrics['overhead_us'],
+            metrics.get('alloc_peak_bytes', 0) / 1024.0
+        ))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+    return 0
+
+
+def find_regressions(baseline, current, threshold):
+    """
+    :param baseline: the results of the baseline
+    :param current: the results of the current run
+    :param threshold: the relative increase considered a regression, e.g. 0.25
+    :return: list of (service, metric, baseline value, current value, whether regressed)
+    """
+    rows = []
+    for name, service in sorted(baseline['services'].items()):
+        metrics = current['services'].get(name, {}).get('metrics', {})
+        for metric, before in sorted(service['metrics'].items()):
+            after = metrics.get(metric)
+            if after is None:
+                continue
+            floor = [value for suffix, value in NOISE_FLOORS.items() if metric.endswith(suffix)]
+            regressed = after > before * (1 + threshold) and after - before > (floor[0] if floor else 0)
+            rows.append((name, metric, before, after, regressed))
+    return rows
+
+
+def command_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    rows = find_regressions(baseline, current, args.threshold)
+    print('{0:<10} {1:<22} {2:>12} {3:>12} {4:>8}'.format('service', 'metric', 'baseline', 'current', 'change'))
+    for name, metric, before, after, regressed in rows:
+        change = '{0:+.0%}'.format(after / before - 1) if before else 'n/a'
+        print('{0:<10} {1:<22} {2:>12.2f} {3:>12.2f} {4:>8}{5}'.format(
+            name, metric, before, after, change, '  REGRESSION' if regressed else ''
+        ))
+    missing = sorted(set(baseline['services']) - set(current['services']))
+    if missing:
+        print('not measured: {0}'.format(', '.join(missing)))
+    regressions = [row for row in rows if row[4]]
+    if regressions:
+        print('{0} metrics regressed by more than {1:.0%}'.format(len(regressions), args.threshold))
+        return 1
+    return 0
+
+
+def parse_option(option):
+    """
+    :param option: an option of the middleware as 'key=value'
+    :return: tuple of key and value
+    """
+    key, sep, value = option.partition('=')
+    if not sep or not key:
+        raise argparse.ArgumentTypeError("invalid option '{0}'. use key=value".format(option))
+    return key, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark the classification of the service configurations')
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='measure and optionally store the results')
+    run_parser.add_argument('--output', help='write the results as JSON, e.g. benchmarks/baseline.json')
+    run_parser.add_argument('--service', action='append', choices=sorted(SERVICES), help='limit to a configuration')
+    run_parser.add_argument('--rounds', type=int, default=20, help='rounds per measurement, the best counts')
+    run_parser.add_argument('--repeat', type=int, default=10, help='passes over the requests per round')
+    run_parser.add_argument(
+        '--option', action='append', type=parse_option, help='additional option of the middleware, e.g. prometheus_enabled=true'
+    )
+    compare_parser = subparsers.add_parser('compare', help='fail if the results regressed against the baseline')
+    compare_parser.add_argument('baseline', help='JSON results of the baseline')
+    compare_parser.add_argument('current', help='JSON results of the current run')
+    compare_parser.add_argument('--threshold', type=float, default=0.25, help='relative increase failing the gate')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        return command_run(args)
+    if args.command == 'compare':
+        return command_compare(args)
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import fcntl
+import json
+import logging
+import os
+
+from . import batching
+from . import events
+
+# the attributes of a request collected by the request thread. the line is formatted by the writer thread
+AccessRecord = collections.namedtuple('AccessRecord', [
+    'time', 'remote_addr', 'method', 'path', 'status', 'duration', 'request_bytes', 'response_bytes', 'request_id',
+    'action', 'target_type_uri', 'target_project_id', 'initiator_project_id', 'initiator_domain_id',
+    'initiator_user_id'
+])
+
+_encode = json.JSONEncoder(ensure_ascii=True).encode
+
+
+def _format_int(value):
+    return str(value) if value is not None else 'null'
+
+
+class AccessLog(object):
+    """
+    writes one JSON line per request with its CADF classification.
+
+    the request thread only queues an AccessRecord. a background thread formats the lines of a batch and appends them
+    with a single write. the constant part of a line, service, action and target type URI, is formatted once per label
+    set. the file is rotated once it exceeds max_bytes. processes sharing the file rotate it under a lock and reopen
+    it once another process or logrotate replaced it.
+    """
+    def __init__(self, path, service_name, max_bytes=100 * 1024 * 1024, backup_count=5, batch_size=500,
+                 flush_interval=1.0, max_queue=10000, max_formats=10000, logger=logging.getLogger(__name__)):
+        """
+        :param path: path of the log file
+        :param service_name: the CADF service name
+        :param max_bytes: size after which the file is rotated. 0 disables the rotation
+        :param backup_count: number of rotated files kept as <path>.1 to <path>.<backup_count>
+        :param batch_size: maximum number of lines per write
+        :param flush_interval: maximum seconds a line is buffered
+        :param max_queue: maximum number of buffered lines. further lines are dropped
+        :param max_formats: maximum number of precompiled formats
+        :param logger: the logger to use
+        """
+        self.path = path
+        self.service_name = service_name
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.max_formats = max_formats
+        self.logger = logger
+        self.rotations = 0
+        self.writer = batching.BatchWriter(
+            'watcher-access-log', self._write, batch_size=batch_size, flush_interval=flush_interval,
+            max_queue=max_queue, logger=logger
+        )
+        # (action, target type URI) -> the constant beginning of a line
+        self._formats = {}
+        self._fd = None
+        self._inode = None
+
+    def log(self, record):
+        """
+        queue the line of a request
+
+        :param record: the AccessRecord
+        :return: whether it was queued
+        """
+        return self.writer.put(record)
+
+    def ensure_started(self):
+        self.writer.ensure_started()
+
+    def stop(self, timeout=None):
+        self.writer.stop(timeout)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def format(self, record):
+        """
+        :param record: the AccessRecord
+        :return: the line
+        """
+        key = (record.action, record.target_type_uri)
+        prefix = self._formats.get(key)
+        if prefix is None:
+            prefix = '{{"service":{0},"action":{1},"target_type_uri":{2},'.format(
+                _encode(self.service_name), _encode(record.action), _encode(record.target_type_uri)
+            )
+            if len(self._formats) < self.max_formats:
+                self._formats[key] = prefix
+        return ''.join((
+            prefix,
+            '"time":"', events.format_event_time(record.time),
+            '","remote_addr":', _encode(record.remote_addr),
+            ',"method":', _encode(record.method),
+            ',"path":', _encode(record.path),
+            ',"status":', _encode(record.status),
+            ',"duration":', '{0:.6f}'.format(record.duration),
+            ',"request_bytes":', _format_int(record.request_bytes),
+            ',"response_bytes":', _format_int(record.response_bytes),
+            ',"request_id":', _encode(record.request_id),
+            ',"target_project_id":', _encode(record.target_project_id),
+            ',"initiator_project_id":', _encode(record.initiator_project_id),
+            ',"initiator_domain_id":', _encode(record.initiator_domain_id),
+            ',"initiator_user_id":', _encode(record.initiator_user_id),
+            '}\n'
+        ))
+
+    def _write(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.format(record))
+            except Exception as e:
+                self.logger.debug("failed to format access log line for {0}: {1}".format(str(record), str(e)))
+        if not lines:
+            return
+        self._ensure_open()
+        os.write(self._fd, ''.join(lines).encode('utf-8'))
+        if self.max_bytes > 0 and os.fstat(self._fd).st_size >= self.max_bytes:
+            self._rotate()
+
+    def _ensure_open(self):
+        """
+        (re)open the file unless it's the one at path
+        """
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            inode = None
+        if self._fd is not None and inode == self._inode:
+            return
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._inode = os.fstat(self._fd).st_ino
+
+    def _rotate(self):
+        lock_fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                stat = None
+            # not rotated by another process meanwhile
+            if stat is not None and stat.st_ino == self._inode and stat.st_size >= self.max_bytes:
+                if self.backup_count > 0:
+                    for index in range(self.backup_count - 1, 0, -1):
+                        source = '{0}.{1}'.format(self.path, index)
+                        if os.path.exists(source):
+                            os.rename(source, '{0}.{1}'.format(self.path, index + 1))
+                    os.rename(self.path, self.path + '.1')
+                else:
+                    os.remove(self.path)
+                self.rotations += 1
+        finally:
+            os.close(lock_fd)
+        self._ensure_open()
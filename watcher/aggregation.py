@@ -0,0 +1,251 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import bisect
+import collections
+import logging
+import math
+import threading
+
+from . import common
+from . import prometheus
+
+MODE_HISTOGRAM = 'histogram'
+MODE_SKETCH = 'sketch'
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+class BucketHistogram(object):
+    """
+    histogram with fixed, upper inclusive buckets
+    """
+    def __init__(self, buckets=prometheus.DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        if other.buckets != self.buckets:
+            raise ValueError("cannot merge histograms with different buckets")
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def cumulative_counts(self):
+        """
+        :return: list of (upper bound, cumulative count) including +Inf
+        """
+        result = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            result.append((bound, cumulative))
+        return result
+
+
+class DDSketch(object):
+    """
+    mergeable quantile sketch with relative error guarantees as described in
+    'DDSketch: A Fast and Fully-Mergeable Quantile Sketch with Relative-Error Guarantees' (Masson et al.)
+
+    values are mapped to logarithmic bins. a quantile estimate is within relative_accuracy of the true value.
+    if more than max_bins are used, the lowest bins are collapsed, which only affects the lowest quantiles.
+    """
+    def __init__(self, relative_accuracy=0.01, max_bins=2048, min_value=1e-9):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+        self.min_value = min_value
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if value <= self.min_value:
+            self.zero_count += 1
+            return
+        index = int(math.ceil(math.log(value) / self._log_gamma))
+        self.bins[index] = self.bins.get(index, 0) + 1
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("cannot merge sketches with different relative accuracy")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def quantile(self, q):
+        """
+        estimate a quantile
+
+        :param q: the quantile between 0 and 1
+        :return: the estimated value or None if the sketch is empty
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                # the value in the middle of the bin (gamma^(i-1), gamma^i] in terms of relative error
+                return 2 * math.pow(self.gamma, index) / (self.gamma + 1)
+        return 2 * math.pow(self.gamma, max(self.bins)) / (self.gamma + 1)
+
+    def _collapse(self):
+        indexes = sorted(self.bins)
+        excess = len(indexes) - self.max_bins
+        target = indexes[excess]
+        for index in indexes[:excess]:
+            self.bins[target] += self.bins.pop(index)
+
+
+class DistributionAggregator(common.PeriodicThread):
+    """
+    aggregates observations per tag set locally and periodically flushes them via statsd,
+    either as histogram bucket counters or as quantile gauges computed from a DDSketch.
+
+    like the prometheus registry, request threads only append to a deque. the flush is done by a background thread
+    every flush_interval seconds and once more when it is stopped.
+    """
+    def __init__(self, metric, mode=MODE_HISTOGRAM, buckets=prometheus.DEFAULT_BUCKETS, relative_accuracy=0.01,
+                 quantiles=DEFAULT_QUANTILES, flush_interval=10, client=None, logger=logging.getLogger(__name__)):
+        """
+        :param metric: the metric name
+        :param mode: 'histogram' or 'sketch'
+        :param buckets: upper bounds of the buckets if mode is 'histogram'
+        :param relative_accuracy: relative accuracy of the sketch if mode is 'sketch'
+        :param quantiles: quantiles emitted if mode is 'sketch'
+        :param flush_interval: seconds between flushes
+        :param client: the statsd client
+        :param logger: the logger to use
+        """
+        if mode not in (MODE_HISTOGRAM, MODE_SKETCH):
+            raise ValueError("unknown aggregation mode: {0}".format(mode))
+        super(DistributionAggregator, self).__init__('watcher-aggregator-{0}'.format(metric), flush_interval, logger)
+        self.metric = metric
+        self.mode = mode
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        self.relative_accuracy = relative_accuracy
+        self.quantiles = tuple(quantiles)
+        self.flush_interval = flush_interval
+        self.client = client
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def observe(self, tags, value):
+        """
+        observe a value
+
+        :param tags: list of tags ['key:value', ..]
+        :param value: the value, usually a duration in seconds
+        """
+        key = tuple(tags)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending.setdefault(key, collections.deque())
+        pending.append(value)
+
+    def pending(self):
+        """
+        :return: number of observations not yet flushed
+        """
+        return sum(len(pending) for pending in list(self._pending.values()))
+
+    def flush(self, client=None):
+        """
+        flush the pending observations
+
+        :param client: the statsd client. defaults to the client of the aggregator
+        :return: number of flushed tag sets
+        """
+        with self._lock:
+            return self._flush(client or self.client)
+
+    def run_once(self):
+        self.flush()
+
+    def stop(self, timeout=None):
+        """
+        stop the flushing thread and flush the pending observations
+        """
+        super(DistributionAggregator, self).stop(timeout)
+        self.flush()
+
+    def collect(self):
+        """
+        fold all pending observations into a new distribution per tag set
+
+        :return: dict of tags (tuple) and BucketHistogram or DDSketch
+        """
+        result = {}
+        for key, pending in list(self._pending.items()):
+            if not pending:
+                # forget tag sets without observations for a whole interval. an observation appended while evicting
+                # is kept. approximate with concurrent requests
+                if self._pending.pop(key, None) is not None and pending:
+                    self._pending.setdefault(key, collections.deque()).extend(pending)
+                continue
+            if self.mode == MODE_SKETCH:
+                distribution = DDSketch(self.relative_accuracy)
+            else:
+                distribution = BucketHistogram(self.buckets)
+            while True:
+                try:
+                    distribution.add(pending.popleft())
+                except IndexError:
+                    break
+            result[key] = distribution
+        return result
+
+    def _flush(self, client):
+        distributions = self.collect()
+        for key, distribution in distributions.items():
+            tags = list(key)
+            try:
+                if self.mode == MODE_SKETCH:
+                    for q in self.quantiles:
+                        client.gauge(self.metric, distribution.quantile(q), tags=tags + ['quantile:{0}'.format(q)])
+                else:
+                    for bound, cumulative in distribution.cumulative_counts():
+                        client.increment(
+                            self.metric + '_bucket', cumulative, tags=tags + ['le:{0}'.format(prometheus.format_value(bound))]
+                        )
+                client.increment(self.metric + '_count', distribution.count, tags=tags)
+                client.increment(self.metric + '_sum', distribution.sum, tags=tags)
+            except Exception as e:
+                self.logger.debug("failed to flush distribution {0} {1}: {2}".format(self.metric, tags, str(e)))
+        return len(distributions)
@@ -0,0 +1,137 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import logging
+import threading
+
+from . import common
+
+# drop new records while the queue is full
+DROP_NEWEST = 'newest'
+# drop the oldest queued records to make room for new ones
+DROP_OLDEST = 'oldest'
+
+
+class BatchWriter(common.PeriodicThread):
+    """
+    background thread handing queued records in batches to a handler.
+
+    the request thread only appends a record to a deque, which is atomic in CPython. the writer thread wakes up
+    every flush_interval seconds or as soon as a full batch is queued, and passes up to batch_size records at a time
+    to the handler. if the handler cannot keep up, the queue is bounded by max_queue and records are dropped
+    according to the drop policy.
+    """
+    def __init__(self, name, handler, batch_size=100, flush_interval=1.0, max_queue=10000, drop_policy=DROP_NEWEST,
+                 tick=None, logger=logging.getLogger(__name__)):
+        """
+        :param name: name of the thread
+        :param handler: callable receiving a list of records
+        :param batch_size: maximum number of records per batch
+        :param flush_interval: maximum seconds a record is queued
+        :param max_queue: maximum number of queued records
+        :param drop_policy: 'newest' or 'oldest'
+        :param tick: optional callable called by the writer thread after every flush, even if nothing was queued
+        :param logger: the logger to use
+        """
+        super(BatchWriter, self).__init__(name, flush_interval, logger)
+        if drop_policy not in (DROP_NEWEST, DROP_OLDEST):
+            raise ValueError("invalid drop policy '{0}'. use '{1}' or '{2}'".format(drop_policy, DROP_NEWEST, DROP_OLDEST))
+        self.handler = handler
+        self.tick = tick
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.drop_policy = drop_policy
+        if drop_policy == DROP_OLDEST:
+            self.queue = collections.deque(maxlen=max_queue)
+        else:
+            self.queue = collections.deque()
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+
+    def put(self, record):
+        """
+        queue a record
+
+        :param record: the record
+        :return: whether the record was queued without dropping one
+        """
+        queue = self.queue
+        length = len(queue)
+        if length >= self.max_queue:
+            # approximate with concurrent requests
+            self.dropped += 1
+            if self.drop_policy == DROP_NEWEST:
+                return False
+            queue.append(record)
+            return False
+        queue.append(record)
+        if length + 1 == self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def flush(self):
+        """
+        hand all queued records to the handler
+
+        :return: number of records handled
+        """
+        handled = 0
+        with self._flush_lock:
+            queue = self.queue
+            while queue:
+                batch = []
+                try:
+                    for _ in range(self.batch_size):
+                        batch.append(queue.popleft())
+                except IndexError:
+                    pass
+                if not batch:
+                    break
+                try:
+                    self.handler(batch)
+                    self.written += len(batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    self.logger.warning("{0} failed to handle {1} records: {2}".format(self.name, len(batch), str(e)))
+                handled += len(batch)
+        return handled
+
+    def run_once(self):
+        self.flush()
+        if self.tick:
+            self.tick()
+
+    def stop(self, timeout=None):
+        """
+        stop the writer thread after handling the queued records
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        super(BatchWriter, self).stop(timeout)
+        self.flush()
+
+    def _run(self):
+        stopped = self._stopped
+        wakeup = self._wakeup
+        while not stopped.is_set():
+            wakeup.wait(self.interval)
+            wakeup.clear()
+            try:
+                self.run_once()
+            except Exception as e:
+                self.logger.debug("{0} failed: {1}".format(self.name, str(e)))
@@ -55,6 +55,8 @@ class BaseCADFStrategy(object):
         self.target_type_uri_prefix = target_type_uri_prefix
         self.logger = logger
         self.regex_mapping = regex_mapping
+        # number of paths mapped per regex if set to a dict by the debug endpoint. approximate with concurrent requests
+        self.regex_hits = None
         self.custom_action_config = custom_action_config
         # prefix to apply to the openstack action found in a json body
         self.cadf_os_action_prefix = 'update/'
@@ -154,23 +156,13 @@ class BaseCADFStrategy(object):
         cadf_action = taxonomy.UNKNOWN
 
         try:
-            # is this an ../action request with a json body, then check the json body for the openstack action
-            if common.is_action_request(req):
-                cadf_action = self._cadf_action_from_body(req.json)
+            cadf_action = self.determine_os_action(req)
 
             # get target type URI from request path if still unknown
             if common.is_none_or_unknown(target_type_uri):
                 target_type_uri = self.determine_target_type_uri(req)
 
-            # lookup action in custom mapping if one exists
-            if self.custom_action_config:
-                custom_cadf_action = self._cadf_action_from_custom_action_config(target_type_uri, req.method, cadf_action)
-                if not common.is_none_or_unknown(custom_cadf_action):
-                    cadf_action = custom_cadf_action
-
-            # if nothing was found, return cadf action based on request method and path
-            if common.is_none_or_unknown(cadf_action):
-                cadf_action = self._cadf_action_from_method_and_target_type_uri(req.method, target_type_uri)
+            cadf_action = self._cadf_action_from_os_action(target_type_uri, req.method, cadf_action)
 
         except Exception as e:
             self.logger.debug("error while determining cadf action: {0}".format(str(e)))
@@ -178,6 +170,40 @@ class BaseCADFStrategy(object):
         finally:
             return cadf_action
 
+    def determine_os_action(self, req):
+        """
+        determine the openstack action of a request
+
+        :param req: the request
+        :return: the openstack action found in the JSON body of an ../action request or unknown
+        """
+        # is this an ../action request with a json body, then check the json body for the openstack action
+        if common.is_action_request(req):
+            return self._cadf_action_from_body(req.json)
+        return taxonomy.UNKNOWN
+
+    def _cadf_action_from_os_action(self, target_type_uri, method, os_action):
+        """
+        determine the CADF action from the custom action configuration, the openstack action and the request method
+
+        :param target_type_uri: the target type URI
+        :param method: the request method
+        :param os_action: the openstack action or unknown
+        :return: the CADF action or unknown
+        """
+        cadf_action = os_action
+
+        # lookup action in custom mapping if one exists
+        if self.custom_action_config:
+            custom_cadf_action = self._cadf_action_from_custom_action_config(target_type_uri, method, cadf_action)
+            if not common.is_none_or_unknown(custom_cadf_action):
+                cadf_action = custom_cadf_action
+
+        # if nothing was found, return cadf action based on request method and path
+        if common.is_none_or_unknown(cadf_action):
+            cadf_action = self._cadf_action_from_method_and_target_type_uri(method, target_type_uri)
+        return cadf_action
+
     def _cadf_action_from_method_and_target_type_uri(self, method, path):
         """
         determines action based on request method and path
@@ -323,6 +349,8 @@ class BaseCADFStrategy(object):
                 )
                 # return if something was replaced
                 if path != new_path:
+                    if self.regex_hits is not None:
+                        self.regex_hits[regex] = self.regex_hits.get(regex, 0) + 1
                     return new_path
 
             except Exception as e:
@@ -538,15 +566,7 @@ class SwiftCADFStrategy(BaseCADFStrategy):
             if common.is_none_or_unknown(target_type_uri):
                 target_type_uri = self.determine_target_type_uri(req)
 
-            # lookup action in custom mapping if one exists
-            if self.custom_action_config:
-                custom_cadf_action = self._cadf_action_from_custom_action_config(target_type_uri, req.method, cadf_action)
-                if not common.is_none_or_unknown(custom_cadf_action):
-                    cadf_action = custom_cadf_action
-
-            # if nothing was found, return cadf action based on request method and path
-            if common.is_none_or_unknown(cadf_action):
-                cadf_action = self._cadf_action_from_method_and_target_type_uri(req.method, target_type_uri)
+            cadf_action = self._cadf_action_from_os_action(target_type_uri, req.method, cadf_action)
 
         except Exception as e:
             self.logger.debug("error while determining cadf action: {0}".format(str(e)))
@@ -554,6 +574,15 @@ class SwiftCADFStrategy(BaseCADFStrategy):
         finally:
             return cadf_action
 
+    def determine_os_action(self, req):
+        """
+        swift has no ../action requests
+
+        :param req: the request
+        :return: unknown
+        """
+        return taxonomy.UNKNOWN
+
     def get_swift_account_container_object_id_from_path(self, path):
         path_regex = re.compile(
             r'/\S+AUTH_(?P<account_id>\S*?)(\/+?|$)'
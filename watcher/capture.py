@@ -0,0 +1,256 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import base64
+import collections
+import gzip
+import json
+import logging
+import os
+import random
+import time
+import zlib
+
+from six.moves.urllib.parse import unquote_plus
+
+from . import batching
+from . import common
+
+# headers used to classify a request
+DEFAULT_HEADERS = [
+    'X-Project-Id', 'X-Project-Name', 'X-Project-Domain-Id', 'X-Project-Domain-Name', 'X-Domain-Id', 'X-Domain-Name',
+    'X-User-Id', 'X-User-Name', 'X-User-Domain-Id', 'X-User-Domain-Name', 'X-Auth-Token', 'Content-Type'
+]
+DEFAULT_REDACTED_HEADERS = ['X-Auth-Token', 'X-Subject-Token', 'X-Service-Token', 'Authorization', 'Cookie']
+# keys of JSON bodies containing any of these are redacted, e.g. the password of a keystone authentication, the
+# original_password of a password change or the payload of a barbican secret
+REDACTED_BODY_KEYS = (
+    'password', 'adminpass', 'secret', 'token', 'passcode', 'credential', 'blob', 'payload', 'private_key', 'passphrase'
+)
+# query parameters whose values are redacted, e.g. the signature of a swift temporary URL
+DEFAULT_REDACTED_QUERY_PARAMETERS = [
+    'temp_url_sig', 'token', 'auth_token', 'password', 'secret', 'signature', 'X-Amz-Signature', 'X-Amz-Credential',
+    'X-Amz-Security-Token', 'AWSAccessKeyId'
+]
+REDACTED = '***'
+
+# a captured request. the body is the redacted JSON body or None
+CaptureRecord = collections.namedtuple('CaptureRecord', [
+    'time', 'method', 'path', 'query_string', 'headers', 'body', 'body_length', 'status', 'duration', 'action',
+    'target_type_uri'
+])
+
+
+def to_environ_key(header):
+    """
+    :param header: the name of a request header, e.g. X-Project-Id
+    :return: the key of the header in the WSGI environment, e.g. HTTP_X_PROJECT_ID
+    """
+    key = header.upper().replace('-', '_')
+    if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+        return key
+    return 'HTTP_' + key
+
+
+def is_redacted_key(key):
+    """
+    :param key: a key of a JSON body
+    :return: whether its value is sensitive
+    """
+    key = key.lower()
+    return any(part in key for part in REDACTED_BODY_KEYS)
+
+
+def redact(value):
+    """
+    redact the sensitive values of a decoded JSON body
+
+    :param value: the JSON value
+    :return: the value with the sensitive values replaced
+    """
+    if isinstance(value, dict):
+        return dict((key, REDACTED if is_redacted_key(key) else redact(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    return value
+
+
+def redact_query_string(query_string, redacted_parameters):
+    """
+    redact the values of sensitive query parameters
+
+    :param query_string: the query string
+    :param redacted_parameters: set of lower case names of the redacted parameters
+    :return: the query string with the sensitive values replaced
+    """
+    if not query_string:
+        return query_string
+    parameters = []
+    for parameter in query_string.split('&'):
+        name, separator, value = parameter.partition('=')
+        if separator and unquote_plus(name).lower() in redacted_parameters:
+            parameter = name + '=' + REDACTED
+        parameters.append(parameter)
+    return '&'.join(parameters)
+
+
+def read_corpus(path):
+    """
+    read a captured corpus
+
+    :param path: path of the capture file
+    :return: generator of dicts, the body decoded to bytes
+    """
+    with gzip.open(path, 'rb') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line.decode('utf-8'))
+            if record.get('body') is not None:
+                record['body'] = base64.b64decode(record['body'])
+            yield record
+
+
+class Capture(object):
+    """
+    records sampled requests as a corpus to replay.
+
+    sampled requests are limited to max_per_second per process. the request thread only queues a CaptureRecord.
+    a background thread appends every batch as a gzip member to the capture file, which thus is a valid gzip file
+    shared by all processes. capturing stops once the file exceeds max_bytes. only JSON bodies up to max_body_bytes
+    are captured. sensitive headers, query parameters and the values of sensitive keys of the body are redacted.
+    """
+    def __init__(self, path, sample_rate=1.0, max_per_second=10, max_bytes=100 * 1024 * 1024, headers=DEFAULT_HEADERS,
+                 redacted_headers=DEFAULT_REDACTED_HEADERS, redacted_query_parameters=DEFAULT_REDACTED_QUERY_PARAMETERS,
+                 max_body_bytes=4096, batch_size=100, flush_interval=5.0, max_queue=1000,
+                 logger=logging.getLogger(__name__)):
+        """
+        :param path: path of the capture file
+        :param sample_rate: probability a request is captured
+        :param max_per_second: maximum number of captured requests per second and process
+        :param max_bytes: size of the capture file after which capturing stops
+        :param headers: list of captured request headers
+        :param redacted_headers: list of headers whose values are redacted
+        :param redacted_query_parameters: list of query parameters whose values are redacted
+        :param max_body_bytes: maximum size of a captured body
+        :param batch_size: maximum number of records per write
+        :param flush_interval: maximum seconds a record is queued
+        :param max_queue: maximum number of queued records
+        :param logger: the logger to use
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_per_second = max_per_second
+        self.max_bytes = max_bytes
+        redacted = frozenset(header.lower() for header in redacted_headers)
+        # (header, environ key, whether redacted)
+        self.headers = [(header, to_environ_key(header), header.lower() in redacted) for header in headers]
+        self.redacted_query_parameters = frozenset(parameter.lower() for parameter in redacted_query_parameters)
+        self.max_body_bytes = max_body_bytes
+        self.logger = logger
+        self.is_full = False
+        self.writer = batching.BatchWriter(
+            'watcher-capture', self._write, batch_size=batch_size, flush_interval=flush_interval, max_queue=max_queue,
+            logger=logger
+        )
+        self._tokens = float(max_per_second)
+        self._last = time.time()
+
+    def should_capture(self, now):
+        """
+        whether to capture a request. approximate with concurrent requests
+
+        :param now: the current time
+        """
+        if self.is_full or random.random() >= self.sample_rate:
+            return False
+        # token bucket refilled at max_per_second
+        self._tokens = min(float(self.max_per_second), self._tokens + max(0, now - self._last) * self.max_per_second)
+        self._last = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def get_headers(self, environ):
+        """
+        :param environ: the WSGI environment dict
+        :return: dict of the captured headers
+        """
+        headers = {}
+        for header, key, is_redacted in self.headers:
+            value = environ.get(key)
+            if value is not None:
+                headers[header] = REDACTED if is_redacted else value
+        return headers
+
+    def get_query_string(self, environ):
+        """
+        :param environ: the WSGI environment dict
+        :return: the redacted query string or None
+        """
+        return redact_query_string(environ.get('QUERY_STRING'), self.redacted_query_parameters) or None
+
+    def read_body(self, req):
+        """
+        read the JSON body of a request. the body remains readable by the application
+
+        :param req: the webob.Request
+        :return: the redacted body or None
+        """
+        length = common.parse_content_length(req.environ.get('CONTENT_LENGTH'))
+        if not length or length > self.max_body_bytes or not common.is_content_json(req):
+            return None
+        try:
+            body = req.body
+            return json.dumps(redact(json.loads(body.decode('utf-8')))).encode('utf-8')
+        except Exception as e:
+            self.logger.debug("not capturing body of {0} {1}: {2}".format(req.method, req.path, str(e)))
+            return None
+
+    def capture(self, record):
+        """
+        queue a captured request
+
+        :param record: the CaptureRecord
+        """
+        return self.writer.put(record)
+
+    def ensure_started(self):
+        self.writer.ensure_started()
+
+    def stop(self, timeout=None):
+        self.writer.stop(timeout)
+
+    def _write(self, records):
+        if self.is_full:
+            return
+        lines = []
+        for record in records:
+            attributes = record._asdict()
+            if record.body is not None:
+                attributes['body'] = base64.b64encode(record.body).decode('ascii')
+            lines.append(json.dumps(attributes, separators=(',', ':')))
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        data = compressor.compress(('\n'.join(lines) + '\n').encode('utf-8')) + compressor.flush()
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            # a single write per gzip member, so members of concurrent processes don't interleave
+            os.write(fd, data)
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        if size >= self.max_bytes:
+            self.is_full = True
+            self.logger.info("capture file {0} exceeds {1} bytes. stopped capturing".format(self.path, self.max_bytes))
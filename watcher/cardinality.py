@@ -0,0 +1,192 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import heapq
+import threading
+import time
+
+OTHER = 'other'
+
+DEFAULT_LIMITED_LABELS = (
+    'initiator_project_id',
+    'initiator_domain_id',
+    'initiator_user_id',
+    'target_project_id'
+)
+
+
+class SpaceSaving(object):
+    """
+    approximate top-k heavy hitters as described in
+    'Efficient Computation of Frequent and Top-k Elements in Data Streams' (Metwally et al.)
+
+    keeps at most capacity items. an unseen item replaces the item with the lowest count and inherits its count,
+    so counts are overestimated by at most the count of the evicted item. decay() halves the counts, so items
+    no longer seen are eventually replaced by the current heavy hitters.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        # min-heap of (count, item). entries become stale once the count of an item increases
+        self._heap = []
+
+    def add(self, item, count=1):
+        """
+        count an item
+
+        :param item: the item
+        :param count: the increment
+        :return: the estimated count of the item
+        """
+        current = self.counts.get(item)
+        if current is not None:
+            self.counts[item] = current + count
+            return current + count
+
+        base = 0
+        if len(self.counts) >= self.capacity:
+            base = self._evict()
+        self.counts[item] = base + count
+        heapq.heappush(self._heap, (base + count, item))
+        return base + count
+
+    def top(self, n):
+        """
+        :param n: number of items
+        :return: list of the n items with the highest estimated count
+        """
+        return [item for item, _ in sorted(self.counts.items(), key=lambda itm: itm[1], reverse=True)[:n]]
+
+    def decay(self):
+        """
+        halve the counts. items whose count drops to 0 are forgotten
+        """
+        self.counts = dict((item, count // 2) for item, count in self.counts.items() if count // 2 > 0)
+        self._heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def _evict(self):
+        while True:
+            count, item = heapq.heappop(self._heap)
+            current = self.counts.get(item)
+            if current is None:
+                continue
+            if current != count:
+                # stale entry. re-add with the current count
+                heapq.heappush(self._heap, (current, item))
+                continue
+            del self.counts[item]
+            return count
+
+
+class _LabelBudget(object):
+    """
+    admits up to budget distinct values of a label. the admitted values are periodically replaced by the
+    heavy hitters, so the busiest values keep their own series. the counts are halved on every rebalance,
+    so the heavy hitters are those of the recent intervals
+    """
+    def __init__(self, budget, sketch_factor, rebalance_interval):
+        self.budget = budget
+        self.rebalance_interval = rebalance_interval
+        self.sketch = SpaceSaving(budget * sketch_factor)
+        self.admitted = set()
+        self.collapsed = 0
+        self._next_rebalance = time.time() + rebalance_interval
+        self._lock = threading.Lock()
+
+    def admit(self, value, now):
+        """
+        :param value: the label value
+        :param now: the current time
+        :return: whether the value keeps its own series
+        """
+        with self._lock:
+            self.sketch.add(value)
+            if now >= self._next_rebalance:
+                self._next_rebalance = now + self.rebalance_interval
+                self.admitted = set(self.sketch.top(self.budget))
+                self.sketch.decay()
+            if value in self.admitted:
+                return True
+            if len(self.admitted) < self.budget:
+                self.admitted.add(value)
+                return True
+            self.collapsed += 1
+            return False
+
+
+class CardinalityGovernor(object):
+    """
+    limits the number of distinct values of high cardinality labels per metric.
+    values beyond the budget are collapsed into 'other'
+    """
+    def __init__(self, budget, budget_overrides=None, labels=DEFAULT_LIMITED_LABELS, sketch_factor=10,
+                 rebalance_interval=60):
+        """
+        :param budget: default number of distinct values per metric and label. 0 disables the limit
+        :param budget_overrides: dict of metric name and budget
+        :param labels: the labels to limit
+        :param sketch_factor: the heavy hitter sketch tracks budget * sketch_factor values
+        :param rebalance_interval: seconds between replacing admitted values by the heavy hitters
+        """
+        self.budget = budget
+        self.budget_overrides = budget_overrides or {}
+        self.labels = frozenset(labels)
+        self.sketch_factor = sketch_factor
+        self.rebalance_interval = rebalance_interval
+        self._budgets = {}
+
+    def limit(self, metric, tags, now=None):
+        """
+        replace values of limited labels that exceed the budget of the metric by 'other'
+
+        :param metric: the metric name
+        :param tags: list of tags ['key:value', ..]
+        :param now: the current time
+        :return: the new list of tags, list of collapsed labels
+        """
+        budget = self.budget_overrides.get(metric, self.budget)
+        if budget <= 0:
+            return tags, []
+
+        now = now or time.time()
+        result = []
+        collapsed = []
+        for tag in tags:
+            label, _, value = tag.partition(':')
+            if label in self.labels:
+                label_budget = self._get_label_budget(metric, label, budget)
+                if not label_budget.admit(value, now):
+                    tag = '{0}:{1}'.format(label, OTHER)
+                    collapsed.append(label)
+            result.append(tag)
+        return result, collapsed
+
+    def stats(self):
+        """
+        :return: dict of 'metric/label' and number of admitted and collapsed values
+        """
+        return dict(
+            ('{0}/{1}'.format(metric, label), {'admitted': len(b.admitted), 'collapsed': b.collapsed})
+            for (metric, label), b in list(self._budgets.items())
+        )
+
+    def _get_label_budget(self, metric, label, budget):
+        key = (metric, label)
+        label_budget = self._budgets.get(key)
+        if label_budget is None:
+            label_budget = self._budgets.setdefault(
+                key, _LabelBudget(budget, self.sketch_factor, self.rebalance_interval)
+            )
+        return label_budget
@@ -0,0 +1,379 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+compact binary encoding of CADF events for the spool.
+
+a segment is a sequence of records:
+'D' <varint base> <varint count> (<varint length> <utf-8>)*   strings added to the dictionary at index base
+'E' <value>                                                    an event
+'B' <zlib of (<varint length> <record>)*>                      a compressed block of records
+'{' ...                                                        an event as JSON
+
+values are tagged. keys and most strings are indexes into the dictionary, which starts empty with every segment,
+so a segment can be decoded without any other segment.
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import uuid
+import zlib
+
+import six
+
+from . import spool
+
+RECORD_DICTIONARY = ord('D')
+RECORD_EVENT = ord('E')
+RECORD_BLOCK = ord('B')
+RECORD_JSON = ord('{')
+
+TAG_NULL = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STRING_REF = 5
+TAG_STRING = 6
+TAG_UUID = 7
+TAG_DICT = 8
+TAG_LIST = 9
+
+FLOAT = struct.Struct('>d')
+
+# top-level keys of a CADF event whose values are unique per event and thus not added to the dictionary
+DEFAULT_LITERAL_KEYS = frozenset(['id', 'eventTime', 'requestId'])
+
+
+def encode_varint(value, out):
+    """
+    append an unsigned varint to a bytearray
+
+    :param value: non-negative int
+    :param out: the bytearray
+    """
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(buf, offset):
+    """
+    :param buf: bytes or bytearray
+    :param offset: offset of the varint
+    :return: tuple of value and offset after the varint
+    """
+    result = 0
+    shift = 0
+    while True:
+        byte = six.indexbytes(buf, offset)
+        offset += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, offset
+        shift += 7
+
+
+def _is_uuid(value):
+    if len(value) != 36 or value[8] != '-' or value[13] != '-' or value[18] != '-' or value[23] != '-':
+        return False
+    try:
+        return str(uuid.UUID(value)) == value
+    except ValueError:
+        return False
+
+
+class JsonEncoder(object):
+    """
+    encodes events as JSON records
+    """
+    def reset(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def encode(self, events):
+        return [json.dumps(event).encode('utf-8') for event in events]
+
+
+class Encoder(object):
+    """
+    encodes events with a dictionary of strings per segment, varints and optional zlib compression of every batch
+    """
+    def __init__(self, compress=True, compression_level=6, max_dictionary=65536, literal_keys=DEFAULT_LITERAL_KEYS):
+        """
+        :param compress: whether to compress every batch into a block
+        :param compression_level: the zlib compression level
+        :param max_dictionary: maximum number of strings in the dictionary of a segment
+        :param literal_keys: top-level keys whose string values are never added to the dictionary
+        """
+        self.compress = compress
+        self.compression_level = compression_level
+        self.max_dictionary = max_dictionary
+        self.literal_keys = literal_keys
+        self._strings = {}
+        self._size_before_batch = 0
+
+    def reset(self):
+        """
+        start a new dictionary. called whenever a new segment is started
+        """
+        self._strings = {}
+        self._size_before_batch = 0
+
+    def rollback(self):
+        """
+        forget the strings added by the last batch, which was not written
+        """
+        if len(self._strings) > self._size_before_batch:
+            self._strings = dict((s, i) for s, i in self._strings.items() if i < self._size_before_batch)
+
+    def encode(self, events):
+        """
+        encode a batch of events
+
+        :param events: list of events (dicts)
+        :return: list of records
+        """
+        base = self._size_before_batch = len(self._strings)
+        new_strings = []
+        records = []
+        for event in events:
+            out = bytearray([RECORD_EVENT])
+            self._encode_event(event, out, new_strings)
+            records.append(bytes(out))
+
+        if new_strings:
+            out = bytearray([RECORD_DICTIONARY])
+            encode_varint(base, out)
+            encode_varint(len(new_strings), out)
+            for string in new_strings:
+                data = string.encode('utf-8')
+                encode_varint(len(data), out)
+                out.extend(data)
+            records.insert(0, bytes(out))
+
+        if not self.compress:
+            return records
+        block = bytearray()
+        for record in records:
+            encode_varint(len(record), block)
+            block.extend(record)
+        return [bytes(bytearray([RECORD_BLOCK])) + zlib.compress(bytes(block), self.compression_level)]
+
+    def _encode_event(self, event, out, new_strings):
+        out.append(TAG_DICT)
+        encode_varint(len(event), out)
+        for key, value in event.items():
+            self._encode_string_ref(key, out, new_strings)
+            if key in self.literal_keys and isinstance(value, six.string_types):
+                self._encode_literal(value, out)
+            else:
+                self._encode_value(value, out, new_strings)
+
+    def _encode_value(self, value, out, new_strings):
+        if value is None:
+            out.append(TAG_NULL)
+        elif value is True:
+            out.append(TAG_TRUE)
+        elif value is False:
+            out.append(TAG_FALSE)
+        elif isinstance(value, six.integer_types):
+            out.append(TAG_INT)
+            # zigzag. varints are not limited to 64 bits, so every int is encoded exactly
+            encode_varint((-value << 1) - 1 if value < 0 else value << 1, out)
+        elif isinstance(value, float):
+            out.append(TAG_FLOAT)
+            out.extend(FLOAT.pack(value))
+        elif isinstance(value, six.string_types):
+            self._encode_string_ref(value, out, new_strings)
+        elif isinstance(value, dict):
+            out.append(TAG_DICT)
+            encode_varint(len(value), out)
+            for key, item in value.items():
+                self._encode_string_ref(key, out, new_strings)
+                self._encode_value(item, out, new_strings)
+        elif isinstance(value, (list, tuple)):
+            out.append(TAG_LIST)
+            encode_varint(len(value), out)
+            for item in value:
+                self._encode_value(item, out, new_strings)
+        else:
+            self._encode_string_ref(str(value), out, new_strings)
+
+    def _encode_string_ref(self, value, out, new_strings):
+        index = self._strings.get(value)
+        if index is None:
+            if len(self._strings) >= self.max_dictionary:
+                self._encode_literal(value, out)
+                return
+            index = self._strings[value] = len(self._strings)
+            new_strings.append(value)
+        out.append(TAG_STRING_REF)
+        encode_varint(index, out)
+
+    def _encode_literal(self, value, out):
+        if _is_uuid(value):
+            out.append(TAG_UUID)
+            out.extend(uuid.UUID(value).bytes)
+            return
+        data = value.encode('utf-8')
+        out.append(TAG_STRING)
+        encode_varint(len(data), out)
+        out.extend(data)
+
+
+class Decoder(object):
+    """
+    decodes the records of a segment. a new decoder or reset() is required for every segment
+    """
+    def __init__(self):
+        self._strings = []
+
+    def reset(self):
+        self._strings = []
+
+    def decode(self, record):
+        """
+        decode a record
+
+        :param record: bytes
+        :return: list of events (dicts)
+        """
+        record = bytes(record)
+        if not record:
+            return []
+        kind = six.indexbytes(record, 0)
+        if kind == RECORD_JSON:
+            return [json.loads(record.decode('utf-8'))]
+        if kind == RECORD_EVENT:
+            value, _ = self._decode_value(record, 1)
+            return [value]
+        if kind == RECORD_DICTIONARY:
+            self._decode_dictionary(record)
+            return []
+        if kind == RECORD_BLOCK:
+            block = zlib.decompress(record[1:])
+            events = []
+            offset = 0
+            while offset < len(block):
+                length, offset = decode_varint(block, offset)
+                events.extend(self.decode(block[offset:offset + length]))
+                offset += length
+            return events
+        raise ValueError("unknown record type {0}".format(kind))
+
+    def _decode_dictionary(self, record):
+        base, offset = decode_varint(record, 1)
+        count, offset = decode_varint(record, offset)
+        if base > len(self._strings):
+            raise ValueError("dictionary at index {0} but only {1} strings are known".format(base, len(self._strings)))
+        # a dictionary rolled back by the encoder is overwritten
+        del self._strings[base:]
+        for _ in range(count):
+            length, offset = decode_varint(record, offset)
+            self._strings.append(record[offset:offset + length].decode('utf-8'))
+            offset += length
+
+    def _decode_value(self, buf, offset):
+        tag = six.indexbytes(buf, offset)
+        offset += 1
+        if tag == TAG_STRING_REF:
+            index, offset = decode_varint(buf, offset)
+            return self._strings[index], offset
+        if tag == TAG_DICT:
+            count, offset = decode_varint(buf, offset)
+            result = {}
+            for _ in range(count):
+                key, offset = self._decode_value(buf, offset)
+                result[key], offset = self._decode_value(buf, offset)
+            return result, offset
+        if tag == TAG_STRING:
+            length, offset = decode_varint(buf, offset)
+            return buf[offset:offset + length].decode('utf-8'), offset + length
+        if tag == TAG_UUID:
+            return str(uuid.UUID(bytes=buf[offset:offset + 16])), offset + 16
+        if tag == TAG_INT:
+            value, offset = decode_varint(buf, offset)
+            return (value >> 1) ^ -(value & 1), offset
+        if tag == TAG_FLOAT:
+            return FLOAT.unpack_from(buf, offset)[0], offset + FLOAT.size
+        if tag == TAG_LIST:
+            count, offset = decode_varint(buf, offset)
+            result = []
+            for _ in range(count):
+                value, offset = self._decode_value(buf, offset)
+                result.append(value)
+            return result, offset
+        if tag == TAG_NULL:
+            return None, offset
+        if tag == TAG_TRUE:
+            return True, offset
+        if tag == TAG_FALSE:
+            return False, offset
+        raise ValueError("unknown value tag {0}".format(tag))
+
+
+def decode_segment(path):
+    """
+    decode all events of a segment file
+
+    :param path: path of the segment
+    :return: generator of events (dicts)
+    """
+    decoder = Decoder()
+    with open(path, 'rb') as f:
+        records, corrupt = spool.scan(f.read())
+    for _, record in records:
+        for event in decoder.decode(record):
+            yield event
+    if corrupt:
+        raise ValueError("corrupt record in {0}".format(path))
+
+
+def main(argv=None):
+    """
+    print the events of spool segments as CADF JSON, one per line
+    """
+    parser = argparse.ArgumentParser(description='decode spooled CADF events to JSON lines')
+    parser.add_argument('paths', nargs='+', help='segment files or spool directories')
+    parser.add_argument('--pretty', action='store_true', help='indent the JSON')
+    args = parser.parse_args(argv)
+
+    segments = []
+    for path in args.paths:
+        if not os.path.isdir(path):
+            segments.append(path)
+            continue
+        reader = spool.SpoolReader(path)
+        for writer in reader.writers():
+            segments.extend(reader.segment_path(writer, sequence) for sequence in reader.segments(writer))
+
+    for path in segments:
+        try:
+            for event in decode_segment(path):
+                sys.stdout.write(json.dumps(event, indent=2 if args.pretty else None, sort_keys=True) + '\n')
+        except (IOError, OSError, ValueError) as e:
+            sys.stderr.write("failed to decode {0}: {1}\n".format(path, str(e)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
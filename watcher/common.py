@@ -13,8 +13,11 @@
 # under the License.
 
 import json
+import os
 import re
 import six
+import threading
+import time
 
 from pycadf import cadftaxonomy as taxonomy
 
@@ -46,6 +49,109 @@ SERVICE_TYPE_CADF_PREFIX_MAP = {
 }
 
 
+def _rusage_thread_time():
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+def thread_cpu_time():
+    """
+    get the CPU time consumed by the current thread
+
+    :return: CPU time in seconds or None if not supported by the platform
+    """
+    if _thread_time is None:
+        return None
+    return _thread_time()
+
+
+# time.thread_time requires python 3.7. fall back to getrusage on linux
+_thread_time = getattr(time, 'thread_time', None)
+if _thread_time is None:
+    try:
+        import resource
+        if hasattr(resource, 'RUSAGE_THREAD'):
+            _thread_time = _rusage_thread_time
+    except ImportError:
+        pass
+
+
+class ClosingIterable(object):
+    """
+    wraps the iterable returned by a WSGI application and calls the callback once the server closes it,
+    which is after the last chunk of a streamed response was sent
+    """
+    def __init__(self, iterable, callback, count_bytes=False):
+        """
+        :param iterable: the iterable returned by the application
+        :param callback: callable invoked once closed
+        :param count_bytes: whether to count the bytes yielded in bytes_sent
+        """
+        self.iterable = iterable
+        self.callback = callback
+        self.count_bytes = count_bytes
+        self.bytes_sent = 0
+
+    def __iter__(self):
+        if self.count_bytes:
+            return self._iter_counting()
+        return iter(self.iterable)
+
+    def _iter_counting(self):
+        for chunk in self.iterable:
+            self.bytes_sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            callback, self.callback = self.callback, None
+            if callback:
+                callback()
+
+
+def parse_request_start_header(value):
+    """
+    parse the timestamp a front-end (haproxy, nginx, apache) set when it received a request.
+    supported formats: 't=<timestamp>' or '<timestamp>' in seconds, milliseconds or microseconds since epoch
+
+    :param value: the value of the X-Request-Start or X-Queue-Start header
+    :return: the timestamp in seconds since epoch or None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.startswith('t='):
+        value = value[2:]
+    try:
+        timestamp = float(value)
+    except ValueError:
+        return None
+    # distinguish the units by magnitude
+    if timestamp > 1e14:
+        return timestamp / 1e6
+    if timestamp > 1e11:
+        return timestamp / 1e3
+    return timestamp
+
+
+def parse_content_length(value):
+    """
+    :param value: the value of a Content-Length header
+    :return: the length as int or None if missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        length = int(value)
+    except ValueError:
+        return None
+    return length if length >= 0 else None
+
+
 def is_none_or_unknown(thing):
     """
     check if a thing is None or unknown
@@ -266,3 +372,112 @@ def load_json_dict(json_body):
     if isinstance(json_body, dict):
         return json_body
     return load_json_dict(json_body)
+
+
+def string_to_list(possible_list_string, separator=','):
+    """
+    converts a comma separated string to a list of stripped, non-empty strings
+
+    :param possible_list_string: might be string, unicode or list
+    :param separator: the separator
+    :return: list of strings
+    """
+    if isinstance(possible_list_string, (list, tuple)):
+        return list(possible_list_string)
+    if not possible_list_string:
+        return []
+    return [itm.strip() for itm in str(possible_list_string).split(separator) if itm.strip()]
+
+
+def string_to_dict(possible_dict_string, separator=',', key_value_separator=':'):
+    """
+    converts a string like 'key1:value1,key2:value2' to a dictionary
+
+    :param possible_dict_string: might be string, unicode or dict
+    :param separator: the separator of the items
+    :param key_value_separator: the separator of key and value. the last occurrence is used
+    :return: dict of strings
+    """
+    if isinstance(possible_dict_string, dict):
+        return possible_dict_string
+    result = {}
+    for itm in string_to_list(possible_dict_string, separator):
+        key, _, value = itm.rpartition(key_value_separator)
+        if key.strip():
+            result[key.strip()] = value.strip()
+    return result
+
+
+def get_version():
+    """
+    get the version of the installed package via pbr
+
+    :return: the version or 'unknown'
+    """
+    try:
+        import pbr.version
+        return pbr.version.VersionInfo('watcher-middleware').version_string()
+    except Exception:
+        return taxonomy.UNKNOWN
+
+
+class PeriodicThread(object):
+    """
+    daemon thread calling run_once() every interval seconds.
+    threads don't survive a fork, so ensure_started() is called by every request to start the thread lazily
+    in the process actually serving requests, e.g. the workers of a preloading prefork WSGI server
+    """
+    def __init__(self, name, interval, logger=None):
+        self.name = name
+        self.interval = interval
+        self.logger = logger
+        self._pid = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with _periodic_thread_lock:
+            if self._pid == pid:
+                return
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(target=self._run, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = pid
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if self._thread and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self._pid = None
+
+    def join(self, timeout=None):
+        """
+        wait for the thread of this process to stop
+
+        :param timeout: seconds to wait at most
+        :return: whether the thread is not running
+        """
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return True
+        thread.join(timeout)
+        return not thread.is_alive()
+
+    def run_once(self):
+        raise NotImplementedError
+
+    def _run(self):
+        stopped = self._stopped
+        while not stopped.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                if self.logger:
+                    self.logger.debug("{0} failed: {1}".format(self.name, str(e)))
+
+
+_periodic_thread_lock = threading.Lock()
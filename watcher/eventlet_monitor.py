@@ -0,0 +1,116 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import logging
+import os
+import time
+
+try:
+    import eventlet
+except ImportError:
+    eventlet = None
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class HubLagMonitor(object):
+    """
+    measures the scheduling lag of the eventlet hub.
+
+    a greenthread sleeps for a fixed interval. if it wakes up late, blocking code stalled the hub and thus every
+    concurrent request of the worker. stalls exceeding the threshold are recorded along with the requests in flight
+    """
+    def __init__(self, inflight, metric_client, interval=0.5, threshold=0.1, max_entries=100,
+                 logger=logging.getLogger(__name__)):
+        """
+        :param inflight: the InflightRegistry
+        :param metric_client: the statsd client
+        :param interval: seconds the probe sleeps
+        :param threshold: lag in seconds considered a stall
+        :param max_entries: number of stalls kept
+        :param logger: the logger to use
+        """
+        self.inflight = inflight
+        self.metric_client = metric_client
+        self.interval = interval
+        self.threshold = threshold
+        self.logger = logger
+        self.entries = collections.deque(maxlen=max_entries)
+        self.stalls = 0
+        self.max_lag = 0.0
+        self._pid = None
+        self._greenthread = None
+
+    @staticmethod
+    def is_supported():
+        return eventlet is not None
+
+    def ensure_started(self):
+        """
+        spawn the probe in the current process if not running yet
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        self._pid = pid
+        self._greenthread = eventlet.spawn(self._run)
+
+    def stop(self):
+        if self._greenthread is not None and self._pid == os.getpid():
+            self._greenthread.kill()
+        self._greenthread = None
+        self._pid = None
+
+    def _run(self):
+        while True:
+            start = _clock()
+            eventlet.sleep(self.interval)
+            self.observe(max(0.0, _clock() - start - self.interval))
+
+    def observe(self, lag, now=None):
+        """
+        record the lag of a probe
+
+        :param lag: the lag in seconds
+        :param now: the current time
+        """
+        self.max_lag = max(self.max_lag, lag)
+        try:
+            self.metric_client.timing('eventlet_hub_lag_seconds', 1000 * lag)
+        except Exception as e:
+            self.logger.debug("failed to submit eventlet hub lag: {0}".format(str(e)))
+
+        if lag < self.threshold:
+            return
+
+        self.stalls += 1
+        requests = [
+            {'action': info.action, 'target_type_uri': info.target_type_uri, 'method': info.method, 'path': info.path}
+            for info in self.inflight.snapshot()
+        ]
+        self.entries.append({'time': now or time.time(), 'lag': lag, 'requests': requests})
+        self.logger.warning(
+            "eventlet hub stalled for {0:.3f}s with {1} requests in flight: {2}".format(
+                lag, len(requests), ', '.join('{0} {1}'.format(r['action'], r['target_type_uri']) for r in requests)
+            )
+        )
+        try:
+            for r in requests:
+                self.metric_client.increment(
+                    'eventlet_hub_stalled_requests_total',
+                    tags=['action:{0}'.format(r['action']), 'target_type_uri:{0}'.format(r['target_type_uri'])]
+                )
+        except Exception as e:
+            self.logger.debug("failed to submit eventlet hub stalls: {0}".format(str(e)))
@@ -0,0 +1,344 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import json
+import logging
+import threading
+import time
+
+from pycadf import cadftaxonomy as taxonomy
+from pycadf import event
+from pycadf import host
+from pycadf import reason
+from pycadf import resource
+
+from . import batching
+
+SINK_LOG = 'log'
+SINK_FILE = 'file'
+SINK_SPOOL = 'spool'
+SINK_HTTP = 'http'
+
+# the attributes of a request collected by the request thread. the CADF event is built by the writer thread
+EventRecord = collections.namedtuple('EventRecord', [
+    'time', 'duration', 'method', 'path', 'status', 'action', 'target_type_uri', 'target_project_id',
+    'initiator_project_id', 'initiator_domain_id', 'initiator_user_id', 'initiator_host_address', 'request_id'
+])
+
+
+def format_event_time(timestamp):
+    """
+    format a unix timestamp as CADF event time
+
+    :param timestamp: seconds since epoch
+    :return: the time in the format '%Y-%m-%dT%H:%M:%S.%f+0000'
+    """
+    return '{0}.{1:06d}+0000'.format(
+        time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp)), int(timestamp % 1 * 1000000)
+    )
+
+
+def get_outcome(status):
+    """
+    get the CADF outcome of a request by its status code
+
+    :param status: the status code as string
+    :return: success, failure or unknown
+    """
+    if not status or not status.isdigit():
+        return taxonomy.UNKNOWN
+    if int(status) < 400:
+        return taxonomy.OUTCOME_SUCCESS
+    return taxonomy.OUTCOME_FAILURE
+
+
+def build_event(record, service_name):
+    """
+    build a CADF event from a record
+
+    :param record: the EventRecord
+    :param service_name: the CADF service name used as target name
+    :return: the event as dict
+    """
+    initiator = resource.Resource(
+        typeURI=taxonomy.ACCOUNT_USER,
+        id=record.initiator_user_id,
+        host=host.Host(address=record.initiator_host_address)
+    )
+    initiator.project_id = record.initiator_project_id
+    initiator.domain_id = record.initiator_domain_id
+
+    target = resource.Resource(
+        typeURI=record.target_type_uri or taxonomy.UNKNOWN, id=record.target_project_id, name=service_name
+    )
+    target.project_id = record.target_project_id
+
+    cadf_event = event.Event(
+        eventTime=format_event_time(record.time),
+        action=record.action,
+        outcome=get_outcome(record.status),
+        reason=reason.Reason(reasonType='HTTP', reasonCode=str(record.status)),
+        initiator=initiator,
+        target=target,
+        observer=resource.Resource(id='target')
+    )
+    cadf_event.requestPath = record.path
+    if record.request_id:
+        cadf_event.requestId = record.request_id
+    return cadf_event.as_dict()
+
+
+def build_aggregated_event(aggregate, service_name):
+    """
+    build a CADF event representing identical requests
+
+    :param aggregate: the Aggregate
+    :param service_name: the CADF service name used as target name
+    :return: the event as dict with the number of requests and the time of the first and last request
+    """
+    cadf_event = build_event(aggregate.record._replace(request_id=None), service_name)
+    cadf_event['count'] = aggregate.count
+    cadf_event['firstEventTime'] = cadf_event['eventTime']
+    cadf_event['lastEventTime'] = format_event_time(aggregate.last)
+    return cadf_event
+
+
+# the first record and the number of identical requests of an aggregation window
+Aggregate = collections.namedtuple('Aggregate', ['record', 'count', 'last'])
+
+
+class EventAggregator(object):
+    """
+    collapses the records of identical requests per interval.
+
+    requests with the same initiator, target, action and outcome are counted in a window, which is emitted as one
+    event per tuple every interval seconds. the window holds at most max_keys tuples. if a new tuple doesn't fit,
+    the window is emitted early.
+    """
+    def __init__(self, actions, interval=60, max_keys=10000):
+        """
+        :param actions: list of aggregated actions. an action includes its sub-actions, e.g. read includes read/list
+        :param interval: seconds after which the window is emitted
+        :param max_keys: maximum number of tuples in the window
+        """
+        self.actions = frozenset(actions)
+        self.action_prefixes = tuple(action + '/' for action in actions)
+        self.interval = interval
+        self.max_keys = max_keys
+        self.window = {}
+        self.window_start = None
+        self.overflows = 0
+
+    def matches(self, action):
+        """
+        whether requests with this action are aggregated
+
+        :param action: the CADF action
+        """
+        return action in self.actions or action.startswith(self.action_prefixes)
+
+    def add(self, record, now):
+        """
+        count a record
+
+        :param record: the EventRecord
+        :param now: the current time
+        :return: list of Aggregates emitted early to make room for the record
+        """
+        key = (
+            record.initiator_user_id, record.initiator_project_id, record.initiator_domain_id,
+            record.initiator_host_address, record.target_type_uri, record.target_project_id, record.action,
+            get_outcome(record.status)
+        )
+        window = self.window
+        aggregate = window.get(key)
+        if aggregate is not None:
+            window[key] = Aggregate(aggregate.record, aggregate.count + 1, record.time)
+            return []
+        emitted = []
+        if len(window) >= self.max_keys:
+            self.overflows += 1
+            emitted = self.flush(now, force=True)
+        if self.window_start is None:
+            self.window_start = now
+        self.window[key] = Aggregate(record, 1, record.time)
+        return emitted
+
+    def flush(self, now, force=False):
+        """
+        emit the window once the interval elapsed
+
+        :param now: the current time
+        :param force: whether to emit the window regardless of the interval
+        :return: list of Aggregates
+        """
+        if not self.window or (not force and now - self.window_start < self.interval):
+            return []
+        aggregates = list(self.window.values())
+        self.window = {}
+        self.window_start = None
+        return aggregates
+
+
+class LogSink(object):
+    """
+    writes events as JSON to a logger
+    """
+    def __init__(self, logger=logging.getLogger(__name__)):
+        self.logger = logger
+
+    def write(self, events):
+        for cadf_event in events:
+            self.logger.info(json.dumps(cadf_event))
+
+    def close(self):
+        pass
+
+
+class FileSink(object):
+    """
+    appends events as JSON lines to a file
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, events):
+        data = ''.join(json.dumps(cadf_event) + '\n' for cadf_event in events)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write(data)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class SpoolSink(object):
+    """
+    appends events to a spool. each batch is written with a single write and fsync (group commit)
+    """
+    def __init__(self, spool_writer):
+        """
+        :param spool_writer: the SpoolWriter with an encoder of events, e.g. codec.Encoder or codec.JsonEncoder
+        """
+        self.spool_writer = spool_writer
+
+    def write(self, events):
+        if not self.spool_writer.append(events):
+            raise IOError("spool {0} is full".format(self.spool_writer.path))
+
+    def close(self):
+        self.spool_writer.close()
+
+
+class HttpSink(object):
+    """
+    POSTs every batch of events to a collector. while the collector is slow or down the batches are retried with
+    backoff by the writer thread and new events are dropped according to the drop policy of the EventEmitter
+    """
+    def __init__(self, shipper):
+        """
+        :param shipper: the shipper.HttpShipper
+        """
+        self.shipper = shipper
+
+    def write(self, events):
+        self.shipper.ship(events)
+
+    def close(self):
+        self.shipper.close()
+
+
+class EventEmitter(object):
+    """
+    emits CADF events asynchronously.
+
+    the request thread only queues an EventRecord. building, serializing and writing the events to the sink
+    happens in batches in the background.
+    """
+    def __init__(self, sink, service_name, batch_size=100, flush_interval=1.0, max_queue=10000,
+                 drop_policy=batching.DROP_NEWEST, aggregator=None, logger=logging.getLogger(__name__)):
+        """
+        :param sink: the sink receiving lists of events
+        :param service_name: the CADF service name used as target name
+        :param batch_size: maximum number of events per batch
+        :param flush_interval: maximum seconds an event is queued
+        :param max_queue: maximum number of queued events
+        :param drop_policy: 'newest' or 'oldest'
+        :param aggregator: optional EventAggregator collapsing the events of identical requests
+        :param logger: the logger to use
+        """
+        self.sink = sink
+        self.service_name = service_name
+        self.aggregator = aggregator
+        self.logger = logger
+        self.writer = batching.BatchWriter(
+            'watcher-events', self._handle, batch_size=batch_size, flush_interval=flush_interval,
+            max_queue=max_queue, drop_policy=drop_policy, tick=self._tick if aggregator else None, logger=logger
+        )
+
+    def emit(self, record):
+        """
+        queue the record of a request
+
+        :param record: the EventRecord
+        :return: whether it was queued without dropping an event
+        """
+        return self.writer.put(record)
+
+    def ensure_started(self):
+        self.writer.ensure_started()
+
+    def stop(self, timeout=None):
+        self.writer.stop(timeout)
+        if self.aggregator:
+            self._write_aggregates(self.aggregator.flush(time.time(), force=True))
+        self.sink.close()
+
+    def _handle(self, records):
+        events = []
+        aggregates = []
+        aggregator = self.aggregator
+        now = time.time()
+        for record in records:
+            try:
+                if aggregator and aggregator.matches(record.action):
+                    aggregates.extend(aggregator.add(record, now))
+                    continue
+                events.append(build_event(record, self.service_name))
+            except Exception as e:
+                self.logger.debug("failed to build CADF event for {0}: {1}".format(str(record), str(e)))
+        if events:
+            self.sink.write(events)
+        self._write_aggregates(aggregates)
+
+    def _tick(self):
+        self._write_aggregates(self.aggregator.flush(time.time()))
+
+    def _write_aggregates(self, aggregates):
+        events = []
+        for aggregate in aggregates:
+            try:
+                events.append(build_aggregated_event(aggregate, self.service_name))
+            except Exception as e:
+                self.logger.debug("failed to build CADF event for {0}: {1}".format(str(aggregate), str(e)))
+        if events:
+            self.sink.write(events)
@@ -0,0 +1,134 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import logging
+import re
+
+from . import common
+from . import errors
+
+# emit or skip the CADF event and the detail labels (initiator, target project) of a request
+Decision = collections.namedtuple('Decision', ['events', 'detail_metrics'])
+
+DEFAULT_DECISION = Decision(events=True, detail_metrics=True)
+
+# a compiled rule. conditions are None if not configured
+Rule = collections.namedtuple('Rule', [
+    'actions', 'action_prefixes', 'target_type_uri', 'initiator_project_ids', 'statuses', 'status_classes', 'decision'
+])
+
+
+def _to_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value]
+    return [str(value)]
+
+
+def compile_rule(rule):
+    """
+    compile a rule of the event_filters configuration
+
+    :param rule: dict of conditions (action, target_type_uri, initiator_project_id, status) and decisions
+                 (events, detail_metrics)
+    :return: the Rule
+    :raises ConfigError: if the rule is invalid
+    """
+    if not isinstance(rule, dict):
+        raise errors.ConfigError("event filter must be a mapping: {0}".format(rule))
+    unknown = set(rule.keys()) - {'action', 'target_type_uri', 'initiator_project_id', 'status', 'events',
+                                  'detail_metrics'}
+    if unknown:
+        raise errors.ConfigError("unknown keys {0} in event filter {1}".format(', '.join(sorted(unknown)), rule))
+
+    actions = _to_list(rule.get('action'))
+
+    target_type_uri = None
+    patterns = _to_list(rule.get('target_type_uri'))
+    if patterns:
+        try:
+            # one regex matching the complete target type URI
+            target_type_uri = re.compile('(?:{0})\\Z'.format('|'.join('(?:{0})'.format(p) for p in patterns)))
+        except re.error as e:
+            raise errors.ConfigError("invalid target_type_uri pattern in event filter {0}: {1}".format(rule, str(e)))
+
+    statuses = set()
+    status_classes = set()
+    for status in _to_list(rule.get('status')):
+        status = status.lower()
+        if len(status) == 3 and status[0].isdigit() and status[1:] == 'xx':
+            status_classes.add(status[0])
+        elif len(status) == 3 and status.isdigit():
+            statuses.add(status)
+        else:
+            raise errors.ConfigError("invalid status '{0}' in event filter {1}. use e.g. 404 or 4xx".format(status, rule))
+
+    project_ids = _to_list(rule.get('initiator_project_id'))
+    return Rule(
+        actions=frozenset(actions) if actions else None,
+        action_prefixes=tuple(action + '/' for action in actions),
+        target_type_uri=target_type_uri,
+        initiator_project_ids=frozenset(project_ids) if project_ids else None,
+        statuses=frozenset(statuses) if statuses or status_classes else None,
+        status_classes=frozenset(status_classes),
+        decision=Decision(
+            events=common.string_to_bool(rule.get('events', True)),
+            detail_metrics=common.string_to_bool(rule.get('detail_metrics', True))
+        )
+    )
+
+
+class EventFilter(object):
+    """
+    selects the requests emitting CADF events and detail metrics by an ordered list of rules.
+
+    the conditions of a rule must all match: the action or one of its sub-actions, the target type URI (regex),
+    the initiator project id and the status code or class, e.g. 4xx. the first matching rule decides. requests
+    matching no rule emit both.
+    """
+    def __init__(self, rules, logger=logging.getLogger(__name__)):
+        """
+        :param rules: list of rules (dicts) of the event_filters configuration. invalid rules are skipped
+        :param logger: the logger to use
+        """
+        self.logger = logger
+        self.rules = []
+        for rule in rules or []:
+            try:
+                self.rules.append(compile_rule(rule))
+            except errors.ConfigError as e:
+                self.logger.warning("ignoring event filter: {0}".format(str(e)))
+
+    def match(self, action, target_type_uri, initiator_project_id, status_code):
+        """
+        :param action: the CADF action
+        :param target_type_uri: the CADF target type URI
+        :param initiator_project_id: the project id of the initiator
+        :param status_code: the response status code as string
+        :return: the Decision
+        """
+        for rule in self.rules:
+            if rule.actions is not None and action not in rule.actions and not action.startswith(rule.action_prefixes):
+                continue
+            if rule.initiator_project_ids is not None and initiator_project_id not in rule.initiator_project_ids:
+                continue
+            if rule.statuses is not None and status_code not in rule.statuses and \
+                    status_code[:1] not in rule.status_classes:
+                continue
+            if rule.target_type_uri is not None and not rule.target_type_uri.match(target_type_uri):
+                continue
+            return rule.decision
+        return DEFAULT_DECISION
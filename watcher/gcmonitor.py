@@ -0,0 +1,89 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import gc
+import threading
+import time
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+class GCMonitor(object):
+    """
+    measures garbage collection pauses via gc.callbacks (python >= 3.3).
+
+    a pause stops every thread of the process, so it is added to all requests in flight.
+    the collection itself is attributed to the request whose thread triggered it by allocating.
+    """
+    def __init__(self, inflight, min_generation=0, max_pending=10000):
+        """
+        :param inflight: the InflightRegistry
+        :param min_generation: ignore collections of younger generations
+        :param max_pending: maximum number of pauses kept until drained
+        """
+        self.inflight = inflight
+        self.min_generation = min_generation
+        self.pending = collections.deque(maxlen=max_pending)
+        self.collections = [0, 0, 0]
+        self.pause_seconds = [0.0, 0.0, 0.0]
+        self._start = None
+        self._installed = False
+
+    @staticmethod
+    def is_supported():
+        return hasattr(gc, 'callbacks')
+
+    def install(self):
+        if self.is_supported() and not self._installed:
+            gc.callbacks.append(self._callback)
+            self._installed = True
+
+    def uninstall(self):
+        if self._installed:
+            gc.callbacks.remove(self._callback)
+            self._installed = False
+
+    def drain(self):
+        """
+        :return: list of (generation, pause in seconds) since the last drain
+        """
+        result = []
+        while True:
+            try:
+                result.append(self.pending.popleft())
+            except IndexError:
+                return result
+
+    def _callback(self, phase, info):
+        generation = info.get('generation', 0)
+        if generation < self.min_generation:
+            return
+        if phase == 'start':
+            self._start = _clock()
+            return
+        if self._start is None:
+            return
+        pause = _clock() - self._start
+        self._start = None
+
+        self.collections[generation] += 1
+        self.pause_seconds[generation] += pause
+        self.pending.append((generation, pause))
+
+        ident = threading.current_thread().ident
+        for request_info in self.inflight.snapshot():
+            request_info.gc_pause += pause
+            if request_info.thread_ident == ident:
+                request_info.gc_collections += 1
@@ -0,0 +1,101 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import threading
+import time
+
+from pycadf import cadftaxonomy as taxonomy
+
+
+class RequestInfo(object):
+    """
+    classification of a request currently handled by this process
+    """
+    __slots__ = (
+        'thread_ident', 'start', 'method', 'path', 'action', 'target_type_uri',
+        'initiator_project_id', 'initiator_user_id', 'target_project_id', 'gc_pause', 'gc_collections'
+    )
+
+    def __init__(self, method, path, action=taxonomy.UNKNOWN, target_type_uri=taxonomy.UNKNOWN,
+                 initiator_project_id=taxonomy.UNKNOWN, initiator_user_id=taxonomy.UNKNOWN,
+                 target_project_id=taxonomy.UNKNOWN, start=None):
+        self.thread_ident = threading.current_thread().ident
+        self.start = start or time.time()
+        self.method = method
+        self.path = path
+        self.action = action
+        self.target_type_uri = target_type_uri
+        self.initiator_project_id = initiator_project_id
+        self.initiator_user_id = initiator_user_id
+        self.target_project_id = target_project_id
+        # seconds this request was paused by garbage collections and number of collections it triggered
+        self.gc_pause = 0.0
+        self.gc_collections = 0
+
+    def to_dict(self):
+        return dict((attr, getattr(self, attr)) for attr in self.__slots__)
+
+
+class InflightRegistry(object):
+    """
+    registry of the requests currently handled by this process.
+    registering and unregistering are single dict operations, which are atomic in CPython
+    """
+    def __init__(self):
+        self._requests = {}
+        # ids of the requests in flight per (action, target_type_uri). set.add and set.discard are atomic as well
+        self._by_key = {}
+
+    def register(self, info):
+        """
+        :param info: the RequestInfo
+        :return: the RequestInfo
+        """
+        self._requests[id(info)] = info
+        key = (info.action, info.target_type_uri)
+        ids = self._by_key.get(key)
+        if ids is None:
+            ids = self._by_key.setdefault(key, set())
+        ids.add(id(info))
+        return info
+
+    def unregister(self, info):
+        """
+        :param info: the RequestInfo as returned by register()
+        """
+        self._requests.pop(id(info), None)
+        ids = self._by_key.get((info.action, info.target_type_uri))
+        if ids is not None:
+            ids.discard(id(info))
+
+    def count(self, action, target_type_uri):
+        """
+        :return: number of requests in flight with the given action and target type URI
+        """
+        return len(self._by_key.get((action, target_type_uri), ()))
+
+    def counts(self):
+        """
+        :return: dict of (action, target_type_uri) and number of requests in flight
+        """
+        return dict((key, len(ids)) for key, ids in list(self._by_key.items()))
+
+    def snapshot(self):
+        """
+        :return: list of RequestInfo currently in flight
+        """
+        return list(self._requests.copy().values())
+
+    def __len__(self):
+        return len(self._requests)
@@ -0,0 +1,187 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# key for the allocations of action, target type URI pairs exceeding max_keys
+TRUNCATED = ('truncated', 'truncated')
+
+
+class AllocationSampler(object):
+    """
+    traces the memory allocations of a sampled fraction of requests via tracemalloc (python >= 3.4).
+
+    tracing is started when a sampled request arrives and stopped once the application returned, so tracing never
+    outlives a request whose response is not closed. allocations while a streamed response is iterated are not included.
+    the traced memory still allocated at that point is the net allocation, the maximum traced memory the peak.
+    tracemalloc traces the whole process, so at most one request is traced at a time. the attribution is approximate
+    under concurrency, as allocations of concurrent requests on other threads or greenthreads are included.
+    """
+    def __init__(self, sample_rate=0.01, top_sites=10, max_keys=1000, dump_path=None, dump_interval=60,
+                 logger=logging.getLogger(__name__)):
+        """
+        :param sample_rate: fraction of requests traced
+        :param top_sites: number of allocation sites kept per action and target type URI
+        :param max_keys: maximum number of action, target type URI pairs
+        :param dump_path: file the allocations are written to every dump_interval seconds
+        :param dump_interval: seconds between dumps
+        :param logger: the logger to use
+        """
+        self.sample_rate = sample_rate
+        self.top_sites = top_sites
+        self.max_keys = max_keys
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self.logger = logger
+        self.allocations = {}
+        self.sampled = 0
+        # time spent taking snapshots, to verify the overhead
+        self.snapshot_seconds = 0.0
+        self._tracing_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._last_dump = time.time()
+
+    @staticmethod
+    def is_supported():
+        return tracemalloc is not None
+
+    def start(self):
+        """
+        start tracing if the current request is sampled and no other request is traced
+
+        :return: whether the request is traced
+        """
+        if random.random() >= self.sample_rate:
+            return False
+        if not self._tracing_lock.acquire(False):
+            return False
+        # tracing was started by somebody else, e.g. PYTHONTRACEMALLOC
+        if tracemalloc.is_tracing():
+            self._tracing_lock.release()
+            return False
+        tracemalloc.start()
+        return True
+
+    def stop(self, action, target_type_uri):
+        """
+        stop tracing and record the allocations of the traced request
+
+        :param action: the CADF action of the request
+        :param target_type_uri: the target type URI of the request
+        :return: tuple of peak and net allocations in bytes
+        """
+        start = time.time()
+        try:
+            net, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+            self._tracing_lock.release()
+
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        sites = [
+            ('{0}:{1}'.format(stat.traceback[0].filename, stat.traceback[0].lineno), stat.size)
+            for stat in snapshot.statistics('lineno')[:self.top_sites]
+        ]
+        del snapshot
+        self.snapshot_seconds += time.time() - start
+
+        self.record(action, target_type_uri, peak, net, sites)
+        if self.dump_path and start - self._last_dump >= self.dump_interval:
+            self._last_dump = start
+            try:
+                self.dump(self.dump_path)
+            except (IOError, OSError) as e:
+                self.logger.warning("failed to dump allocations to {0}: {1}".format(self.dump_path, str(e)))
+        return peak, net
+
+    def record(self, action, target_type_uri, peak, net, sites):
+        """
+        aggregate the allocations of a request
+
+        :param action: the CADF action of the request
+        :param target_type_uri: the target type URI of the request
+        :param peak: peak allocations in bytes
+        :param net: allocations in bytes not freed at the end of the request
+        :param sites: list of (allocation site, bytes)
+        """
+        key = (str(action), str(target_type_uri))
+        with self._lock:
+            self.sampled += 1
+            entry = self.allocations.get(key)
+            if entry is None:
+                if len(self.allocations) >= self.max_keys:
+                    key = TRUNCATED
+                entry = self.allocations.setdefault(
+                    key, {'requests': 0, 'peak_max_bytes': 0, 'peak_sum_bytes': 0, 'net_sum_bytes': 0, 'sites': {}}
+                )
+            entry['requests'] += 1
+            entry['peak_max_bytes'] = max(entry['peak_max_bytes'], peak)
+            entry['peak_sum_bytes'] += peak
+            entry['net_sum_bytes'] += net
+            for site, size in sites:
+                entry['sites'][site] = entry['sites'].get(site, 0) + size
+            if len(entry['sites']) > self.top_sites:
+                entry['sites'] = dict(
+                    sorted(entry['sites'].items(), key=lambda item: item[1], reverse=True)[:self.top_sites]
+                )
+
+    def to_list(self, reset=False):
+        """
+        get the aggregated allocations
+
+        :param reset: whether to clear the aggregated allocations
+        :return: list of dicts, one per action and target type URI, ordered by peak allocations
+        """
+        with self._lock:
+            allocations = self.allocations
+            if reset:
+                self.allocations = {}
+            result = []
+            for (action, target_type_uri), entry in allocations.items():
+                result.append({
+                    'action': action,
+                    'target_type_uri': target_type_uri,
+                    'requests': entry['requests'],
+                    'peak_max_bytes': entry['peak_max_bytes'],
+                    'peak_avg_bytes': entry['peak_sum_bytes'] // entry['requests'],
+                    'net_avg_bytes': entry['net_sum_bytes'] // entry['requests'],
+                    'top_sites': [
+                        {'site': site, 'bytes': size}
+                        for site, size in sorted(entry['sites'].items(), key=lambda item: item[1], reverse=True)
+                    ]
+                })
+        return sorted(result, key=lambda entry: entry['peak_max_bytes'], reverse=True)
+
+    def dump(self, path, reset=False):
+        """
+        write the aggregated allocations as JSON to a file
+
+        :param path: the file path
+        :param reset: whether to clear the aggregated allocations
+        """
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_list(reset), f, indent=2)
+        os.rename(tmp_path, path)
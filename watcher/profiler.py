@@ -0,0 +1,132 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+import sys
+import threading
+import time
+
+from . import common
+
+TRUNCATED = '[truncated]'
+
+
+def format_frame(frame):
+    """
+    format a frame for a collapsed stack
+
+    :param frame: the frame
+    :return: 'function (filename:first line of function)'
+    """
+    code = frame.f_code
+    return '{0} ({1}:{2})'.format(code.co_name, code.co_filename, code.co_firstlineno).replace(';', ':')
+
+
+def collapse_stack(frame, max_depth):
+    """
+    collapse the stack of a frame to 'outermost;..;innermost'
+
+    :param frame: the innermost frame
+    :param max_depth: maximum number of frames. the outermost frames are dropped
+    :return: the collapsed stack
+    """
+    frames = []
+    while frame is not None and len(frames) < max_depth:
+        frames.append(format_frame(frame))
+        frame = frame.f_back
+    frames.reverse()
+    return ';'.join(frames)
+
+
+class SamplingProfiler(common.PeriodicThread):
+    """
+    low frequency sampling profiler for the threads handling watched requests.
+
+    every interval the stacks of all threads with a request in flight are sampled and aggregated as collapsed
+    stacks rooted at the request's CADF action and target type URI.
+    the output is compatible with flamegraph.pl and speedscope.
+    only native threads can be sampled. greenthreads of eventlet are invisible to sys._current_frames().
+    """
+    def __init__(self, inflight, interval=0.1, max_depth=64, max_stacks=10000, logger=logging.getLogger(__name__)):
+        """
+        :param inflight: the InflightRegistry
+        :param interval: seconds between samples
+        :param max_depth: maximum number of frames per stack
+        :param max_stacks: maximum number of distinct stacks. further stacks are counted as truncated
+        :param logger: the logger to use
+        """
+        super(SamplingProfiler, self).__init__('watcher-profiler', interval, logger)
+        self.inflight = inflight
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.stacks = {}
+        self.samples = 0
+        # time spent sampling, to verify the overhead
+        self.sampling_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def run_once(self):
+        self.sample()
+
+    def sample(self):
+        """
+        sample the stacks of all threads currently handling a watched request
+        """
+        start = time.time()
+        requests = self.inflight.snapshot()
+        if not requests:
+            return
+        frames = sys._current_frames()
+        own_ident = threading.current_thread().ident
+        with self._lock:
+            for info in requests:
+                if info.thread_ident == own_ident:
+                    continue
+                frame = frames.get(info.thread_ident)
+                if frame is None:
+                    continue
+                stack = '{0};{1};{2}'.format(
+                    str(info.action).replace(';', ':'), str(info.target_type_uri).replace(';', ':'),
+                    collapse_stack(frame, self.max_depth)
+                )
+                if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+                    stack = TRUNCATED
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+                self.samples += 1
+        # drop the references to the frames of other threads
+        del frames
+        self.sampling_seconds += time.time() - start
+
+    def collapsed(self, reset=False):
+        """
+        get the collapsed stacks in the format '<frame>;<frame>;.. <count>' per line
+
+        :param reset: whether to clear the collected stacks
+        :return: the collapsed stacks
+        """
+        with self._lock:
+            stacks = self.stacks
+            if reset:
+                self.stacks = {}
+        return ''.join('{0} {1}\n'.format(stack, count) for stack, count in sorted(stacks.items()))
+
+    def dump(self, path, reset=False):
+        """
+        write the collapsed stacks to a file
+
+        :param path: the file path
+        :param reset: whether to clear the collected stacks
+        """
+        with open(path, 'w') as f:
+            f.write(self.collapsed(reset))
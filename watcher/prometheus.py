@@ -0,0 +1,297 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import bisect
+import collections
+import threading
+import time
+
+CONTENT_TYPE_TEXT = 'text/plain; version=0.0.4; charset=utf-8'
+CONTENT_TYPE_OPENMETRICS = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# number of pending observations after which a request thread attempts to fold them into the series
+DRAIN_THRESHOLD = 256
+
+
+def escape_label_value(value):
+    """
+    escape a label value according to the prometheus exposition format
+
+    :param value: the label value
+    :return: the escaped label value
+    """
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(tags, extra=None):
+    """
+    convert a list of statsd tags ['key:value', ..] to a prometheus label string '{key="value",..}'
+
+    :param tags: list of tags
+    :param extra: optional list of additional (key, value) tuples
+    :return: the label string
+    """
+    pairs = []
+    for tag in tags:
+        key, _, value = tag.partition(':')
+        pairs.append('{0}="{1}"'.format(key, escape_label_value(value)))
+    for key, value in extra or []:
+        pairs.append('{0}="{1}"'.format(key, escape_label_value(value)))
+    if not pairs:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value):
+    """
+    format a sample value
+
+    :param value: int or float
+    :return: the value as string
+    """
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+def render_header(name, documentation, metric_type, openmetrics=False):
+    """
+    render the HELP and TYPE lines of a metric family
+
+    :param name: the metric name
+    :param documentation: the help text
+    :param metric_type: counter, histogram, ..
+    :param openmetrics: whether to render the OpenMetrics format
+    :return: list of lines
+    """
+    family = name
+    if openmetrics and metric_type == 'counter' and family.endswith('_total'):
+        family = family[:-len('_total')]
+    return [
+        '# HELP {0} {1}'.format(family, documentation),
+        '# TYPE {0} {1}'.format(family, metric_type)
+    ]
+
+
+class _Series(object):
+    """
+    a single time series of a metric identified by its tags
+
+    observations are appended to a deque, which is atomic in CPython, and folded into the
+    aggregated state only while holding the metric's lock. the request path never waits for that lock.
+    """
+    __slots__ = ('tags', 'label_string', 'pending', 'lines', 'state')
+
+    def __init__(self, tags, state):
+        self.tags = tags
+        self.label_string = format_labels(tags)
+        self.pending = collections.deque()
+        self.lines = None
+        self.state = state
+
+
+class _Metric(object):
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _get_series(self, tags):
+        key = tuple(tags)
+        series = self._series.get(key)
+        if series is None:
+            # dict.setdefault is atomic. a concurrently created series is discarded
+            series = self._series.setdefault(key, _Series(key, self._initial_state()))
+        return series
+
+    def _record(self, tags, value):
+        series = self._get_series(tags)
+        series.pending.append(value)
+        # fold pending observations opportunistically but never block the request
+        if len(series.pending) > DRAIN_THRESHOLD and self._lock.acquire(False):
+            try:
+                self._drain(series)
+            finally:
+                self._lock.release()
+
+    def _drain(self, series):
+        """
+        fold pending observations into the series state. caller must hold the lock
+
+        :param series: the series
+        :return: whether the state changed
+        """
+        changed = False
+        pending = series.pending
+        while True:
+            try:
+                value = pending.popleft()
+            except IndexError:
+                break
+            self._fold(series.state, value)
+            changed = True
+        if changed:
+            series.lines = None
+        return changed
+
+    def render(self, openmetrics=False):
+        """
+        render the metric family. only series that changed since the last rendering are formatted again
+
+        :param openmetrics: whether to render the OpenMetrics format
+        :return: list of lines
+        """
+        lines = render_header(self.name, self.documentation, self.metric_type, openmetrics)
+        with self._lock:
+            for series in list(self._series.values()):
+                self._drain(series)
+                if series.lines is None or series.lines[0] != openmetrics:
+                    series.lines = (openmetrics, self._render_series(series, openmetrics))
+                lines.extend(series.lines[1])
+        return lines
+
+    def _initial_state(self):
+        raise NotImplementedError
+
+    def _fold(self, state, value):
+        raise NotImplementedError
+
+    def _render_series(self, series, openmetrics):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """
+    monotonic counter
+    """
+    metric_type = 'counter'
+
+    def inc(self, tags, value=1):
+        """
+        increment the counter
+
+        :param tags: list of tags ['key:value', ..]
+        :param value: the increment
+        """
+        self._record(tags, value)
+
+    def _initial_state(self):
+        return [0]
+
+    def _fold(self, state, value):
+        state[0] += value
+
+    def _render_series(self, series, openmetrics):
+        return ['{0}{1} {2}'.format(self.name, series.label_string, format_value(series.state[0]))]
+
+
+class Histogram(_Metric):
+    """
+    histogram with fixed buckets
+    """
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def observe(self, tags, value, exemplar=None):
+        """
+        observe a value
+
+        :param tags: list of tags ['key:value', ..]
+        :param value: the observed value, usually in seconds
+        :param exemplar: optional list of tags identifying the observation, e.g. ['request_id:req-..'].
+                         the latest exemplar per bucket is rendered in the OpenMetrics format
+        """
+        if exemplar:
+            self._record(tags, (value, exemplar, time.time()))
+        else:
+            self._record(tags, value)
+
+    def _initial_state(self):
+        # bucket counts (non-cumulative, last one is +Inf), sum, exemplar per bucket
+        return [[0] * (len(self.buckets) + 1), 0.0, None]
+
+    def _fold(self, state, value):
+        if isinstance(value, tuple):
+            value, exemplar, timestamp = value
+            if state[2] is None:
+                state[2] = [None] * (len(self.buckets) + 1)
+            state[2][bisect.bisect_left(self.buckets, value)] = (format_labels(exemplar), value, timestamp)
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def _render_series(self, series, openmetrics):
+        counts, total, exemplars = series.state
+        lines = []
+        cumulative = 0
+        for index, bound in enumerate(self.buckets + (float('inf'),)):
+            cumulative += counts[index]
+            line = '{0}_bucket{1} {2}'.format(
+                self.name, format_labels(series.tags, [('le', format_value(bound))]), cumulative
+            )
+            if openmetrics and exemplars and exemplars[index]:
+                line += ' # {0} {1} {2:.3f}'.format(
+                    exemplars[index][0], format_value(exemplars[index][1]), exemplars[index][2]
+                )
+            lines.append(line)
+        lines.append('{0}_count{1} {2}'.format(self.name, series.label_string, cumulative))
+        lines.append('{0}_sum{1} {2}'.format(self.name, series.label_string, format_value(total)))
+        return lines
+
+
+class Registry(object):
+    """
+    in-process registry of metrics rendered in the prometheus text or OpenMetrics format
+    """
+    def __init__(self, namespace=None):
+        self.namespace = namespace
+        self._metrics = []
+
+    def _full_name(self, name):
+        if self.namespace:
+            return '{0}_{1}'.format(self.namespace, name)
+        return name
+
+    def counter(self, name, documentation):
+        metric = Counter(self._full_name(name), documentation)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(self._full_name(name), documentation, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, openmetrics=False):
+        """
+        render all metrics
+
+        :param openmetrics: whether to render the OpenMetrics format
+        :return: the exposition as string
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(openmetrics))
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
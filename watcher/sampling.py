@@ -0,0 +1,79 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import itertools
+import time
+
+
+class Sampler(object):
+    """
+    determines the statsd sample rate of a metric.
+
+    the rate is the configured rate of the metric, lowered to the rate of the CADF action if one is configured.
+    in adaptive mode the rate is additionally scaled down once the number of emitted metrics per second
+    exceeds the threshold, so that roughly threshold metrics per second are sent.
+    """
+    def __init__(self, default_rate=1.0, metric_rates=None, action_rates=None,
+                 adaptive_threshold=0, adaptive_min_rate=0.01, window=1.0):
+        """
+        :param default_rate: rate of metrics without a configured rate
+        :param metric_rates: dict of metric name and rate
+        :param action_rates: dict of CADF action and rate
+        :param adaptive_threshold: metrics per second above which rates are lowered. 0 disables adaptive sampling
+        :param adaptive_min_rate: the adaptive factor never lowers a rate below this value
+        :param window: length of the window in seconds the emit rate is measured in
+        """
+        self.default_rate = default_rate
+        self.metric_rates = metric_rates or {}
+        self.action_rates = action_rates or {}
+        self.adaptive_threshold = adaptive_threshold
+        self.adaptive_min_rate = adaptive_min_rate
+        self.window = window
+        self.factor = 1.0
+        # next() on itertools.count is atomic under the GIL
+        self._emits = itertools.count()
+        self._window_start = time.time()
+        self._window_emits = 0
+
+    def rate(self, metric, action=None, now=None):
+        """
+        get the sample rate for an emit of a metric
+
+        :param metric: the metric name
+        :param action: the CADF action of the request
+        :param now: the current time
+        :return: the sample rate between 0 and 1
+        """
+        rate = self.metric_rates.get(metric, self.default_rate)
+        action_rate = self.action_rates.get(action)
+        if action_rate is not None:
+            rate = min(rate, action_rate)
+
+        if self.adaptive_threshold > 0:
+            self._adapt(now or time.time())
+            rate = max(min(rate, self.adaptive_min_rate), rate * self.factor)
+        return rate
+
+    def _adapt(self, now):
+        emits = next(self._emits)
+        elapsed = now - self._window_start
+        if elapsed < self.window:
+            return
+        per_second = (emits - self._window_emits) / elapsed
+        self._window_start = now
+        self._window_emits = emits
+        if per_second > self.adaptive_threshold:
+            self.factor = self.adaptive_threshold / per_second
+        else:
+            self.factor = 1.0
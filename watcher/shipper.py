@@ -0,0 +1,507 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+import collections
+import fcntl
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import threading
+import uuid
+import zlib
+
+from six.moves import http_client
+from six.moves.urllib import parse as urlparse
+
+from . import codec
+from . import common
+from . import spool
+
+CHECKPOINT_FILE = 'checkpoint'
+SHIPPER_LOCK_FILE = 'shipper.lock'
+DEAD_LETTER_FILE = 'dead-letter.jsonl'
+
+
+def backoff_delay(attempt, base, maximum):
+    """
+    exponential backoff with full jitter
+
+    :param attempt: number of the retry starting at 0
+    :param base: delay of the first retry in seconds
+    :param maximum: maximum delay in seconds
+    :return: a random delay between 0 and min(maximum, base * 2 ** attempt)
+    """
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+def gzip_compress(data, compression_level=6):
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class ConnectionPool(object):
+    """
+    pool of keep-alive HTTP connections to a single host
+    """
+    def __init__(self, url, max_size=4, timeout=10):
+        """
+        :param url: the URL requests are sent to
+        :param max_size: maximum number of idle connections
+        :param timeout: socket timeout in seconds
+        """
+        parsed = urlparse.urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            raise ValueError("invalid collector URL '{0}'".format(url))
+        self.url = url
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = (parsed.path or '/') + ('?' + parsed.query if parsed.query else '')
+        self.max_size = max_size
+        self.timeout = timeout
+        self.created = 0
+        if parsed.scheme == 'https':
+            self._connection_class = http_client.HTTPSConnection
+        else:
+            self._connection_class = http_client.HTTPConnection
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+
+    def request(self, method, body=None, headers=None):
+        """
+        send a request over an idle or new connection.
+        a request that could not be sent over a reused connection, which the server might have closed meanwhile, is
+        sent again over a new connection. a request that was sent completely is never sent again, as the server might
+        have processed it already
+
+        :param method: the HTTP method
+        :param body: the request body
+        :param headers: dict of request headers
+        :return: the response, which was read already
+        """
+        while True:
+            connection, is_reused = self._get()
+            try:
+                connection.request(method, self.path, body, headers or {})
+            except (http_client.HTTPException, socket.error):
+                connection.close()
+                if is_reused:
+                    continue
+                raise
+            try:
+                response = connection.getresponse()
+                response.read()
+            except (http_client.HTTPException, socket.error):
+                connection.close()
+                raise
+            if (response.getheader('connection') or '').lower() == 'close':
+                connection.close()
+            else:
+                self._put(connection)
+            return response
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+
+    def _get(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+            self.created += 1
+        return self._connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def _put(self, connection):
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+
+class HttpShipper(object):
+    """
+    POSTs batches of events as JSON array to a collector and retries with jittered exponential backoff
+    """
+    def __init__(self, url, pool_size=4, timeout=10, gzip=True, compression_level=6, max_retries=5,
+                 backoff_base=0.5, backoff_max=30, headers=None, logger=logging.getLogger(__name__)):
+        """
+        :param url: the URL of the collector
+        :param pool_size: maximum number of idle keep-alive connections
+        :param timeout: socket timeout in seconds
+        :param gzip: whether to gzip the batches
+        :param compression_level: the gzip compression level
+        :param max_retries: number of retries of a batch before giving up
+        :param backoff_base: delay of the first retry in seconds
+        :param backoff_max: maximum delay between retries in seconds
+        :param headers: dict of additional request headers, e.g. for authentication
+        :param logger: the logger to use
+        """
+        self.pool = ConnectionPool(url, max_size=pool_size, timeout=timeout)
+        self.gzip = gzip
+        self.compression_level = compression_level
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.headers = headers or {}
+        self.logger = logger
+        self.shipped = 0
+        self.rejected = 0
+        self.retries = 0
+
+    def ship(self, events, stopped=None, idempotency_key=None):
+        """
+        POST a batch of events. batches rejected by the collector with a client error are dropped since sending them
+        again won't help. every attempt carries the same Idempotency-Key header, so the collector can drop a batch it
+        processed already, e.g. if the response was lost
+
+        :param events: list of events (dicts)
+        :param stopped: optional threading.Event aborting the backoff
+        :param idempotency_key: the key of the batch. defaults to a random one
+        :return: whether the collector accepted the batch
+        :raises IOError: if the batch could not be delivered after max_retries
+        """
+        body = json.dumps(events).encode('utf-8')
+        headers = {'Content-Type': 'application/json', 'Idempotency-Key': idempotency_key or uuid.uuid4().hex}
+        if self.gzip:
+            body = gzip_compress(body, self.compression_level)
+            headers['Content-Encoding'] = 'gzip'
+        headers.update(self.headers)
+
+        stopped = stopped or threading.Event()
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                response = self.pool.request('POST', body, headers)
+                if response.status < 300:
+                    self.shipped += len(events)
+                    return True
+                if 400 <= response.status < 500 and response.status not in (408, 429):
+                    self.rejected += len(events)
+                    self.logger.warning("collector {0} rejected {1} events with status {2}".format(
+                        self.pool.url, len(events), response.status
+                    ))
+                    return False
+                error = 'status {0}'.format(response.status)
+                retry_after = response.getheader('retry-after')
+            except (http_client.HTTPException, socket.error) as e:
+                error = str(e)
+
+            if attempt >= self.max_retries or stopped.is_set():
+                raise IOError("failed to ship {0} events to {1}: {2}".format(len(events), self.pool.url, error))
+            delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+            if retry_after and retry_after.isdigit():
+                delay = min(max(delay, float(retry_after)), self.backoff_max)
+            self.logger.debug("retrying to ship {0} events to {1} in {2:.2f}s: {3}".format(
+                len(events), self.pool.url, delay, error
+            ))
+            self.retries += 1
+            attempt += 1
+            stopped.wait(delay)
+
+    def close(self):
+        self.pool.close()
+
+
+class SpoolShipper(common.PeriodicThread):
+    """
+    ships the events of a spool to a collector.
+
+    the acknowledged position of every writer directory is checkpointed in writer-<n>/checkpoint as segment and offset
+    of the next record. batches rejected by the collector are appended to writer-<n>/dead-letter.jsonl before the
+    checkpoint moves past them. segments that were rotated by their writer are removed once shipped. the last segment
+    of a writer is kept, as its sequence number is continued by the next process claiming the directory.
+    only batch_size records are read at a time, so memory stays bounded when the collector is slow. the spool takes up
+    the backlog until its writers start dropping events at cadf_events_spool_max_bytes.
+    among the processes sharing a spool only the one holding the lock of the spool ships.
+    """
+    def __init__(self, reader, shipper, batch_size=500, interval=1.0, fsync=True, metric_client=None,
+                 logger=logging.getLogger(__name__)):
+        """
+        :param reader: the SpoolReader
+        :param shipper: the HttpShipper
+        :param batch_size: maximum number of events per batch
+        :param interval: seconds between checking the spool for new events
+        :param fsync: whether to fsync checkpoints and dead-lettered events
+        :param metric_client: optional statsd client counting dead-lettered events
+        :param logger: the logger to use
+        """
+        super(SpoolShipper, self).__init__('watcher-spool-shipper', interval, logger)
+        self.reader = reader
+        self.shipper = shipper
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.metric_client = metric_client
+        # number of events rejected by the collector and moved to a dead-letter file
+        self.dead_lettered = 0
+        self._host = socket.gethostname()
+        self._spool_path = os.path.abspath(reader.path)
+        self._lock_fd = None
+        self._lock_pid = None
+        # writer -> (sequence, offset, decoder) of the last shipped record
+        self._decoders = {}
+
+    def run_once(self):
+        """
+        ship all events spooled since the last checkpoint
+
+        :return: number of events shipped
+        """
+        if not self.claim():
+            return 0
+        shipped = 0
+        for writer in self.reader.writers():
+            if self._stopped.is_set():
+                break
+            shipped += self.ship_writer(writer)
+        return shipped
+
+    def ship_writer(self, writer):
+        """
+        ship the events of a writer directory since its checkpoint
+
+        :param writer: the writer name
+        :return: number of events shipped
+        """
+        sequence, offset = self.load_checkpoint(writer)
+        segments = self.reader.segments(writer)
+        shipped = 0
+        for index, current in enumerate(segments):
+            if current < sequence:
+                # shipped, but not removed
+                self.reader.remove(writer, current)
+                continue
+            if current > sequence:
+                sequence, offset = current, 0
+            count, offset = self._ship_segment(writer, sequence, offset)
+            shipped += count
+            if index == len(segments) - 1:
+                break
+            # rotated segments are never appended to
+            self.save_checkpoint(writer, sequence + 1, 0)
+            self.reader.remove(writer, sequence)
+            self._decoders.pop(writer, None)
+        return shipped
+
+    def load_checkpoint(self, writer):
+        """
+        :param writer: the writer name
+        :return: tuple of segment sequence number and offset of the next record
+        """
+        try:
+            with open(os.path.join(self.reader.path, writer, CHECKPOINT_FILE)) as f:
+                checkpoint = json.load(f)
+            return int(checkpoint['sequence']), int(checkpoint['offset'])
+        except (IOError, OSError):
+            return 0, 0
+        except (ValueError, KeyError, TypeError) as e:
+            self.logger.warning("ignoring invalid spool checkpoint of {0}: {1}".format(writer, str(e)))
+            return 0, 0
+
+    def save_checkpoint(self, writer, sequence, offset):
+        path = os.path.join(self.reader.path, writer, CHECKPOINT_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'sequence': sequence, 'offset': offset}, f)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.rename(tmp_path, path)
+
+    def stop(self, timeout=None):
+        super(SpoolShipper, self).stop(timeout)
+        self.shipper.close()
+        if self._lock_fd is not None and self._lock_pid == os.getpid():
+            os.close(self._lock_fd)
+        self._lock_fd = None
+        self._lock_pid = None
+
+    def _ship_segment(self, writer, sequence, offset):
+        """
+        :return: tuple of the number of events shipped and the checkpointed offset
+        """
+        decoder = self._get_decoder(writer, sequence, offset)
+        # invalidated until the segment was shipped up to the offset the decoder is at
+        self._decoders.pop(writer, None)
+        shipped = 0
+        checkpoint = offset
+        pending = []
+        while True:
+            records = self.reader.read(writer, sequence, offset, max_records=self.batch_size)
+            for end, payload in records:
+                pending.extend(self._decode(decoder, writer, sequence, payload))
+                offset = end
+                if len(pending) >= self.batch_size:
+                    if self._ship_batch(writer, pending, self._batch_key(writer, sequence, checkpoint, offset)):
+                        shipped += len(pending)
+                    pending = []
+                    self.save_checkpoint(writer, sequence, offset)
+                    checkpoint = offset
+            if len(records) < self.batch_size:
+                break
+        if pending and self._ship_batch(writer, pending, self._batch_key(writer, sequence, checkpoint, offset)):
+            shipped += len(pending)
+        if offset != checkpoint:
+            self.save_checkpoint(writer, sequence, offset)
+        self._decoders[writer] = (sequence, offset, decoder)
+        return shipped, offset
+
+    def _batch_key(self, writer, sequence, start, end):
+        """
+        get the idempotency key of the batch of the records between two offsets of a segment. the key is the same when
+        the batch is shipped again after a failure or a restart, so the collector can drop duplicates
+        """
+        return '{0}:{1}:{2}:{3}:{4}-{5}'.format(self._host, self._spool_path, writer, sequence, start, end)
+
+    def _ship_batch(self, writer, events, key):
+        """
+        ship a batch of events. a batch rejected by the collector is moved to the dead-letter file of the writer, so
+        the checkpoint only moves past events that were either acknowledged or dead-lettered
+
+        :return: whether the collector accepted the batch
+        :raises IOError: if the batch could neither be shipped nor dead-lettered
+        """
+        if self.shipper.ship(events, self._stopped, idempotency_key=key):
+            return True
+        self.dead_letter(writer, events)
+        return False
+
+    def dead_letter(self, writer, events):
+        """
+        append events rejected by the collector to writer-<n>/dead-letter.jsonl, one JSON object per line
+
+        :param writer: the writer name
+        :param events: list of events (dicts)
+        """
+        path = os.path.join(self.reader.path, writer, DEAD_LETTER_FILE)
+        data = b''.join(json.dumps(event, sort_keys=True).encode('utf-8') + b'\n' for event in events)
+        with open(path, 'ab') as f:
+            size = f.tell()
+            try:
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            except (IOError, OSError):
+                # don't leave a partial line behind, the batch is dead-lettered again with the next attempt
+                f.truncate(size)
+                raise
+        self.dead_lettered += len(events)
+        self.logger.warning("moved {0} rejected events to {1}".format(len(events), path))
+        if self.metric_client:
+            try:
+                self.metric_client.increment('cadf_events_dead_lettered_total', len(events))
+            except Exception as e:
+                self.logger.debug("failed to submit dead-lettered events: {0}".format(str(e)))
+
+    def _get_decoder(self, writer, sequence, offset):
+        """
+        get the decoder of a segment at an offset. the dictionary records before the offset are decoded again after
+        a restart or a failure
+        """
+        cached = self._decoders.get(writer)
+        if cached and cached[0] == sequence and cached[1] == offset:
+            return cached[2]
+        decoder = codec.Decoder()
+        position = 0
+        while position < offset:
+            records = self.reader.read(writer, sequence, position, max_records=self.batch_size)
+            if not records:
+                break
+            for end, payload in records:
+                if end > offset:
+                    break
+                self._decode(decoder, writer, sequence, payload)
+                position = end
+            if records[-1][0] > offset:
+                break
+        return decoder
+
+    def _decode(self, decoder, writer, sequence, payload):
+        try:
+            return decoder.decode(payload)
+        except Exception as e:
+            self.logger.warning("skipping undecodable record in {0}/{1}: {2}".format(writer, sequence, str(e)))
+            return []
+
+    def claim(self):
+        """
+        claim the spool for this process. only the process holding the claim ships the spool
+
+        :return: whether this process holds the claim
+        """
+        pid = os.getpid()
+        if self._lock_pid == pid:
+            return True
+        if not os.path.isdir(self.reader.path):
+            return False
+        fd = os.open(os.path.join(self.reader.path, SHIPPER_LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            os.close(fd)
+            return False
+        # a descriptor inherited from the parent process is closed without unlocking as the lock is shared
+        self._lock_fd = fd
+        self._lock_pid = pid
+        self._decoders = {}
+        return True
+
+
+def main(argv=None):
+    """
+    ship the events of a spool to a collector
+    """
+    parser = argparse.ArgumentParser(description='ship spooled CADF events to an HTTP collector')
+    parser.add_argument('path', help='the spool directory')
+    parser.add_argument('url', help='the URL of the collector')
+    parser.add_argument('--batch-size', type=int, default=500, help='maximum number of events per batch')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between checking the spool')
+    parser.add_argument('--no-gzip', action='store_true', help='do not compress the batches')
+    parser.add_argument('--once', action='store_true', help='ship the spooled events and exit')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)-15s %(message)s')
+    shipper = SpoolShipper(
+        spool.SpoolReader(args.path), HttpShipper(args.url, gzip=not args.no_gzip),
+        batch_size=args.batch_size, interval=args.interval
+    )
+    try:
+        if args.once:
+            if not shipper.claim():
+                sys.stderr.write("spool {0} is shipped by another process\n".format(args.path))
+                return 1
+            sys.stdout.write("shipped {0} events\n".format(shipper.run_once()))
+            return 0
+        shipper.ensure_started()
+        # wake up regularly to handle an interrupt
+        while not shipper.join(1):
+            pass
+    except (IOError, OSError) as e:
+        sys.stderr.write("failed to ship events: {0}\n".format(str(e)))
+        return 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shipper.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
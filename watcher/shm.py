@@ -0,0 +1,439 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import bisect
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+
+from . import prometheus
+
+KEYS_FILE = 'keys'
+REGION_PREFIX = 'worker-'
+WORKER_SLOT_PREFIX = 'slot-'
+SLOT_SIZE = struct.calcsize('<d')
+
+
+def claim_file(path, prefix, max_files):
+    """
+    lock the first file <prefix><n> of a directory that is not locked by another process yet.
+    the lock is released by the kernel once the process dies
+
+    :param path: the directory
+    :param prefix: the prefix of the file names
+    :param max_files: maximum number of files
+    :return: tuple of the locked descriptor and n or None if all files are locked
+    """
+    for index in range(max_files):
+        fd = os.open(os.path.join(path, '{0}{1:04d}'.format(prefix, index)), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            os.close(fd)
+            continue
+        return fd, index
+    return None
+
+
+class WorkerSlot(object):
+    """
+    stable index of a process among the worker processes of a prefork WSGI server.
+    a process claims the first free slot-<n> file of the directory, so a restarted or recycled worker takes over the
+    index of the dead one
+    """
+    def __init__(self, path, max_workers=1024):
+        """
+        :param path: the directory, e.g. /dev/shm/openstack-watcher-<service>-workers
+        :param max_workers: maximum number of worker processes
+        """
+        self.path = path
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._index = None
+
+    def index(self):
+        """
+        get the index of this process. claims a slot on first use in a process
+
+        :return: the index
+        :raises IOError: if no slot is free
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return self._index
+        with self._lock:
+            if self._pid != pid:
+                # closing a descriptor inherited from the parent process keeps the lock of the parent intact
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                if not os.path.isdir(self.path):
+                    os.makedirs(self.path)
+                claimed = claim_file(self.path, WORKER_SLOT_PREFIX, self.max_workers)
+                if claimed is None:
+                    raise IOError("no free worker slot in {0}".format(self.path))
+                self._fd, self._index = claimed
+                self._pid = pid
+        return self._index
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None and self._pid == os.getpid():
+                os.close(self._fd)
+            self._fd = None
+            self._pid = None
+            self._index = None
+
+
+class SharedStore(object):
+    """
+    mmap backed store of float counters shared by the processes of a prefork WSGI server
+
+    layout of the directory:
+    (1) keys:         append-only list of keys, one per line. the line number is the slot of the key
+    (2) worker-<n>:   one region per process holding a float per slot.
+                      a process claims a free region by locking it. the lock is released by the kernel
+                      once the process dies, so a restarted worker continues counting in the same region.
+
+    every region has a single writer, thus increments need no locking. the lock of a process is only taken to claim
+    or grow its region. threads of a process incrementing the same key at the same time might lose an increment.
+    readers sum the values of a slot across all regions.
+    """
+    def __init__(self, path, max_slots=65536, initial_slots=1024, max_regions=1024,
+                 logger=logging.getLogger(__name__)):
+        """
+        :param path: the directory. should be on a tmpfs, e.g. /dev/shm/openstack-watcher-<service>
+        :param max_slots: maximum number of distinct keys
+        :param initial_slots: initial number of slots per region
+        :param max_regions: maximum number of regions (processes)
+        :param logger: the logger to use
+        """
+        self.path = path
+        self.max_slots = max_slots
+        self.initial_slots = initial_slots
+        self.max_regions = max_regions
+        self.logger = logger
+        # number of values dropped as the table of keys was full
+        self.dropped = 0
+        # keys are never removed. once the table is full, unknown keys are dropped without reading the keys file
+        self.full = False
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self._keys_path = os.path.join(path, KEYS_FILE)
+        self._slots = {}
+        self._keys = []
+        self._keys_offset = 0
+        self._lock = threading.Lock()
+
+        self._pid = None
+        self._region_fd = None
+        self._region = None
+        self._region_slots = 0
+
+    def add(self, key, value):
+        """
+        add a value to the counter of the given key
+
+        :param key: the key
+        :param value: the value to add
+        """
+        slot = self.slot(key)
+        if slot is None:
+            self.dropped += 1
+            return
+        self.add_to_slot(slot, value)
+
+    def add_to_slot(self, slot, value):
+        """
+        add a value to the counter in the given slot
+
+        :param slot: the slot as returned by slot()
+        :param value: the value to add
+        """
+        # the region has a single writer. the lock is only taken to claim or grow it
+        if slot >= self._region_slots or self._pid != os.getpid():
+            with self._lock:
+                self._ensure_region(slot + 1)
+        region = self._region
+        offset = slot * SLOT_SIZE
+        struct.pack_into('<d', region, offset, struct.unpack_from('<d', region, offset)[0] + value)
+
+    def slot(self, key):
+        """
+        get the slot of a key. registers the key if it's not known yet
+
+        :param key: the key. must not contain line breaks
+        :return: the slot or None if the table is full
+        """
+        slot = self._slots.get(key)
+        if slot is not None or self.full:
+            return slot
+
+        with self._lock:
+            self._refresh_keys()
+            slot = self._slots.get(key)
+            if slot is not None or self.full:
+                return slot
+
+            with open(self._keys_path, 'ab') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    # another process might have registered the key meanwhile
+                    self._refresh_keys()
+                    slot = self._slots.get(key)
+                    if slot is None and len(self._keys) < self.max_slots:
+                        f.write(key.encode('utf-8') + b'\n')
+                        f.flush()
+                        self._refresh_keys()
+                        slot = self._slots.get(key)
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        return slot
+
+    def merged(self):
+        """
+        get the merged view of all regions
+
+        :return: dict of key and value
+        """
+        with self._lock:
+            self._refresh_keys()
+            keys = list(self._keys)
+
+        totals = [0.0] * len(keys)
+        for name in os.listdir(self.path):
+            if not name.startswith(REGION_PREFIX):
+                continue
+            try:
+                with open(os.path.join(self.path, name), 'rb') as f:
+                    size = os.fstat(f.fileno()).st_size
+                    if size < SLOT_SIZE:
+                        continue
+                    region = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        count = min(len(keys), size // SLOT_SIZE)
+                        for slot, value in enumerate(struct.unpack_from('<{0}d'.format(count), region, 0)):
+                            totals[slot] += value
+                    finally:
+                        region.close()
+            except (IOError, OSError, ValueError) as e:
+                self.logger.debug("failed to read shared metric region {0}: {1}".format(name, str(e)))
+        return dict(zip(keys, totals))
+
+    def _refresh_keys(self):
+        """
+        read keys registered by other processes since the last refresh. caller must hold the lock
+        """
+        try:
+            with open(self._keys_path, 'rb') as f:
+                f.seek(self._keys_offset)
+                data = f.read()
+        except (IOError, OSError):
+            return
+        # ignore an incomplete last line
+        end = data.rfind(b'\n')
+        if end < 0:
+            return
+        for line in data[:end].split(b'\n'):
+            key = line.decode('utf-8')
+            self._slots.setdefault(key, len(self._keys))
+            self._keys.append(key)
+        self._keys_offset += end + 1
+        if not self.full and len(self._keys) >= self.max_slots:
+            self.full = True
+            self.logger.warning(
+                "shared metric table in {0} is full with {1} keys. dropping new label sets".format(self.path, self.max_slots)
+            )
+
+    def _ensure_region(self, min_slots):
+        """
+        claim a region for this process and ensure it holds at least min_slots. caller must hold the lock
+
+        :param min_slots: the number of slots required
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            # never write to a region inherited from the parent process (preloading prefork servers)
+            self._claim_region()
+            self._pid = pid
+
+        if min_slots > self._region_slots:
+            slots = max(self._region_slots, self.initial_slots)
+            while slots < min_slots:
+                slots *= 2
+            self._map_region(slots)
+
+    def _claim_region(self):
+        if self._region is not None:
+            self._region.close()
+            self._region = None
+        if self._region_fd is not None:
+            os.close(self._region_fd)
+            self._region_fd = None
+        self._region_slots = 0
+
+        claimed = claim_file(self.path, REGION_PREFIX, self.max_regions)
+        if claimed is None:
+            raise IOError("no free shared metric region in {0}".format(self.path))
+        self._region_fd, index = claimed
+        self.logger.debug("process {0} claimed shared metric region {1}".format(os.getpid(), index))
+
+    def _map_region(self, slots):
+        # regions only grow. a region of a previous process might already be larger
+        size = max(slots * SLOT_SIZE, os.fstat(self._region_fd).st_size)
+        if os.fstat(self._region_fd).st_size < size:
+            os.ftruncate(self._region_fd, size)
+        # the previous mapping is not closed as other threads might still write to it. both map the same file and
+        # the previous one is unmapped once it's no longer referenced
+        self._region = mmap.mmap(self._region_fd, size)
+        self._region_slots = size // SLOT_SIZE
+
+
+class _SharedMetric(object):
+    metric_type = 'untyped'
+
+    def __init__(self, store, name, documentation):
+        self.store = store
+        self.name = name
+        self.documentation = documentation
+        # interned tag sets: tuple(tags) -> slots
+        self._slots = {}
+
+    def _key(self, label_string, part=''):
+        return '{0}\t{1}\t{2}'.format(self.name, label_string, part).replace('\n', ' ')
+
+    def _series(self, merged):
+        """
+        get the label strings and parts of the keys of this metric. label values might contain tabs
+
+        :param merged: the merged view of the store
+        :return: list of (label string, part, value)
+        """
+        prefix = self.name + '\t'
+        series = []
+        for key, value in merged.items():
+            if key.startswith(prefix):
+                label_string, _, part = key[len(prefix):].rpartition('\t')
+                series.append((label_string, part, value))
+        return series
+
+
+class SharedCounter(_SharedMetric):
+    metric_type = 'counter'
+
+    def inc(self, tags, value=1):
+        key = tuple(tags)
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self.store.slot(self._key(prometheus.format_labels(tags)))
+            if slot is None:
+                self.store.dropped += 1
+                return
+            self._slots[key] = slot
+        self.store.add_to_slot(slot, value)
+
+    def render(self, merged, openmetrics=False):
+        lines = prometheus.render_header(self.name, self.documentation, self.metric_type, openmetrics)
+        for label_string, _, value in sorted(self._series(merged)):
+            lines.append('{0}{1} {2}'.format(self.name, label_string, prometheus.format_value(value)))
+        return lines
+
+
+class SharedHistogram(_SharedMetric):
+    metric_type = 'histogram'
+
+    def __init__(self, store, name, documentation, buckets=prometheus.DEFAULT_BUCKETS):
+        super(SharedHistogram, self).__init__(store, name, documentation)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        self.bounds = [prometheus.format_value(b) for b in self.buckets + (float('inf'),)]
+
+    def observe(self, tags, value, exemplar=None):
+        # exemplars are not shared between processes
+        key = tuple(tags)
+        slots = self._slots.get(key)
+        if slots is None:
+            label_string = prometheus.format_labels(tags)
+            slots = [self.store.slot(self._key(label_string, part)) for part in self.bounds + ['sum']]
+            if None in slots:
+                self.store.dropped += 1
+                return
+            self._slots[key] = slots
+        self.store.add_to_slot(slots[bisect.bisect_left(self.buckets, value)], 1)
+        self.store.add_to_slot(slots[-1], value)
+
+    def render(self, merged, openmetrics=False):
+        lines = prometheus.render_header(self.name, self.documentation, self.metric_type, openmetrics)
+        series = {}
+        for label_string, part, value in self._series(merged):
+            series.setdefault(label_string, {})[part] = value
+
+        for label_string in sorted(series):
+            values = series[label_string]
+            labels = label_string[1:-1]
+            cumulative = 0
+            for bound in self.bounds:
+                cumulative += int(values.get(bound, 0))
+                lines.append('{0}_bucket{{{1}le="{2}"}} {3}'.format(
+                    self.name, labels + ',' if labels else '', bound, cumulative
+                ))
+            lines.append('{0}_count{1} {2}'.format(self.name, label_string, cumulative))
+            lines.append('{0}_sum{1} {2}'.format(self.name, label_string, prometheus.format_value(values.get('sum', 0.0))))
+        return lines
+
+
+class SharedRegistry(object):
+    """
+    registry with the interface of prometheus.Registry, whose metrics are aggregated across processes
+    """
+    def __init__(self, path, namespace=None, max_slots=65536, logger=logging.getLogger(__name__)):
+        self.namespace = namespace
+        self.store = SharedStore(path, max_slots=max_slots, logger=logger)
+        self._metrics = []
+
+    def _full_name(self, name):
+        if self.namespace:
+            return '{0}_{1}'.format(self.namespace, name)
+        return name
+
+    def counter(self, name, documentation):
+        metric = SharedCounter(self.store, self._full_name(name), documentation)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, buckets=prometheus.DEFAULT_BUCKETS):
+        metric = SharedHistogram(self.store, self._full_name(name), documentation, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, openmetrics=False):
+        """
+        render the merged view of all processes
+
+        :param openmetrics: whether to render the OpenMetrics format
+        :return: the exposition as string
+        """
+        merged = self.store.merged()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(merged, openmetrics))
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,131 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class SlowestRequests(object):
+    """
+    keeps the k slowest requests per target type URI and interval.
+
+    each target type URI has a min-heap of at most k entries, so a request faster than the fastest entry of a full
+    heap is rejected without taking the lock. at the end of an interval the heaps are moved to 'previous' and
+    optionally logged.
+    """
+    def __init__(self, k=5, interval=60, max_keys=1000, log=True, logger=logging.getLogger(__name__)):
+        """
+        :param k: number of requests kept per target type URI
+        :param interval: seconds per interval
+        :param max_keys: maximum number of target type URIs per interval
+        :param log: whether to log the slowest requests at the end of an interval
+        :param logger: the logger to use
+        """
+        self.k = k
+        self.interval = interval
+        self.max_keys = max_keys
+        self.log = log
+        self.logger = logger
+        self.current = {}
+        self.previous = {}
+        self.dropped = 0
+        self._interval_start = time.time()
+        self._previous_interval_start = None
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def observe(self, target_type_uri, duration, request_id=None, initiator_project_id=None, action=None, now=None):
+        """
+        observe a finished request
+
+        :param target_type_uri: the target type URI of the request
+        :param duration: the duration in seconds
+        :param request_id: the request id returned by the service
+        :param initiator_project_id: the project of the initiator
+        :param action: the CADF action of the request
+        :param now: the current time
+        :return: whether the request is among the k slowest of the interval
+        """
+        now = now or time.time()
+        if now - self._interval_start >= self.interval:
+            self._rotate(now)
+
+        heap = self.current.get(target_type_uri)
+        if heap is not None and len(heap) >= self.k and duration <= heap[0][0]:
+            return False
+
+        with self._lock:
+            heap = self.current.get(target_type_uri)
+            if heap is None:
+                if len(self.current) >= self.max_keys:
+                    self.dropped += 1
+                    return False
+                heap = self.current[target_type_uri] = []
+            item = (duration, next(self._sequence), {
+                'time': now,
+                'duration': duration,
+                'request_id': request_id,
+                'initiator_project_id': initiator_project_id,
+                'action': action,
+            })
+            if len(heap) < self.k:
+                heapq.heappush(heap, item)
+                return True
+            return heapq.heappushpop(heap, item) is not item
+
+    def _rotate(self, now):
+        with self._lock:
+            # another thread rotated already
+            if now - self._interval_start < self.interval:
+                return
+            self.previous = self.current
+            self.current = {}
+            self._previous_interval_start = self._interval_start
+            self._interval_start = now
+            previous = self.previous
+
+        if not self.log:
+            return
+        for target_type_uri, heap in sorted(previous.items()):
+            self.logger.info("slowest requests of {0}: {1}".format(target_type_uri, ', '.join(
+                '{0} ({1}, project {2}) {3:.3f}s'.format(
+                    entry['request_id'], entry['action'], entry['initiator_project_id'], entry['duration']
+                )
+                for entry in self._sorted(heap)
+            )))
+
+    @staticmethod
+    def _sorted(heap):
+        return [entry for _, _, entry in sorted(heap, key=lambda item: item[0], reverse=True)]
+
+    def to_dict(self):
+        """
+        :return: the slowest requests per target type URI of the current and the previous interval
+        """
+        with self._lock:
+            return {
+                'interval': self.interval,
+                'current': {
+                    'start': self._interval_start,
+                    'requests': dict((target, self._sorted(heap)) for target, heap in self.current.items()),
+                },
+                'previous': {
+                    'start': self._previous_interval_start,
+                    'requests': dict((target, self._sorted(heap)) for target, heap in self.previous.items()),
+                },
+                'dropped': self.dropped,
+            }
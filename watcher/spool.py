@@ -0,0 +1,371 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+WRITER_PREFIX = 'writer-'
+LOCK_FILE = 'lock'
+SEGMENT_SUFFIX = '.seg'
+# length and crc32 of the payload
+FRAME_HEADER = struct.Struct('>II')
+
+
+def frame(payload):
+    """
+    frame a payload
+
+    :param payload: bytes
+    :return: the frame
+    """
+    return FRAME_HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + payload
+
+
+def scan(buf, offset=0, max_records=None):
+    """
+    read the frames of a buffer
+
+    :param buf: bytes or mmap
+    :param offset: offset of the first frame
+    :param max_records: maximum number of frames to read
+    :return: tuple of the list of (offset after the frame, payload) and whether a corrupt frame was found
+    """
+    records = []
+    size = len(buf)
+    while max_records is None or len(records) < max_records:
+        end = offset + FRAME_HEADER.size
+        if end > size:
+            # incomplete header, the frame is still being written
+            return records, False
+        length, crc = FRAME_HEADER.unpack_from(buf, offset)
+        if end + length > size:
+            return records, False
+        payload = buf[end:end + length]
+        if zlib.crc32(payload) & 0xffffffff != crc:
+            return records, True
+        offset = end + length
+        records.append((offset, payload))
+    return records, False
+
+
+def segment_name(sequence):
+    return '{0:016d}{1}'.format(sequence, SEGMENT_SUFFIX)
+
+
+def list_segments(path):
+    """
+    :param path: the directory of a writer
+    :return: sorted list of segment sequence numbers
+    """
+    try:
+        names = os.listdir(path)
+    except (IOError, OSError):
+        return []
+    return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in names if name.endswith(SEGMENT_SUFFIX))
+
+
+class SpoolWriter(object):
+    """
+    append-only spool of framed records split into segments.
+
+    layout of the directory:
+    writer-<n>/lock                 locked by the process owning the writer directory
+    writer-<n>/<sequence>.seg       segments of frames: length (4 bytes), crc32 (4 bytes), payload
+
+    every process of a prefork WSGI server claims a writer directory by locking it, thus each segment has a single
+    writer. the lock is released by the kernel once the process dies. the next process claiming the directory
+    truncates a partially written frame at the end of the last segment and continues in a new segment. after a failed
+    append the writer continues in a new segment as well, leaving the torn group behind.
+    a segment is never appended to after it was rotated, so readers can consume all but the last segment of a writer.
+    """
+    def __init__(self, path, segment_max_bytes=64 * 1024 * 1024, segment_max_age=300, max_bytes=1024 * 1024 * 1024,
+                 fsync=True, max_writers=1024, encoder=None, logger=logging.getLogger(__name__)):
+        """
+        :param path: the spool directory
+        :param segment_max_bytes: size after which a segment is rotated. a group is never split across segments
+        :param segment_max_age: seconds after which a segment is rotated
+        :param max_bytes: maximum size of the segments of a writer directory. further records are dropped
+        :param fsync: whether to fsync after each append
+        :param max_writers: maximum number of writer directories (processes)
+        :param encoder: optional encoder of the records, e.g. codec.Encoder. reset with every new segment
+        :param logger: the logger to use
+        """
+        self.path = path
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_age = segment_max_age
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.max_writers = max_writers
+        self.encoder = encoder
+        self.logger = logger
+        self.dropped = 0
+        self.appended = 0
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._lock_fd = None
+        self._writer_path = None
+        self._segment = None
+        self._sequence = 0
+        self._segment_bytes = 0
+        self._segment_start = 0
+        self._closed_bytes = 0
+
+    def append(self, records):
+        """
+        append a group of records with a single write and fsync
+
+        :param records: list of bytes or, if an encoder is configured, list of records to encode
+        :return: whether the records were appended
+        """
+        with self._lock:
+            self._ensure_writer()
+            now = time.time()
+            if self._segment is None or self._segment_bytes >= self.segment_max_bytes or \
+                    (self._segment_bytes > 0 and now - self._segment_start >= self.segment_max_age):
+                self._rotate(now)
+            # encoded after the rotation as the encoding might depend on the segment
+            payloads = self.encoder.encode(records) if self.encoder else records
+            data = b''.join(frame(payload) for payload in payloads)
+            if self._closed_bytes + self._segment_bytes + len(data) > self.max_bytes:
+                if self.encoder:
+                    self.encoder.rollback()
+                self.dropped += len(records)
+                return False
+            try:
+                self._segment.write(data)
+                self._segment.flush()
+                if self.fsync:
+                    os.fsync(self._segment.fileno())
+            except (IOError, OSError) as e:
+                self.logger.warning("failed to append {0} records to spool: {1}".format(len(records), str(e)))
+                # the strings of the lost group are unknown to readers
+                if self.encoder:
+                    self.encoder.rollback()
+                self._discard_tail()
+                self.dropped += len(records)
+                return False
+            self._segment_bytes += len(data)
+            self.appended += len(records)
+            return True
+
+    def close(self):
+        with self._lock:
+            if self._segment is not None:
+                self._segment.close()
+            self._segment = None
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+            self._pid = None
+
+    @property
+    def writer_path(self):
+        return self._writer_path
+
+    @property
+    def sequence(self):
+        return self._sequence
+
+    def _ensure_writer(self):
+        """
+        claim a writer directory for this process. caller must hold the lock
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        # never write to a segment inherited from the parent process (preloading prefork servers).
+        # closing the inherited descriptors keeps the lock of the parent intact
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self._claim_writer()
+        self._pid = pid
+        self._recover()
+        self._rotate(time.time())
+
+    def _claim_writer(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        for index in range(self.max_writers):
+            writer_path = os.path.join(self.path, '{0}{1:04d}'.format(WRITER_PREFIX, index))
+            if not os.path.isdir(writer_path):
+                try:
+                    os.makedirs(writer_path)
+                except OSError:
+                    # created concurrently by another process
+                    pass
+            fd = os.open(os.path.join(writer_path, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                os.close(fd)
+                continue
+            self._lock_fd = fd
+            self._writer_path = writer_path
+            self.logger.debug("process {0} claimed spool writer {1}".format(os.getpid(), writer_path))
+            return
+        raise IOError("no free spool writer in {0}".format(self.path))
+
+    def _recover(self):
+        """
+        truncate a partially written or corrupt tail of the last segment of a previous process
+        """
+        sequences = list_segments(self._writer_path)
+        self._sequence = sequences[-1] if sequences else 0
+        if not sequences:
+            return
+        segment_path = os.path.join(self._writer_path, segment_name(self._sequence))
+        with open(segment_path, 'r+b') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                records, corrupt = scan(buf)
+            finally:
+                buf.close()
+            valid = records[-1][0] if records else 0
+            if valid < size:
+                self.logger.warning(
+                    "truncating {0} bytes of {1} {2}".format(
+                        size - valid, 'corrupt' if corrupt else 'incomplete', segment_path
+                    )
+                )
+                f.truncate(valid)
+                os.fsync(f.fileno())
+
+    def _discard_tail(self):
+        """
+        continue in a new segment after a group was partially written, so the next group doesn't follow a torn frame.
+        the segment is not truncated, as a reader might have consumed complete frames of the group already. readers
+        skip the torn tail of a rotated segment. caller must hold the lock
+        """
+        try:
+            self._segment.close()
+        except (IOError, OSError):
+            # the buffered data is discarded together with the file object
+            pass
+        self._segment = None
+        try:
+            self._rotate(time.time())
+        except (IOError, OSError) as e:
+            # retried with the next append
+            self.logger.warning("failed to rotate spool segment: {0}".format(str(e)))
+
+    def _rotate(self, now):
+        """
+        close the current segment and start a new one. caller must hold the lock
+        """
+        if self._segment is not None:
+            self._segment.close()
+        self._sequence += 1
+        self._segment = open(os.path.join(self._writer_path, segment_name(self._sequence)), 'ab')
+        if self.fsync:
+            fd = os.open(self._writer_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self._segment_bytes = 0
+        self._segment_start = now
+        # segments removed by the reader no longer count towards max_bytes
+        self._closed_bytes = 0
+        for sequence in list_segments(self._writer_path):
+            if sequence != self._sequence:
+                try:
+                    self._closed_bytes += os.path.getsize(os.path.join(self._writer_path, segment_name(sequence)))
+                except OSError:
+                    pass
+        if self.encoder:
+            self.encoder.reset()
+
+
+class SpoolReader(object):
+    """
+    reads the segments of all writers of a spool via mmap
+    """
+    def __init__(self, path, logger=logging.getLogger(__name__)):
+        """
+        :param path: the spool directory
+        :param logger: the logger to use
+        """
+        self.path = path
+        self.logger = logger
+
+    def writers(self):
+        """
+        :return: sorted list of writer names
+        """
+        try:
+            return sorted(name for name in os.listdir(self.path) if name.startswith(WRITER_PREFIX))
+        except (IOError, OSError):
+            return []
+
+    def segments(self, writer):
+        """
+        :param writer: the writer name
+        :return: sorted list of segment sequence numbers
+        """
+        return list_segments(os.path.join(self.path, writer))
+
+    def segment_path(self, writer, sequence):
+        return os.path.join(self.path, writer, segment_name(sequence))
+
+    def read(self, writer, sequence, offset=0, max_records=None):
+        """
+        read the records of a segment
+
+        :param writer: the writer name
+        :param sequence: the segment sequence number
+        :param offset: offset of the first record
+        :param max_records: maximum number of records
+        :return: list of (offset after the record, payload)
+        """
+        segment_path = self.segment_path(writer, sequence)
+        with open(segment_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= offset:
+                return []
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                records, corrupt = scan(buf, offset, max_records)
+            finally:
+                buf.close()
+        if corrupt:
+            self.logger.warning("corrupt record in {0} after offset {1}".format(
+                segment_path, records[-1][0] if records else offset
+            ))
+        return records
+
+    def remove(self, writer, sequence):
+        """
+        remove a consumed segment
+
+        :param writer: the writer name
+        :param sequence: the segment sequence number
+        """
+        try:
+            os.remove(self.segment_path(writer, sequence))
+        except OSError as e:
+            self.logger.debug("failed to remove spool segment {0}/{1}: {2}".format(writer, sequence, str(e)))
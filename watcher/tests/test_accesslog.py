@@ -0,0 +1,153 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import mock
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from webob import Request
+
+from . import fake
+from watcher import accesslog
+from watcher.watcher import OpenStackWatcherMiddleware
+
+
+def create_record(**kwargs):
+    attributes = dict(
+        time=1500000000.5, remote_addr='10.0.0.1', method='GET', path='/v2.1/servers', status='200', duration=0.25,
+        request_bytes=None, response_bytes=42, request_id='req-1', action='read/list',
+        target_type_uri='service/compute/servers', target_project_id='b206a1900310484f8a9504754c84b067',
+        initiator_project_id='b206a1900310484f8a9504754c84b067', initiator_domain_id='default',
+        initiator_user_id='4c3b2a1d0e9f8a7b6c5d4e3f2a1b0c9d'
+    )
+    attributes.update(kwargs)
+    return accesslog.AccessRecord(**attributes)
+
+
+class TestAccessLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'access.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_format(self):
+        access_log = accesslog.AccessLog(self.path, 'service/compute')
+        line = access_log.format(create_record(path='/v2.1/servers/"quoted"\n'))
+        self.assertTrue(line.endswith('\n'))
+        self.assertEqual(json.loads(line), {
+            'service': 'service/compute', 'action': 'read/list', 'target_type_uri': 'service/compute/servers',
+            'time': '2017-07-14T02:40:00.500000+0000', 'remote_addr': '10.0.0.1', 'method': 'GET',
+            'path': '/v2.1/servers/"quoted"\n', 'status': '200', 'duration': 0.25, 'request_bytes': None,
+            'response_bytes': 42, 'request_id': 'req-1', 'target_project_id': 'b206a1900310484f8a9504754c84b067',
+            'initiator_project_id': 'b206a1900310484f8a9504754c84b067', 'initiator_domain_id': 'default',
+            'initiator_user_id': '4c3b2a1d0e9f8a7b6c5d4e3f2a1b0c9d'
+        })
+        self.assertEqual(list(access_log._formats.keys()), [('read/list', 'service/compute/servers')])
+
+    def test_rotation(self):
+        access_log = accesslog.AccessLog(self.path, 'service/compute', max_bytes=1000, backup_count=2)
+        for _ in range(4):
+            for _ in range(3):
+                access_log.log(create_record())
+            access_log.writer.flush()
+        access_log.stop()
+        self.assertEqual(access_log.rotations, 4)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['access.log', 'access.log.1', 'access.log.2', 'access.log.lock'])
+        with open(self.path + '.1') as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    def test_reopen(self):
+        access_log = accesslog.AccessLog(self.path, 'service/compute', max_bytes=0)
+        access_log.log(create_record())
+        access_log.writer.flush()
+        # rotated by logrotate
+        os.rename(self.path, self.path + '.old')
+        access_log.log(create_record())
+        access_log.stop()
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+    def test_middleware(self):
+        watcher = OpenStackWatcherMiddleware(
+            fake.FakeApp(),
+            {'service_type': 'compute', 'access_log_enabled': 'true', 'access_log_path': self.path}
+        )
+        watcher.metric_client = mock.Mock()
+        req = Request.blank('/v2.1/servers', remote_addr='10.0.0.2')
+        req.headers['X-Project-Id'] = 'b206a1900310484f8a9504754c84b067'
+        _, _, app_iter = req.call_application(watcher)
+        body = b''.join(app_iter)
+        # logged once the server closed the response
+        app_iter.close()
+        watcher.access_log.stop(5)
+
+        with open(self.path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]['action'], 'read')
+        self.assertEqual(lines[0]['target_type_uri'], 'service/compute/servers')
+        self.assertEqual(lines[0]['remote_addr'], '10.0.0.2')
+        self.assertEqual(lines[0]['status'], '200')
+        self.assertEqual(lines[0]['initiator_project_id'], 'b206a1900310484f8a9504754c84b067')
+        self.assertEqual(lines[0]['response_bytes'], len(body))
+
+    def test_middleware_streamed_response(self):
+        def streaming_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'application/octet-stream')])
+            for chunk in (b'a' * 10, b'b' * 20):
+                time.sleep(0.1)
+                yield chunk
+
+        watcher = OpenStackWatcherMiddleware(
+            streaming_app, {'service_type': 'object-store', 'access_log_enabled': 'true', 'access_log_path': self.path}
+        )
+        watcher.metric_client = mock.Mock()
+        # like a server, iterate and close the response
+        app_iter = watcher(Request.blank('/v1/AUTH_b206a1900310484f8a9504754c84b067/c/o').environ, mock.Mock())
+        self.assertEqual(b''.join(app_iter), b'a' * 10 + b'b' * 20)
+        app_iter.close()
+        watcher.access_log.stop(5)
+
+        with open(self.path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(lines[0]['status'], '200')
+        # the bytes and duration of the whole streamed body, not only until the application returned
+        self.assertEqual(lines[0]['response_bytes'], 30)
+        self.assertGreaterEqual(lines[0]['duration'], 0.2)
+
+    def test_middleware_failed_application(self):
+        def failing_app(environ, start_response):
+            raise RuntimeError('failed')
+
+        watcher = OpenStackWatcherMiddleware(
+            failing_app, {'service_type': 'compute', 'access_log_enabled': 'true', 'access_log_path': self.path}
+        )
+        watcher.metric_client = mock.Mock()
+        self.assertRaises(RuntimeError, Request.blank('/v2.1/servers').call_application, watcher)
+        watcher.access_log.stop(5)
+
+        with open(self.path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(lines[0]['status'], 'unknown')
+        self.assertIsNone(lines[0]['response_bytes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import random
+import threading
+import unittest
+
+from webob import Request
+
+from . import fake
+from watcher import aggregation
+from watcher.watcher import OpenStackWatcherMiddleware
+
+
+class TestAggregation(unittest.TestCase):
+    def test_sketch_relative_accuracy(self):
+        values = [random.expovariate(10) for _ in range(10000)]
+        sketch = aggregation.DDSketch(relative_accuracy=0.01)
+        for value in values:
+            sketch.add(value)
+
+        values.sort()
+        for q in (0.5, 0.9, 0.99):
+            expected = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(sketch.quantile(q), expected, delta=expected * 0.01 + 1e-12)
+
+    def test_sketch_merge(self):
+        a = aggregation.DDSketch()
+        b = aggregation.DDSketch()
+        for value in range(1, 51):
+            a.add(value)
+        for value in range(51, 101):
+            b.add(value)
+        a.merge(b)
+        self.assertEqual(a.count, 100)
+        self.assertAlmostEqual(a.quantile(0.99), 99, delta=99 * 0.01)
+
+    def test_sketch_bounded_bins(self):
+        sketch = aggregation.DDSketch(max_bins=10)
+        for value in range(1, 1000):
+            sketch.add(value)
+        self.assertLessEqual(len(sketch.bins), 10)
+        self.assertAlmostEqual(sketch.quantile(1), 999, delta=999 * 0.01)
+
+    def test_histogram_flush(self):
+        aggregator = aggregation.DistributionAggregator(
+            'api_requests_duration_seconds', buckets=[0.1, 1], flush_interval=10
+        )
+        aggregator.observe(['action:read'], 0.05)
+        aggregator.observe(['action:read'], 0.5)
+        aggregator.observe(['action:read'], 5)
+
+        client = mock.Mock()
+        self.assertEqual(aggregator.flush(client), 1)
+
+        client.increment.assert_any_call('api_requests_duration_seconds_bucket', 1, tags=['action:read', 'le:0.1'])
+        client.increment.assert_any_call('api_requests_duration_seconds_bucket', 2, tags=['action:read', 'le:1.0'])
+        client.increment.assert_any_call('api_requests_duration_seconds_bucket', 3, tags=['action:read', 'le:+Inf'])
+        client.increment.assert_any_call('api_requests_duration_seconds_count', 3, tags=['action:read'])
+
+        # nothing is emitted for intervals without observations and the tag set is forgotten
+        client.reset_mock()
+        self.assertEqual(aggregator.flush(client), 0)
+        client.increment.assert_not_called()
+        self.assertEqual(aggregator._pending, {})
+
+        # but counted again once observed
+        aggregator.observe(['action:read'], 0.05)
+        self.assertEqual(aggregator.flush(client), 1)
+        client.increment.assert_any_call('api_requests_duration_seconds_count', 1, tags=['action:read'])
+
+    def test_sketch_flush(self):
+        aggregator = aggregation.DistributionAggregator(
+            'api_requests_duration_seconds', mode=aggregation.MODE_SKETCH, quantiles=[0.5]
+        )
+        for _ in range(10):
+            aggregator.observe(['action:read'], 0.2)
+
+        client = mock.Mock()
+        aggregator.flush(client)
+        name, value = client.gauge.call_args[0]
+        self.assertEqual(name, 'api_requests_duration_seconds')
+        self.assertAlmostEqual(value, 0.2, delta=0.2 * 0.01)
+        self.assertEqual(client.gauge.call_args[1], {'tags': ['action:read', 'quantile:0.5']})
+
+    def test_middleware_aggregates_durations(self):
+        watcher = OpenStackWatcherMiddleware(
+            fake.FakeApp(),
+            {
+                'service_type': 'compute',
+                'duration_aggregation': 'histogram'
+            }
+        )
+        watcher.metric_client = mock.Mock()
+        Request.blank('/v2.1/servers').get_response(watcher)
+
+        watcher.metric_client.timing.assert_not_called()
+        self.assertEqual(watcher.duration_aggregator.pending(), 1)
+
+    def test_flush_thread(self):
+        flushed = threading.Event()
+        client = mock.Mock()
+        client.increment.side_effect = lambda name, value, tags: name.endswith('_sum') and flushed.set()
+        aggregator = aggregation.DistributionAggregator(
+            'api_requests_duration_seconds', flush_interval=0.01, client=client
+        )
+        aggregator.ensure_started()
+        try:
+            aggregator.observe(['action:read'], 0.05)
+            self.assertTrue(flushed.wait(5))
+        finally:
+            aggregator.stop()
+        client.increment.assert_any_call('api_requests_duration_seconds_count', 1, tags=['action:read'])
+
+    def test_flush_on_stop(self):
+        client = mock.Mock()
+        aggregator = aggregation.DistributionAggregator(
+            'api_requests_duration_seconds', flush_interval=60, client=client
+        )
+        aggregator.ensure_started()
+        aggregator.observe(['action:read'], 0.5)
+        aggregator.stop()
+        client.increment.assert_any_call('api_requests_duration_seconds_sum', 0.5, tags=['action:read'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from webob import Request
+
+from . import fake
+from watcher import capture
+from watcher.watcher import OpenStackWatcherMiddleware
+
+
+class TestCapture(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'capture.jsonl.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_to_environ_key(self):
+        self.assertEqual(capture.to_environ_key('X-Project-Id'), 'HTTP_X_PROJECT_ID')
+        self.assertEqual(capture.to_environ_key('Content-Type'), 'CONTENT_TYPE')
+
+    def test_redact(self):
+        body = {'auth': {'identity': {'methods': ['password'], 'password': {'user': {'name': 'a', 'password': 'b'}}}}}
+        self.assertEqual(
+            capture.redact(body), {'auth': {'identity': {'methods': ['password'], 'password': capture.REDACTED}}}
+        )
+
+    def test_redact_secrets(self):
+        # keystone password change
+        body = {'user': {'original_password': 'old', 'password': 'new'}}
+        self.assertEqual(capture.redact(body), {'user': {'original_password': capture.REDACTED, 'password': capture.REDACTED}})
+        # barbican secret
+        body = {'name': 'key', 'payload': 'material', 'payload_content_type': 'text/plain', 'algorithm': 'aes'}
+        self.assertEqual(capture.redact(body), {
+            'name': 'key', 'payload': capture.REDACTED, 'payload_content_type': capture.REDACTED, 'algorithm': 'aes'
+        })
+        self.assertEqual(capture.redact({'private_key': 'pem'}), {'private_key': capture.REDACTED})
+
+    def test_redact_query_string(self):
+        redacted = frozenset(p.lower() for p in capture.DEFAULT_REDACTED_QUERY_PARAMETERS)
+        self.assertEqual(
+            capture.redact_query_string('temp_url_sig=abc&temp_url_expires=1500000000&filename=a', redacted),
+            'temp_url_sig=***&temp_url_expires=1500000000&filename=a'
+        )
+        self.assertEqual(capture.redact_query_string('limit=10&Token=abc', redacted), 'limit=10&Token=***')
+        self.assertEqual(capture.redact_query_string('token', redacted), 'token')
+        self.assertEqual(capture.redact_query_string('', redacted), '')
+
+    def test_rate_limit(self):
+        recorder = capture.Capture(self.path, max_per_second=2)
+        self.assertEqual([recorder.should_capture(100) for _ in range(3)], [True, True, False])
+        self.assertTrue(recorder.should_capture(100.5))
+        self.assertFalse(recorder.should_capture(100.5))
+        self.assertFalse(capture.Capture(self.path, sample_rate=0).should_capture(100))
+
+    def test_max_bytes(self):
+        recorder = capture.Capture(self.path, max_bytes=1)
+        recorder.capture(capture.CaptureRecord(0, 'GET', '/', None, {}, None, None, '200', 0.1, 'read', 'service'))
+        recorder.writer.flush()
+        self.assertTrue(recorder.is_full)
+        self.assertFalse(recorder.should_capture(100))
+
+    def test_middleware(self):
+        watcher = OpenStackWatcherMiddleware(
+            fake.FakeApp(),
+            {'service_type': 'compute', 'capture_enabled': 'true', 'capture_path': self.path}
+        )
+        watcher.metric_client = mock.Mock()
+        for _ in range(2):
+            req = Request.blank('/v2.1/servers/0ef3e5e6-a3f4-4b2f-a1c4-3a7c8b7b4b6e/action?token=abc', method='POST')
+            req.headers['X-Project-Id'] = 'b206a1900310484f8a9504754c84b067'
+            req.headers['X-Auth-Token'] = 'secret-token'
+            req.content_type = 'application/json'
+            req.body = json.dumps({'changePassword': {'adminPass': 'x', 'password': 'y'}}).encode('utf-8')
+            req.get_response(watcher)
+            # the application can still read the body
+            self.assertEqual(req.json['changePassword']['password'], 'y')
+        watcher.capture.stop(5)
+
+        records = list(capture.read_corpus(self.path))
+        self.assertEqual(len(records), 2)
+        record = records[0]
+        self.assertEqual(record['method'], 'POST')
+        self.assertEqual(record['path'], '/v2.1/servers/0ef3e5e6-a3f4-4b2f-a1c4-3a7c8b7b4b6e/action')
+        self.assertEqual(record['query_string'], 'token=***')
+        self.assertEqual(record['headers'], {
+            'X-Project-Id': 'b206a1900310484f8a9504754c84b067', 'X-Auth-Token': capture.REDACTED,
+            'Content-Type': 'application/json'
+        })
+        # the action remains, its value contains a password
+        self.assertEqual(json.loads(record['body'].decode('utf-8')), {'changePassword': capture.REDACTED})
+        self.assertEqual(record['status'], '200')
+        self.assertEqual(record['action'], 'update/changePassword')
+        self.assertEqual(record['target_type_uri'], 'service/compute/servers/server/action')
+
+
+if __name__ == '__main__':
+    unittest.main()
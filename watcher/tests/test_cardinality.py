@@ -0,0 +1,121 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import time
+import unittest
+
+from webob import Request
+
+from . import fake
+from watcher import cardinality
+from watcher.watcher import OpenStackWatcherMiddleware
+
+
+class TestCardinality(unittest.TestCase):
+    def test_space_saving(self):
+        sketch = cardinality.SpaceSaving(3)
+        for item, count in (('a', 100), ('b', 50), ('c', 1), ('d', 1), ('e', 1), ('f', 30)):
+            for _ in range(count):
+                sketch.add(item)
+        self.assertEqual(len(sketch.counts), 3)
+        self.assertEqual(sketch.top(2), ['a', 'b'])
+
+    def test_space_saving_decay(self):
+        sketch = cardinality.SpaceSaving(3)
+        for item, count in (('a', 100), ('b', 1), ('c', 3)):
+            for _ in range(count):
+                sketch.add(item)
+        sketch.decay()
+        self.assertEqual(sketch.counts, {'a': 50, 'c': 1})
+        # the freed capacity is used before evicting
+        sketch.add('d')
+        sketch.add('e')
+        self.assertEqual(sketch.counts, {'a': 50, 'd': 1, 'e': 2})
+
+    def test_limit(self):
+        governor = cardinality.CardinalityGovernor(2)
+        now = time.time()
+        tags = ['action:read', 'target_project_id:{0}']
+
+        for project in ('p1', 'p2'):
+            limited, collapsed = governor.limit('api_requests_total', [t.format(project) for t in tags], now)
+            self.assertEqual(limited[1], 'target_project_id:' + project)
+            self.assertEqual(collapsed, [])
+
+        limited, collapsed = governor.limit('api_requests_total', [t.format('p3') for t in tags], now)
+        self.assertEqual(limited, ['action:read', 'target_project_id:other'])
+        self.assertEqual(collapsed, ['target_project_id'])
+
+        # another metric has its own budget
+        limited, _ = governor.limit('other_metric', [t.format('p3') for t in tags], now)
+        self.assertEqual(limited[1], 'target_project_id:p3')
+
+    def test_heavy_hitters_replace_admitted_values(self):
+        governor = cardinality.CardinalityGovernor(1, rebalance_interval=60)
+        now = time.time()
+        governor.limit('api_requests_total', ['target_project_id:quiet'], now)
+        for _ in range(10):
+            limited, _ = governor.limit('api_requests_total', ['target_project_id:busy'], now)
+        self.assertEqual(limited, ['target_project_id:other'])
+
+        limited, _ = governor.limit('api_requests_total', ['target_project_id:busy'], now + 61)
+        self.assertEqual(limited, ['target_project_id:busy'])
+        limited, _ = governor.limit('api_requests_total', ['target_project_id:quiet'], now + 61)
+        self.assertEqual(limited, ['target_project_id:other'])
+        self.assertEqual(governor.stats()['api_requests_total/target_project_id']['collapsed'], 11)
+
+    def test_former_heavy_hitters_decay(self):
+        governor = cardinality.CardinalityGovernor(1, rebalance_interval=60)
+        now = time.time()
+        for _ in range(100):
+            governor.limit('api_requests_total', ['target_project_id:former'], now)
+
+        # the former heavy hitter stops sending requests. the new one takes over after its count decayed
+        admitted = []
+        for interval in range(1, 4):
+            for _ in range(30):
+                limited, _ = governor.limit('api_requests_total', ['target_project_id:new'], now + 61 * interval)
+            admitted.append(limited[0])
+        self.assertEqual(admitted, ['target_project_id:other', 'target_project_id:other', 'target_project_id:new'])
+
+    def test_budget_override(self):
+        governor = cardinality.CardinalityGovernor(0, budget_overrides={'api_requests_total': 1})
+        governor.limit('api_requests_total', ['target_project_id:a'])
+        self.assertEqual(governor.limit('api_requests_total', ['target_project_id:b'])[0], ['target_project_id:other'])
+        self.assertEqual(governor.limit('unlimited', ['target_project_id:b'])[0], ['target_project_id:b'])
+
+    def test_middleware(self):
+        watcher = OpenStackWatcherMiddleware(
+            fake.FakeApp(),
+            {
+                'service_type': 'compute',
+                'metric_cardinality_limit': '1'
+            }
+        )
+        watcher.metric_client = mock.Mock()
+        for project_id in ('a' * 32, 'b' * 32):
+            req = Request.blank('/v2.1/servers')
+            req.headers['X-Project-Id'] = project_id
+            req.get_response(watcher)
+
+        watcher.metric_client.increment.assert_any_call(
+            'cardinality_collapsed_total', tags=['metric:api_requests_total', 'label:initiator_project_id']
+        )
+        _, kwargs = watcher.metric_client.increment.call_args
+        self.assertIn('initiator_project_id:other', kwargs['tags'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import mock
+import shutil
+import six
+import tempfile
+import unittest
+import uuid
+
+from watcher import codec
+from watcher import spool
+
+
+def create_event(index=0):
+    return {
+        'typeURI': 'http://schemas.dmtf.org/cloud/audit/1.0/event',
+        'eventType': 'activity',
+        'id': str(uuid.uuid4()),
+        'eventTime': '2017-07-14T02:40:{0:02d}.500000+0000'.format(index % 60),
+        'action': 'read/list',
+        'outcome': 'success',
+        'reason': {'reasonType': 'HTTP', 'reasonCode': '200'},
+        'initiator': {
+            'id': '4c3b2a1d0e9f8a7b6c5d4e3f2a1b0c9d', 'typeURI': 'service/security/account/user',
+            'host': {'address': '10.0.0.1'}, 'project_id': 'b206a1900310484f8a9504754c84b067'
+        },
+        'target': {'id': 'b206a1900310484f8a9504754c84b067', 'typeURI': 'service/compute/servers'},
+        'observer': {'id': 'target'},
+        'requestPath': '/v2.1/servers',
+        'requestId': 'req-{0}'.format(uuid.uuid4()),
+        'count': index,
+        'negative': -index,
+        'duration': 0.25,
+        'tags': ['a', None, True, False],
+    }
+
+
+class TestCodec(unittest.TestCase):
+    def test_varint(self):
+        for value in (0, 1, 127, 128, 300, 2 ** 40):
+            out = bytearray()
+            codec.encode_varint(value, out)
+            self.assertEqual(codec.decode_varint(bytes(out), 0), (value, len(out)))
+
+    def test_roundtrip(self):
+        for compress in (False, True):
+            encoder = codec.Encoder(compress=compress)
+            decoder = codec.Decoder()
+            events = [create_event(i) for i in range(3)]
+            decoded = []
+            for record in encoder.encode(events):
+                decoded.extend(decoder.decode(record))
+            self.assertEqual(decoded, events)
+
+    def test_int_boundaries(self):
+        values = [0, 1, -1, 2 ** 63 - 1, -2 ** 63, 2 ** 63, -2 ** 63 - 1, 2 ** 64, -2 ** 64 - 1, -2 ** 100]
+        encoder = codec.Encoder(compress=False)
+        decoder = codec.Decoder()
+        decoded = []
+        for record in encoder.encode([{'count': value} for value in values]):
+            decoded.extend(decoder.decode(record))
+        self.assertEqual([event['count'] for event in decoded], values)
+
+    def test_dictionary_is_reused(self):
+        encoder = codec.Encoder(compress=False)
+        first = encoder.encode([create_event()])
+        second = encoder.encode([create_event()])
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1, 'all strings of the second event are known')
+
+    def test_rollback(self):
+        encoder = codec.Encoder(compress=False)
+        decoder = codec.Decoder()
+        for record in encoder.encode([{'action': 'read'}]):
+            decoder.decode(record)
+        # the batch is not written
+        encoder.encode([{'action': 'update', 'new': 'string'}])
+        encoder.rollback()
+        decoded = []
+        for record in encoder.encode([{'action': 'delete'}]):
+            decoded.extend(decoder.decode(record))
+        self.assertEqual(decoded, [{'action': 'delete'}])
+
+    def test_dictionary_gap(self):
+        encoder = codec.Encoder(compress=False)
+        encoder.encode([{'action': 'read'}])
+        # the first dictionary was never decoded
+        records = encoder.encode([{'action': 'update'}])
+        self.assertRaises(ValueError, codec.Decoder().decode, records[0])
+
+    def test_max_dictionary(self):
+        encoder = codec.Encoder(compress=False, max_dictionary=2)
+        decoder = codec.Decoder()
+        decoded = []
+        for record in encoder.encode([{'action': 'read', 'outcome': 'success'}]):
+            decoded.extend(decoder.decode(record))
+        self.assertEqual(decoded, [{'action': 'read', 'outcome': 'success'}])
+
+    def test_json_record(self):
+        self.assertEqual(codec.Decoder().decode(b'{"action": "read"}'), [{'action': 'read'}])
+
+    def test_size(self):
+        events = [create_event(i) for i in range(100)]
+        json_size = sum(len(record) for record in codec.JsonEncoder().encode(events))
+        binary_size = sum(len(record) for record in codec.Encoder(compress=False).encode(events))
+        compressed_size = sum(len(record) for record in codec.Encoder().encode(events))
+        self.assertLess(binary_size * 3, json_size)
+        self.assertLess(compressed_size, binary_size)
+
+    def test_spool_segments(self):
+        path = tempfile.mkdtemp()
+        try:
+            writer = spool.SpoolWriter(path, segment_max_bytes=1, fsync=False, encoder=codec.Encoder())
+            events = [create_event(i) for i in range(3)]
+            for event in events:
+                writer.append([event])
+            writer.close()
+
+            reader = spool.SpoolReader(path)
+            self.assertEqual(reader.segments('writer-0000'), [1, 2, 3])
+            # every segment can be decoded on its own
+            self.assertEqual(list(codec.decode_segment(reader.segment_path('writer-0000', 3))), events[2:])
+
+            with mock.patch('sys.stdout', new_callable=six.StringIO) as stdout:
+                self.assertEqual(codec.main([path]), 0)
+            self.assertEqual([json.loads(line) for line in stdout.getvalue().splitlines()], events)
+        finally:
+            shutil.rmtree(path)
+
+    def test_failed_spool_append(self):
+        path = tempfile.mkdtemp()
+        try:
+            writer = spool.SpoolWriter(path, fsync=False, encoder=codec.Encoder(compress=False))
+            writer.append([{'action': 'read'}])
+            writer._segment = mock.Mock(
+                write=mock.Mock(side_effect=IOError('no space left on device')), close=writer._segment.close
+            )
+            self.assertFalse(writer.append([{'action': 'update', 'new': 'string'}]))
+            writer.append([{'action': 'delete', 'new': 'string'}])
+            writer.close()
+
+            # the next group is appended to a new segment with a dictionary of its own
+            reader = spool.SpoolReader(path)
+            self.assertEqual(list(codec.decode_segment(reader.segment_path('writer-0000', 1))), [{'action': 'read'}])
+            self.assertEqual(
+                list(codec.decode_segment(reader.segment_path('writer-0000', 2))), [{'action': 'delete', 'new': 'string'}]
+            )
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -180,6 +180,46 @@ class TestCommon(unittest.TestCase):
                 "bool of '{0}' should be '{1}' but got '{2}'".format(repr(input), expected, actual)
             )
 
+    def test_closing_iterable(self):
+        closed = []
+        iterable = common.ClosingIterable(['a', 'b'], lambda: closed.append(True))
+        self.assertEqual(list(iterable), ['a', 'b'])
+        iterable.close()
+        iterable.close()
+        self.assertEqual(closed, [True])
+
+    def test_parse_request_start_header(self):
+        stimuli = {
+            't=1500000000.123': 1500000000.123,
+            '1500000000123': 1500000000.123,
+            't=1500000000123456': 1500000000.123456,
+            'foo': None,
+            None: None,
+        }
+        for stim, expected in six.iteritems(stimuli):
+            actual = common.parse_request_start_header(stim)
+            if expected is None:
+                self.assertIsNone(actual)
+            else:
+                self.assertAlmostEqual(actual, expected, places=5)
+
+    def test_parse_content_length(self):
+        stimuli = {'123': 123, '0': 0, '-1': None, 'foo': None, '': None, None: None}
+        for stim, expected in six.iteritems(stimuli):
+            self.assertEqual(common.parse_content_length(stim), expected)
+
+    def test_string_to_list(self):
+        self.assertEqual(common.string_to_list(' a, b,,c '), ['a', 'b', 'c'])
+        self.assertEqual(common.string_to_list(''), [])
+        self.assertEqual(common.string_to_list((1, 2)), [1, 2])
+
+    def test_string_to_dict(self):
+        self.assertEqual(
+            common.string_to_dict('read/list:0.1, api_requests_total : 1000'),
+            {'read/list': '0.1', 'api_requests_total': '1000'}
+        )
+        self.assertEqual(common.string_to_dict(''), {})
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,77 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import os
+import unittest
+
+from webob import Request
+
+from . import fake
+from watcher.watcher import OpenStackWatcherMiddleware
+
+
+WORKDIR = os.path.dirname(os.path.realpath(__file__))
+NEUTRON_CONFIG_PATH = WORKDIR + '/fixtures/neutron.yaml'
+
+
+class TestDebugEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.watcher = OpenStackWatcherMiddleware(
+            fake.FakeApp(),
+            {
+                'service_type': 'network',
+                'config_file': NEUTRON_CONFIG_PATH,
+                'debug_enabled': 'true',
+                'debug_allowed_addresses': '10.0.0.1',
+                'duration_aggregation': 'histogram'
+            }
+        )
+        self.watcher.metric_client = mock.Mock()
+
+    def get_debug_info(self, remote_addr='10.0.0.1'):
+        return Request.blank('/watcher/debug', environ={'REMOTE_ADDR': remote_addr}).get_response(self.watcher)
+
+    def test_forbidden(self):
+        self.assertEqual(self.get_debug_info('10.0.0.2').status_int, 403)
+
+    def test_debug_info(self):
+        Request.blank('/v2.0/networks/d5a4b3c2-1f6e-4a8b-9c0d-2e3f4a5b6c7d/tags').get_response(self.watcher)
+        Request.blank('/v2.0/networks', method='FOO').get_response(self.watcher)
+
+        resp = self.get_debug_info()
+        self.assertEqual(resp.status_int, 200)
+        info = resp.json
+        self.assertIn('version', info)
+        self.assertEqual(info['config']['wsgi']['service_type'], 'network')
+        self.assertEqual(info['config']['strategy']['target_type_uri_prefix'], 'service/network')
+        self.assertEqual(info['regex_hits'], {'v2.0/\\S+/\\S+/tags$': 1})
+        self.assertEqual(info['unknown_paths'], ['FOO /v2.0/networks'])
+        self.assertEqual(info['queues']['duration_aggregator'], 2)
+        self.assertEqual(info['dropped']['failed_metric_submissions'], 0)
+
+    def test_regex_hits_disabled(self):
+        watcher = OpenStackWatcherMiddleware(
+            fake.FakeApp(),
+            {
+                'service_type': 'network',
+                'config_file': NEUTRON_CONFIG_PATH
+            }
+        )
+        Request.blank('/v2.0/networks/d5a4b3c2-1f6e-4a8b-9c0d-2e3f4a5b6c7d/tags').get_response(watcher)
+        self.assertIsNone(watcher.strategy.regex_hits)
+
+
+if __name__ == '__main__':
+    unittest.main()
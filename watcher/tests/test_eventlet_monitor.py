@@ -0,0 +1,93 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import time
+import unittest
+
+from webob import Request
+
+from . import fake
+from watcher import eventlet_monitor
+from watcher import inflight
+from watcher.watcher import OpenStackWatcherMiddleware
+
+
+class TestHubLagMonitor(unittest.TestCase):
+    def setUp(self):
+        self.registry = inflight.InflightRegistry()
+        self.registry.register(inflight.RequestInfo(
+            'GET', '/v2.1/servers/detail', action='read/list', target_type_uri='service/compute/servers/detail'
+        ))
+        self.client = mock.Mock()
+        self.monitor = eventlet_monitor.HubLagMonitor(
+            self.registry, self.client, threshold=0.1, max_entries=1, logger=mock.Mock()
+        )
+
+    def test_observe_below_threshold(self):
+        self.monitor.observe(0.01)
+        self.client.timing.assert_called_once_with('eventlet_hub_lag_seconds', 10.0)
+        self.assertEqual(self.monitor.stalls, 0)
+        self.assertEqual(len(self.monitor.entries), 0)
+
+    def test_observe_stall(self):
+        self.monitor.observe(0.5)
+        self.monitor.observe(0.2)
+        self.assertEqual(self.monitor.stalls, 2)
+        self.assertEqual(self.monitor.max_lag, 0.5)
+        self.assertEqual(len(self.monitor.entries), 1)
+        self.assertEqual(self.monitor.entries[0]['requests'][0]['action'], 'read/list')
+        self.client.increment.assert_called_with(
+            'eventlet_hub_stalled_requests_total',
+            tags=['action:read/list', 'target_type_uri:service/compute/servers/detail']
+        )
+
+    @unittest.skipUnless(eventlet_monitor.HubLagMonitor.is_supported(), "eventlet not installed")
+    def test_probe_detects_blocking_code(self):
+        import eventlet
+        self.monitor.interval = 0.01
+        self.monitor.ensure_started()
+        try:
+            eventlet.sleep(0)
+            # block the hub
+            time.sleep(0.3)
+            eventlet.sleep(0.05)
+        finally:
+            self.monitor.stop()
+        self.assertGreaterEqual(self.monitor.max_lag, 0.2)
+
+    def test_debug_info(self):
+        watcher = OpenStackWatcherMiddleware(fake.FakeApp(), {'service_type': 'compute', 'debug_enabled': 'true'})
+        # the monitor is only created by the middleware if eventlet is installed
+        watcher.eventlet_monitor = self.monitor
+        self.monitor.observe(0.5, now=1000.0)
+
+        resp = Request.blank('/watcher/debug', remote_addr='127.0.0.1').get_response(watcher)
+        self.assertEqual(resp.status_int, 200)
+        self.assertEqual(resp.json['eventlet_hub_stalls'], {
+            'stalls': 1,
+            'max_lag': 0.5,
+            'entries': [{
+                'time': 1000.0,
+                'lag': 0.5,
+                'requests': [{
+                    'action': 'read/list', 'target_type_uri': 'service/compute/servers/detail',
+                    'method': 'GET', 'path': '/v2.1/servers/detail'
+                }]
+            }]
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from webob import Request
+
+from . import fake
+from watcher import batching
+from watcher import events
+from watcher.watcher import OpenStackWatcherMiddleware
+
+
+def create_record(**kwargs):
+    attributes = dict(
+        time=1500000000.5, duration=0.1, method='GET', path='/v2.1/servers', status='200', action='read/list',
+        target_type_uri='service/compute/servers', target_project_id='b206a1900310484f8a9504754c84b067',
+        initiator_project_id='b206a1900310484f8a9504754c84b067', initiator_domain_id='default',
+        initiator_user_id='4c3b2a1d0e9f8a7b6c5d4e3f2a1b0c9d', initiator_host_address='10.0.0.1', request_id='req-1'
+    )
+    attributes.update(kwargs)
+    return events.EventRecord(**attributes)
+
+
+class TestBatchWriter(unittest.TestCase):
+    def test_batches(self):
+        batches = []
+        writer = batching.BatchWriter('test', batches.append, batch_size=2, flush_interval=60)
+        for record in range(5):
+            self.assertTrue(writer.put(record))
+        self.assertEqual(writer.flush(), 5)
+        self.assertEqual(batches, [[0, 1], [2, 3], [4]])
+        self.assertEqual(writer.written, 5)
+
+    def test_drop_newest(self):
+        batches = []
+        writer = batching.BatchWriter('test', batches.append, max_queue=2, drop_policy=batching.DROP_NEWEST)
+        self.assertEqual([writer.put(record) for record in range(3)], [True, True, False])
+        writer.flush()
+        self.assertEqual(batches, [[0, 1]])
+        self.assertEqual(writer.dropped, 1)
+
+    def test_drop_oldest(self):
+        batches = []
+        writer = batching.BatchWriter('test', batches.append, max_queue=2, drop_policy=batching.DROP_OLDEST)
+        for record in range(3):
+            writer.put(record)
+        writer.flush()
+        self.assertEqual(batches, [[1, 2]])
+        self.assertEqual(writer.dropped, 1)
+
+    def test_invalid_drop_policy(self):
+        self.assertRaises(ValueError, batching.BatchWriter, 'test', None, drop_policy='random')
+
+    def test_failing_handler(self):
+        def handler(batch):
+            raise IOError('collector down')
+
+        writer = batching.BatchWriter('test', handler, logger=mock.Mock())
+        writer.put(1)
+        writer.flush()
+        self.assertEqual((writer.written, writer.failed), (0, 1))
+
+    def test_full_batch_wakes_writer(self):
+        handled = threading.Event()
+        writer = batching.BatchWriter('test', lambda batch: handled.set(), batch_size=2, flush_interval=60)
+        writer.ensure_started()
+        try:
+            writer.put(1)
+            writer.put(2)
+            self.assertTrue(handled.wait(5))
+        finally:
+            writer.stop(5)
+
+
+class TestEvents(unittest.TestCase):
+    def test_build_event(self):
+        record = events.EventRecord(
+            1500000000.5, 0.1, 'GET', '/v2.1/servers', '404', 'read/list', 'service/compute/servers',
+            'b206a1900310484f8a9504754c84b067', 'b206a1900310484f8a9504754c84b067', 'default',
+            '4c3b2a1d0e9f8a7b6c5d4e3f2a1b0c9d', '10.0.0.1', 'req-1'
+        )
+        cadf_event = events.build_event(record, 'service/compute')
+        self.assertEqual(cadf_event['eventTime'], '2017-07-14T02:40:00.500000+0000')
+        self.assertEqual(cadf_event['action'], 'read/list')
+        self.assertEqual(cadf_event['outcome'], 'failure')
+        self.assertEqual(cadf_event['reason'], {'reasonType': 'HTTP', 'reasonCode': '404'})
+        self.assertEqual(cadf_event['initiator']['project_id'], 'b206a1900310484f8a9504754c84b067')
+        self.assertEqual(cadf_event['initiator']['host']['address'], '10.0.0.1')
+        self.assertEqual(cadf_event['target']['typeURI'], 'service/compute/servers')
+        self.assertEqual(cadf_event['target']['name'], 'service/compute')
+        self.assertEqual(cadf_event['observer'], {'id': 'target'})
+        self.assertEqual(cadf_event['requestId'], 'req-1')
+
+    def test_aggregator(self):
+        aggregator = events.EventAggregator(['read'], interval=60, max_keys=2)
+        self.assertTrue(aggregator.matches('read'))
+        self.assertTrue(aggregator.matches('read/list'))
+        self.assertFalse(aggregator.matches('readonly'))
+        self.assertFalse(aggregator.matches('update'))
+
+        self.assertEqual(aggregator.add(create_record(time=10), 100), [])
+        self.assertEqual(aggregator.add(create_record(time=20, request_id='req-2'), 110), [])
+        self.assertEqual(aggregator.add(create_record(time=30, status='500'), 120), [])
+        self.assertEqual(len(aggregator.window), 2)
+        self.assertEqual(aggregator.flush(159), [])
+
+        aggregates = sorted(aggregator.flush(160), key=lambda aggregate: aggregate.record.status)
+        self.assertEqual([(a.record.time, a.count, a.last) for a in aggregates], [(10, 2, 20), (30, 1, 30)])
+        self.assertEqual(aggregator.window, {})
+
+    def test_aggregator_max_keys(self):
+        aggregator = events.EventAggregator(['read'], max_keys=2)
+        aggregator.add(create_record(initiator_user_id='a'), 0)
+        aggregator.add(create_record(initiator_user_id='b'), 0)
+        emitted = aggregator.add(create_record(initiator_user_id='c'), 0)
+        self.assertEqual(sorted(a.record.initiator_user_id for a in emitted), ['a', 'b'])
+        self.assertEqual(len(aggregator.window), 1)
+        self.assertEqual(aggregator.overflows, 1)
+
+    def test_emitter_aggregates(self):
+        written = []
+        sink = mock.Mock()
+        sink.write.side_effect = written.extend
+        emitter = events.EventEmitter(sink, 'service/compute', aggregator=events.EventAggregator(['read']))
+        for i in range(3):
+            emitter.emit(create_record(time=1500000000 + i, request_id='req-{0}'.format(i)))
+        emitter.emit(create_record(action='update'))
+        emitter.writer.run_once()
+        self.assertEqual([event['action'] for event in written], ['update'])
+
+        emitter.stop()
+        cadf_event = written[-1]
+        self.assertEqual(cadf_event['action'], 'read/list')
+        self.assertEqual(cadf_event['count'], 3)
+        self.assertEqual(cadf_event['firstEventTime'], '2017-07-14T02:40:00.000000+0000')
+        self.assertEqual(cadf_event['lastEventTime'], '2017-07-14T02:40:02.000000+0000')
+        self.assertNotIn('requestId', cadf_event)
+
+    def test_middleware(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'events.log')
+            watcher = OpenStackWatcherMiddleware(
+                fake.FakeApp(),
+                {
+                    'service_type': 'compute',
+                    'cadf_events_enabled': 'true',
+                    'cadf_events_sink': 'file',
+                    'cadf_events_path': path
+                }
+            )
+            watcher.metric_client = mock.Mock()
+            req = Request.blank('/v2.1/servers')
+            req.headers['X-Project-Id'] = 'b206a1900310484f8a9504754c84b067'
+            req.get_response(watcher)
+            watcher.event_emitter.stop(5)
+
+            with open(path) as f:
+                lines = f.readlines()
+            self.assertEqual(len(lines), 1)
+            cadf_event = json.loads(lines[0])
+            self.assertEqual(cadf_event['action'], 'read')
+            self.assertEqual(cadf_event['outcome'], 'success')
+            self.assertEqual(cadf_event['target']['typeURI'], 'service/compute/servers')
+            self.assertEqual(cadf_event['initiator']['project_id'], 'b206a1900310484f8a9504754c84b067')
+            self.assertEqual(cadf_event['requestPath'], '/v2.1/servers')
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import unittest
+
+from webob import Request
+
+from . import fake
+from watcher import errors
+from watcher import filters
+from watcher.watcher import OpenStackWatcherMiddleware
+
+PROJECT_ID = 'b206a1900310484f8a9504754c84b067'
+
+
+class TestFilters(unittest.TestCase):
+    def test_match(self):
+        event_filter = filters.EventFilter([
+            {'action': 'read', 'status': '2xx', 'events': False},
+            {'target_type_uri': ['service/compute/os-hypervisors.*', 'service/compute/os-services'],
+             'initiator_project_id': PROJECT_ID, 'detail_metrics': 'false'},
+            {'status': [404, '5xx'], 'events': True, 'detail_metrics': False},
+        ])
+        self.assertEqual(
+            event_filter.match('read/list', 'service/compute/servers', PROJECT_ID, '200'),
+            filters.Decision(events=False, detail_metrics=True)
+        )
+        self.assertEqual(
+            event_filter.match('read', 'service/compute/servers', PROJECT_ID, '403'), filters.DEFAULT_DECISION
+        )
+        self.assertEqual(
+            event_filter.match('update', 'service/compute/os-hypervisors/os-hypervisor', PROJECT_ID, '202'),
+            filters.Decision(events=True, detail_metrics=False)
+        )
+        # the pattern must match the complete target type URI
+        self.assertEqual(
+            event_filter.match('update', 'service/compute/os-services/os-service', PROJECT_ID, '202'),
+            filters.DEFAULT_DECISION
+        )
+        self.assertEqual(
+            event_filter.match('update', 'service/compute/os-services', 'other', '202'), filters.DEFAULT_DECISION
+        )
+        self.assertEqual(
+            event_filter.match('create', 'service/compute/servers', PROJECT_ID, '503'),
+            filters.Decision(events=True, detail_metrics=False)
+        )
+        self.assertEqual(
+            event_filter.match('readonly', 'service/compute/servers', PROJECT_ID, 'unknown'), filters.DEFAULT_DECISION
+        )
+
+    def test_invalid_rules(self):
+        for rule in ({'status': '4x'}, {'target_type_uri': '('}, {'method': 'GET'}, 'read'):
+            self.assertRaises(errors.ConfigError, filters.compile_rule, rule)
+        logger = mock.Mock()
+        event_filter = filters.EventFilter([{'status': 'ok'}, {'action': 'read', 'events': False}], logger=logger)
+        self.assertEqual(len(event_filter.rules), 1)
+        self.assertTrue(logger.warning.called)
+
+    def test_middleware(self):
+        watcher = OpenStackWatcherMiddleware(fake.FakeApp(), {'service_type': 'compute', 'cadf_events_enabled': 'true'})
+        watcher.event_filter = filters.EventFilter([{'action': 'read', 'events': False, 'detail_metrics': False}])
+        watcher.metric_client = mock.Mock()
+        watcher.event_emitter = mock.Mock()
+
+        req = Request.blank('/v2.1/servers')
+        req.headers['X-Project-Id'] = PROJECT_ID
+        req.get_response(watcher)
+        self.assertFalse(watcher.event_emitter.emit.called)
+        tags = watcher.metric_client.increment.call_args[1]['tags']
+        self.assertNotIn('initiator_project_id:{0}'.format(PROJECT_ID), tags)
+
+        req = Request.blank('/v2.1/servers', method='POST')
+        req.headers['X-Project-Id'] = PROJECT_ID
+        req.get_response(watcher)
+        self.assertTrue(watcher.event_emitter.emit.called)
+        tags = watcher.metric_client.increment.call_args[1]['tags']
+        self.assertIn('initiator_project_id:{0}'.format(PROJECT_ID), tags)
+
+
+if __name__ == '__main__':
+    unittest.main()
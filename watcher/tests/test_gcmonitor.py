@@ -0,0 +1,77 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import gc
+import mock
+import unittest
+
+from webob import Request
+
+from watcher import gcmonitor
+from watcher import inflight
+from watcher.watcher import OpenStackWatcherMiddleware
+
+
+@unittest.skipUnless(gcmonitor.GCMonitor.is_supported(), "gc.callbacks not supported")
+class TestGCMonitor(unittest.TestCase):
+    def test_attribution(self):
+        registry = inflight.InflightRegistry()
+        info = registry.register(inflight.RequestInfo('GET', '/v2.1/servers', action='read/list'))
+        monitor = gcmonitor.GCMonitor(registry, min_generation=2)
+        monitor.install()
+        try:
+            gc.collect(1)
+            gc.collect(2)
+        finally:
+            monitor.uninstall()
+
+        pauses = monitor.drain()
+        self.assertEqual([generation for generation, _ in pauses], [2])
+        self.assertEqual(monitor.drain(), [])
+        self.assertEqual(info.gc_collections, 1)
+        self.assertAlmostEqual(info.gc_pause, pauses[0][1])
+        self.assertNotIn(monitor._callback, gc.callbacks)
+
+    def test_middleware(self):
+        def collecting_app(environ, start_response):
+            gc.collect()
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [b'collected']
+
+        watcher = OpenStackWatcherMiddleware(
+            collecting_app,
+            {
+                'service_type': 'compute',
+                'gc_monitor_enabled': 'true'
+            }
+        )
+        watcher.metric_client = mock.Mock()
+        try:
+            _, _, app_iter = Request.blank('/v2.1/servers').call_application(watcher)
+            app_iter.close()
+        finally:
+            watcher.gc_monitor.uninstall()
+
+        timings = [c[0][0] for c in watcher.metric_client.timing.call_args_list]
+        self.assertIn('gc_pause_seconds', timings)
+        self.assertIn('api_requests_gc_pause_seconds', timings)
+        watcher.metric_client.increment.assert_any_call(
+            'api_requests_gc_collections_total', 1,
+            tags=['service_name:service/compute', 'service:compute', 'action:read',
+                  'target_type_uri:service/compute/servers', 'status:200']
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
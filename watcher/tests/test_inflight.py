@@ -0,0 +1,140 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import shutil
+import tempfile
+import time
+import unittest
+
+from webob import Request
+
+from . import fake
+from watcher import inflight
+from watcher.watcher import OpenStackWatcherMiddleware
+
+
+class TestInflight(unittest.TestCase):
+    def test_counts(self):
+        registry = inflight.InflightRegistry()
+        a = registry.register(inflight.RequestInfo('GET', '/v2.1/servers', action='read/list', target_type_uri='servers'))
+        b = registry.register(inflight.RequestInfo('GET', '/v2.1/servers', action='read/list', target_type_uri='servers'))
+        registry.register(inflight.RequestInfo('POST', '/v2.1/servers', action='create', target_type_uri='servers'))
+        self.assertEqual(registry.count('read/list', 'servers'), 2)
+        self.assertEqual(len(registry), 3)
+
+        registry.unregister(a)
+        registry.unregister(a)
+        self.assertEqual(registry.counts(), {('read/list', 'servers'): 1, ('create', 'servers'): 1})
+        registry.unregister(b)
+        self.assertEqual(registry.count('read/list', 'servers'), 0)
+        self.assertEqual(registry.count('delete', 'servers'), 0)
+
+    def setUp(self):
+        self.worker_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.worker_dir)
+
+    def test_middleware_inflight_gauge(self):
+        watcher = OpenStackWatcherMiddleware(
+            fake.FakeApp(),
+            {
+                'service_type': 'compute',
+                'inflight_metric_enabled': 'true',
+                'inflight_worker_dir': self.worker_dir
+            }
+        )
+        watcher.metric_client = mock.Mock()
+        _, _, app_iter = Request.blank('/v2.1/servers').call_application(watcher)
+        tags = [
+            'service_name:service/compute', 'service:compute', 'action:read', 'target_type_uri:service/compute/servers',
+            'worker:0'
+        ]
+        watcher.metric_client.gauge.assert_called_once_with('api_requests_inflight', 1, tags=tags)
+        app_iter.close()
+        watcher.metric_client.gauge.assert_called_with('api_requests_inflight', 0, tags=tags)
+
+    def test_middleware_inflight_gauge_workers(self):
+        # the last value per metric and tags, as kept by the statsd agent
+        gauges = {}
+
+        def gauge(metric, value, tags=None):
+            gauges[(metric, tuple(tags))] = value
+
+        def in_flight():
+            return sum(value for (metric, _), value in gauges.items() if metric == 'api_requests_inflight')
+
+        seen = []
+
+        def second_worker_app(environ, start_response):
+            seen.append(in_flight())
+            return fake.FakeApp()(environ, start_response)
+
+        config = {'service_type': 'compute', 'inflight_metric_enabled': 'true', 'inflight_worker_dir': self.worker_dir}
+        second = OpenStackWatcherMiddleware(second_worker_app, config)
+
+        def first_worker_app(environ, start_response):
+            # the second worker handles a request while the first one is still busy
+            _, _, app_iter = Request.blank('/v2.1/servers').call_application(second)
+            app_iter.close()
+            return fake.FakeApp()(environ, start_response)
+
+        first = OpenStackWatcherMiddleware(first_worker_app, config)
+        first.metric_client = second.metric_client = mock.Mock(gauge=mock.Mock(side_effect=gauge))
+        _, _, app_iter = Request.blank('/v2.1/servers').call_application(first)
+        app_iter.close()
+
+        # the gauge of the first worker is not overwritten by the second one
+        self.assertEqual(seen, [2])
+        self.assertEqual(in_flight(), 0)
+        self.assertEqual(sorted(tags[-1] for _, tags in gauges), ['worker:0', 'worker:1'])
+
+        # a restarted worker takes over the index and thereby the series of the dead one
+        first.worker_slot.close()
+        restarted = OpenStackWatcherMiddleware(fake.FakeApp(), config)
+        restarted.metric_client = first.metric_client
+        _, _, app_iter = Request.blank('/v2.1/servers').call_application(restarted)
+        app_iter.close()
+        self.assertEqual(sorted(tags[-1] for _, tags in gauges), ['worker:0', 'worker:1'])
+
+    def test_middleware_queue_duration(self):
+        watcher = OpenStackWatcherMiddleware(
+            fake.FakeApp(),
+            {
+                'service_type': 'compute',
+                'queue_time_metric_enabled': 'true'
+            }
+        )
+        watcher.metric_client = mock.Mock()
+        req = Request.blank('/v2.1/servers')
+        req.headers['X-Request-Start'] = 't={0:.3f}'.format(time.time() - 0.25)
+        req.get_response(watcher)
+
+        queue_timings = [
+            c for c in watcher.metric_client.timing.call_args_list if c[0][0] == 'api_requests_queue_duration_seconds'
+        ]
+        self.assertEqual(len(queue_timings), 1)
+        self.assertAlmostEqual(queue_timings[0][0][1], 250, delta=50)
+
+        # requests without the header are not measured
+        watcher.metric_client.reset_mock()
+        Request.blank('/v2.1/servers').get_response(watcher)
+        self.assertNotIn(
+            'api_requests_queue_duration_seconds', [c[0][0] for c in watcher.metric_client.timing.call_args_list]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from webob import Request
+
+from watcher import memprofiler
+from watcher.watcher import OpenStackWatcherMiddleware
+
+
+def allocating_app(environ, start_response):
+    transient = [bytearray(1024) for _ in range(1024)]
+    del transient
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'allocated']
+
+
+@unittest.skipUnless(memprofiler.AllocationSampler.is_supported(), "tracemalloc not supported")
+class TestAllocationSampler(unittest.TestCase):
+    def test_sampling(self):
+        sampler = memprofiler.AllocationSampler(sample_rate=1.0, top_sites=2)
+        self.assertTrue(sampler.start())
+        # only one request is traced at a time
+        self.assertFalse(sampler.start())
+        keep = [bytearray(1024) for _ in range(512)]
+        peak, net = sampler.stop('read/list', 'service/compute/servers')
+        self.assertFalse(memprofiler.tracemalloc.is_tracing())
+        self.assertGreaterEqual(net, 512 * 1024)
+        self.assertGreaterEqual(peak, net)
+        del keep
+
+        allocations = sampler.to_list(reset=True)
+        self.assertEqual(len(allocations), 1)
+        self.assertEqual(allocations[0]['action'], 'read/list')
+        self.assertEqual(allocations[0]['requests'], 1)
+        self.assertLessEqual(len(allocations[0]['top_sites']), 2)
+        self.assertIn('test_memprofiler.py', allocations[0]['top_sites'][0]['site'])
+        self.assertEqual(sampler.to_list(), [])
+
+    def test_not_sampled(self):
+        sampler = memprofiler.AllocationSampler(sample_rate=0.0)
+        self.assertFalse(sampler.start())
+        self.assertFalse(memprofiler.tracemalloc.is_tracing())
+
+    def test_max_keys(self):
+        sampler = memprofiler.AllocationSampler(max_keys=1)
+        sampler.record('read', 'a', 10, 5, [('a.py:1', 10)])
+        sampler.record('read', 'b', 20, 5, [('b.py:1', 20)])
+        sampler.record('read', 'c', 30, 5, [('c.py:1', 30)])
+        allocations = sampler.to_list()
+        self.assertEqual(
+            [(entry['target_type_uri'], entry['requests'], entry['peak_max_bytes']) for entry in allocations],
+            [('truncated', 2, 30), ('a', 1, 10)]
+        )
+
+    def test_middleware(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            dump_path = os.path.join(tmp_dir, 'allocations.json')
+            watcher = OpenStackWatcherMiddleware(
+                allocating_app,
+                {
+                    'service_type': 'compute',
+                    'allocation_sampling_enabled': 'true',
+                    'allocation_sample_rate': '1.0',
+                    'allocation_sampling_dump_path': dump_path,
+                    'allocation_sampling_dump_interval': '0'
+                }
+            )
+            watcher.metric_client = mock.Mock()
+            # tracing stops once the application returned, even if the server never closes the response
+            Request.blank('/v2.1/servers').call_application(watcher)
+            self.assertFalse(memprofiler.tracemalloc.is_tracing())
+
+            tags = ['service_name:service/compute', 'service:compute', 'action:read',
+                    'target_type_uri:service/compute/servers', 'status:200']
+            histograms = dict((c[0][0], c[0][1]) for c in watcher.metric_client.histogram.call_args_list)
+            self.assertGreaterEqual(histograms['api_requests_memory_peak_bytes'], 1024 * 1024)
+            watcher.metric_client.histogram.assert_any_call(
+                'api_requests_memory_net_bytes', histograms['api_requests_memory_net_bytes'], tags=tags
+            )
+
+            with open(dump_path) as f:
+                self.assertEqual(json.load(f)[0]['target_type_uri'], 'service/compute/servers')
+
+            # the next request is sampled as well
+            Request.blank('/v2.1/servers').get_response(watcher)
+            self.assertEqual(watcher.allocation_sampler.sampled, 2)
+
+            # tracing is stopped if the application fails
+            def failing_app(environ, start_response):
+                raise RuntimeError('failed')
+
+            watcher.app = failing_app
+            self.assertRaises(RuntimeError, Request.blank('/v2.1/servers').call_application, watcher)
+            self.assertFalse(memprofiler.tracemalloc.is_tracing())
+            self.assertEqual(watcher.allocation_sampler.sampled, 3)
+
+            # other clients can neither read nor reset the allocation sites
+            resp = Request.blank('/watcher/allocations?reset=true', remote_addr='10.0.0.1').get_response(watcher)
+            self.assertEqual(resp.status_int, 403)
+
+            resp = Request.blank('/watcher/allocations', remote_addr='127.0.0.1').get_response(watcher)
+            self.assertEqual(resp.status_int, 200)
+            self.assertEqual(sum(entry['requests'] for entry in resp.json), 3)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import threading
+import unittest
+
+from webob import Request
+
+from . import fake
+from watcher import inflight
+from watcher import profiler
+from watcher.watcher import OpenStackWatcherMiddleware
+
+
+def _handle_slow_request(registry, started, release):
+    info = registry.register(inflight.RequestInfo(
+        'GET', '/v2.1/servers', action='read/list', target_type_uri='service/compute/servers'
+    ))
+    started.set()
+    release.wait(5)
+    registry.unregister(info)
+
+
+class TestProfiler(unittest.TestCase):
+    def test_sample(self):
+        registry = inflight.InflightRegistry()
+        started = threading.Event()
+        release = threading.Event()
+        thread = threading.Thread(target=_handle_slow_request, args=(registry, started, release))
+        thread.start()
+        try:
+            started.wait(5)
+            p = profiler.SamplingProfiler(registry, max_stacks=1)
+            p.sample()
+            p.sample()
+        finally:
+            release.set()
+            thread.join()
+
+        self.assertEqual(len(registry), 0)
+        stack, count = p.collapsed().strip().rsplit(' ', 1)
+        self.assertEqual(count, '2')
+        self.assertTrue(stack.startswith('read/list;service/compute/servers;'))
+        self.assertIn('_handle_slow_request', stack)
+        self.assertEqual(p.samples, 2)
+
+        self.assertNotEqual(p.collapsed(reset=True), '')
+        self.assertEqual(p.collapsed(), '')
+
+    def test_collapse_stack_max_depth(self):
+        def inner():
+            import sys
+            return profiler.collapse_stack(sys._getframe(), 2)
+        stack = inner()
+        self.assertEqual(len(stack.split(';')), 2)
+        self.assertIn('inner', stack.split(';')[-1])
+
+    def test_middleware(self):
+        watcher = OpenStackWatcherMiddleware(
+            fake.FakeApp(),
+            {
+                'service_type': 'compute',
+                'profiler_enabled': 'true',
+                'profiler_interval': '60'
+            }
+        )
+        try:
+            _, _, app_iter = Request.blank('/v2.1/servers').call_application(watcher)
+            self.assertEqual(len(watcher.inflight), 1)
+            app_iter.close()
+            self.assertEqual(len(watcher.inflight), 0)
+
+            resp = Request.blank('/watcher/profile', remote_addr='127.0.0.1').get_response(watcher)
+            self.assertEqual(resp.status_int, 200)
+            self.assertEqual(resp.content_type, 'text/plain')
+
+            # other clients can neither read nor reset the stacks
+            watcher.profiler.stacks['read;servers'] = 1
+            resp = Request.blank('/watcher/profile?reset=true', remote_addr='10.0.0.1').get_response(watcher)
+            self.assertEqual(resp.status_int, 403)
+            self.assertEqual(watcher.profiler.stacks, {'read;servers': 1})
+        finally:
+            watcher.profiler.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+from webob import Request
+
+from . import fake
+from watcher import prometheus
+from watcher.watcher import OpenStackWatcherMiddleware
+
+
+class TestPrometheus(unittest.TestCase):
+    def test_counter(self):
+        registry = prometheus.Registry(namespace='openstack_watcher')
+        counter = registry.counter('api_requests_total', 'total count of api requests')
+        for _ in range(prometheus.DRAIN_THRESHOLD + 10):
+            counter.inc(['service:compute', 'action:read'])
+        counter.inc(['service:compute', 'action:create'], 2)
+
+        rendered = registry.render()
+        self.assertIn(
+            'openstack_watcher_api_requests_total{{service="compute",action="read"}} {0}'
+            .format(prometheus.DRAIN_THRESHOLD + 10),
+            rendered
+        )
+        self.assertIn('openstack_watcher_api_requests_total{service="compute",action="create"} 2', rendered)
+        self.assertIn('# TYPE openstack_watcher_api_requests_total counter', rendered)
+
+        openmetrics = registry.render(openmetrics=True)
+        self.assertIn('# TYPE openstack_watcher_api_requests counter', openmetrics)
+        self.assertTrue(openmetrics.endswith('# EOF\n'))
+
+    def test_histogram(self):
+        registry = prometheus.Registry()
+        histogram = registry.histogram('duration_seconds', 'latency', buckets=[0.1, 1])
+        histogram.observe(['action:read'], 0.05)
+        histogram.observe(['action:read'], 0.5)
+        histogram.observe(['action:read'], 5)
+
+        rendered = registry.render()
+        self.assertIn('duration_seconds_bucket{action="read",le="0.1"} 1', rendered)
+        self.assertIn('duration_seconds_bucket{action="read",le="1.0"} 2', rendered)
+        self.assertIn('duration_seconds_bucket{action="read",le="+Inf"} 3', rendered)
+        self.assertIn('duration_seconds_count{action="read"} 3', rendered)
+        self.assertIn('duration_seconds_sum{action="read"} 5.55', rendered)
+
+    def test_histogram_exemplar(self):
+        registry = prometheus.Registry()
+        histogram = registry.histogram('duration_seconds', 'latency', buckets=[0.1, 1])
+        histogram.observe(['action:read'], 0.5, ['request_id:req-1'])
+        histogram.observe(['action:read'], 0.7, ['request_id:req-2'])
+
+        self.assertIn('duration_seconds_bucket{action="read",le="1.0"} 2\n', registry.render())
+        openmetrics = registry.render(openmetrics=True)
+        self.assertIn('duration_seconds_bucket{action="read",le="0.1"} 0\n', openmetrics)
+        self.assertIn('duration_seconds_bucket{action="read",le="1.0"} 2 # {request_id="req-2"} 0.7 ', openmetrics)
+
+    def test_escape_label_value(self):
+        self.assertEqual(prometheus.format_labels(['path:a"b\\c']), '{path="a\\"b\\\\c"}')
+
+    def test_middleware_exposition(self):
+        watcher = OpenStackWatcherMiddleware(
+            fake.FakeApp(),
+            {
+                'service_type': 'compute',
+                'prometheus_enabled': 'true'
+            }
+        )
+        Request.blank('/v2.1/servers').get_response(watcher)
+
+        resp = Request.blank('/watcher/metrics', remote_addr='127.0.0.1').get_response(watcher)
+        self.assertEqual(resp.status_int, 200)
+        self.assertEqual(resp.content_type, 'text/plain')
+        self.assertIn(
+            'openstack_watcher_api_requests_duration_seconds_count{service_name="service/compute",service="compute",'
+            'action="read",target_type_uri="service/compute/servers",status="200"} 1',
+            resp.text
+        )
+        # the metrics endpoint is answered by the middleware and not counted
+        self.assertNotIn('target_type_uri="service/compute/watcher/metrics"', resp.text)
+
+        # only scrapers from the admin_allowed_addresses get the metrics
+        resp = Request.blank('/watcher/metrics', remote_addr='10.0.0.1').get_response(watcher)
+        self.assertEqual(resp.status_int, 403)
+        self.assertNotIn('openstack_watcher_api_requests', resp.text)
+
+    def test_middleware_exposition_disabled(self):
+        watcher = OpenStackWatcherMiddleware(fake.FakeApp(), {'service_type': 'compute'})
+        resp = Request.blank('/watcher/metrics', remote_addr='127.0.0.1').get_response(watcher)
+        self.assertEqual(resp.json_body, '{"message":"fake app"}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+import json
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from webob import Request
+
+from .test_accesslog import create_record
+from benchmarks import fake
+from benchmarks import replay
+from watcher import accesslog
+from watcher.watcher import OpenStackWatcherMiddleware
+
+
+def create_args(**kwargs):
+    attributes = dict(
+        service_type='compute', config_file=None, option=[], mode='inprocess', pacing='max', workers=1,
+        processes=False, app_latency=False
+    )
+    attributes.update(kwargs)
+    return argparse.Namespace(**attributes)
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load_capture(self):
+        path = os.path.join(self.tmp_dir, 'capture.jsonl.gz')
+        watcher = OpenStackWatcherMiddleware(
+            fake.FakeApp(status=202),
+            {'service_type': 'compute', 'capture_enabled': 'true', 'capture_path': path}
+        )
+        watcher.metric_client = mock.Mock()
+        req = Request.blank('/v2.1/servers/0ef3e5e6-a3f4-4b2f-a1c4-3a7c8b7b4b6e/action?token=abc', method='POST')
+        req.headers['X-Project-Id'] = 'b206a1900310484f8a9504754c84b067'
+        req.headers['X-Auth-Token'] = 'secret-token'
+        req.content_type = 'application/json'
+        req.body = json.dumps({'os-start': None}).encode('utf-8')
+        req.get_response(watcher)
+        watcher.capture.stop(5)
+
+        requests = replay.load_requests(path)
+        self.assertEqual(len(requests), 1)
+        request = requests[0]
+        self.assertEqual(request['method'], 'POST')
+        self.assertEqual(request['path'], '/v2.1/servers/0ef3e5e6-a3f4-4b2f-a1c4-3a7c8b7b4b6e/action')
+        self.assertEqual(request['query_string'], 'token=***')
+        # redacted headers are not replayed
+        self.assertEqual(request['headers'], {
+            'X-Project-Id': 'b206a1900310484f8a9504754c84b067', 'Content-Type': 'application/json'
+        })
+        self.assertEqual(json.loads(request['body'].decode('utf-8')), {'os-start': None})
+        self.assertEqual(request['status'], '202')
+
+        # the replayed request is classified like the captured one
+        environ = replay.build_environ(request, create_args())
+        replay.call_inprocess(watcher, environ)
+        self.assertEqual(environ['WATCHER.ACTION'], 'update/os-start')
+        self.assertEqual(environ['WATCHER.INITIATOR_PROJECT_ID'], 'b206a1900310484f8a9504754c84b067')
+
+    def test_load_access_log(self):
+        path = os.path.join(self.tmp_dir, 'access.log')
+        access_log = accesslog.AccessLog(path, 'service/compute')
+        access_log.log(create_record())
+        access_log.log(create_record(time=1500000001.25, method='DELETE', status='204', initiator_user_id='unknown'))
+        access_log.stop()
+
+        requests = replay.load_requests(path)
+        self.assertEqual(requests, [
+            dict(time=1500000000.5, method='GET', path='/v2.1/servers', query_string=None, headers={
+                'X-Project-Id': 'b206a1900310484f8a9504754c84b067', 'X-Domain-Id': 'default',
+                'X-User-Id': '4c3b2a1d0e9f8a7b6c5d4e3f2a1b0c9d'
+            }, body=None, status='200', duration=0.25),
+            dict(time=1500000001.25, method='DELETE', path='/v2.1/servers', query_string=None, headers={
+                'X-Project-Id': 'b206a1900310484f8a9504754c84b067', 'X-Domain-Id': 'default'
+            }, body=None, status='204', duration=0.25),
+        ])
+
+    def test_server_mode(self):
+        requests = [dict(
+            time=0, method='GET', path='/v2.1/servers', query_string=None, headers={}, body=None, status='200',
+            duration=0
+        )]
+        rate, latencies = replay.run(create_args(mode='server', workers=2), requests * 4, True)
+        self.assertEqual(len(latencies), 4)
+        self.assertGreater(rate, 0)
+        self.assertEqual([t for t in threading.enumerate() if t.name == 'replay-server' and t.is_alive()], [])
+
+        # the server is shut down if the replay fails
+        with mock.patch('multiprocessing.Process', side_effect=RuntimeError('interrupted')):
+            self.assertRaises(RuntimeError, replay.run, create_args(mode='server', processes=True), requests, True)
+        for thread in threading.enumerate():
+            if thread.name == 'replay-server':
+                thread.join(5)
+                self.assertFalse(thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
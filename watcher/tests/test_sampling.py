@@ -0,0 +1,69 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import time
+import unittest
+
+from webob import Request
+
+from . import fake
+from watcher import sampling
+from watcher.watcher import OpenStackWatcherMiddleware
+
+
+class TestSampling(unittest.TestCase):
+    def test_rates(self):
+        sampler = sampling.Sampler(
+            metric_rates={'api_requests_duration_seconds': 0.5},
+            action_rates={'read/list': 0.1}
+        )
+        self.assertEqual(sampler.rate('api_requests_total', 'create'), 1.0)
+        self.assertEqual(sampler.rate('api_requests_total', 'read/list'), 0.1)
+        self.assertEqual(sampler.rate('api_requests_duration_seconds', 'create'), 0.5)
+        self.assertEqual(sampler.rate('api_requests_duration_seconds', 'read/list'), 0.1)
+
+    def test_adaptive(self):
+        sampler = sampling.Sampler(adaptive_threshold=100, adaptive_min_rate=0.05)
+        now = time.time()
+        for _ in range(1000):
+            self.assertEqual(sampler.rate('api_requests_total', now=now), 1.0)
+        # 1000 emits within the last second, 10 times the threshold
+        self.assertAlmostEqual(sampler.rate('api_requests_total', now=now + 1), 0.1, places=2)
+
+        # the factor never lowers the rate below the minimum
+        for _ in range(100000):
+            sampler.rate('api_requests_total', now=now + 1.5)
+        self.assertEqual(sampler.rate('api_requests_total', now=now + 2), 0.05)
+
+        # back to normal once the load decreases
+        self.assertEqual(sampler.rate('api_requests_total', now=now + 10), 1.0)
+
+    def test_middleware(self):
+        watcher = OpenStackWatcherMiddleware(
+            fake.FakeApp(),
+            {
+                'service_type': 'compute',
+                'action_sample_rates': 'read:0.1'
+            }
+        )
+        watcher.metric_client = mock.Mock()
+        Request.blank('/v2.1/servers').get_response(watcher)
+
+        self.assertEqual(watcher.metric_client.timing.call_args[1]['sample_rate'], 0.1)
+        self.assertEqual(watcher.metric_client.increment.call_args[1]['sample_rate'], 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
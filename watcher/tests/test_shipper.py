@@ -0,0 +1,271 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import mock
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+import zlib
+
+from six.moves import BaseHTTPServer
+
+from watcher import codec
+from watcher import events
+from watcher import shipper
+from watcher import spool
+
+
+class Collector(BaseHTTPServer.HTTPServer):
+    """
+    local stand-in for a collector answering with the queued status codes and 200 afterwards
+    """
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), CollectorHandler)
+        self.batches = []
+        self.clients = set()
+        self.statuses = []
+        self.keys = []
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/events'.format(self.server_address[1])
+
+    @property
+    def events(self):
+        return [event for batch in self.batches for event in batch]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class CollectorHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        self.server.clients.add(self.client_address)
+        self.server.keys.append(self.headers.get('Idempotency-Key'))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        if status == 200:
+            self.server.batches.append(json.loads(body.decode('utf-8')))
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestShipper(unittest.TestCase):
+    def setUp(self):
+        self.collector = Collector()
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.collector.stop()
+        shutil.rmtree(self.path)
+
+    def test_keep_alive(self):
+        http_shipper = shipper.HttpShipper(self.collector.url)
+        for i in range(3):
+            self.assertTrue(http_shipper.ship([{'action': 'read', 'index': i}]))
+        http_shipper.close()
+        self.assertEqual(self.collector.events, [{'action': 'read', 'index': i} for i in range(3)])
+        self.assertEqual(http_shipper.pool.created, 1)
+        self.assertEqual(len(self.collector.clients), 1)
+
+    def test_retry(self):
+        self.collector.statuses = [503, 500]
+        http_shipper = shipper.HttpShipper(self.collector.url, gzip=False, backoff_base=0.001)
+        self.assertTrue(http_shipper.ship([{'action': 'read'}]))
+        self.assertEqual(http_shipper.retries, 2)
+        self.assertEqual(self.collector.events, [{'action': 'read'}])
+        # every attempt carries the same idempotency key
+        self.assertEqual(len(set(self.collector.keys)), 1)
+        self.assertTrue(self.collector.keys[0])
+
+        self.collector.statuses = [503] * 3
+        http_shipper = shipper.HttpShipper(self.collector.url, max_retries=2, backoff_base=0.001)
+        self.assertRaises(IOError, http_shipper.ship, [{'action': 'update'}])
+
+    def test_rejected(self):
+        self.collector.statuses = [400]
+        http_shipper = shipper.HttpShipper(self.collector.url, backoff_base=0.001)
+        self.assertFalse(http_shipper.ship([{'action': 'read'}]))
+        self.assertEqual(http_shipper.rejected, 1)
+        self.assertEqual(http_shipper.retries, 0)
+
+    def test_pool_retry(self):
+        pool = shipper.ConnectionPool(self.collector.url)
+        response = mock.Mock(status=200)
+        response.getheader.return_value = None
+
+        # a request that could not be sent over a reused connection is sent again over a new one
+        stale = mock.Mock()
+        stale.request.side_effect = socket.error('broken pipe')
+        fresh = mock.Mock()
+        fresh.getresponse.return_value = response
+        with mock.patch.object(pool, '_get', side_effect=[(stale, True), (fresh, False)]):
+            self.assertIs(pool.request('POST', b'[]'), response)
+        fresh.request.assert_called_once_with('POST', '/events', b'[]', {})
+
+        # a request that was sent completely is not sent again, the server might have processed it
+        reused = mock.Mock()
+        reused.getresponse.side_effect = socket.error('connection reset by peer')
+        with mock.patch.object(pool, '_get', side_effect=[(reused, True), (fresh, False)]):
+            self.assertRaises(socket.error, pool.request, 'POST', b'[]')
+        reused.request.assert_called_once_with('POST', '/events', b'[]', {})
+        self.assertEqual(fresh.request.call_count, 1)
+
+    def test_backoff_delay(self):
+        for attempt in range(10):
+            self.assertTrue(0 <= shipper.backoff_delay(attempt, 0.5, 30) <= min(30, 0.5 * 2 ** attempt))
+
+    def test_http_sink(self):
+        emitter = events.EventEmitter(events.HttpSink(shipper.HttpShipper(self.collector.url)), 'service/compute')
+        emitter.emit(events.EventRecord(
+            1500000000.5, 0.1, 'GET', '/v2.1/servers', '200', 'read/list', 'service/compute/servers',
+            'project', 'project', 'domain', 'user', '10.0.0.1', 'req-1'
+        ))
+        emitter.stop()
+        self.assertEqual([event['requestId'] for event in self.collector.events], ['req-1'])
+
+    def test_spool_shipper(self):
+        writer = spool.SpoolWriter(self.path, segment_max_bytes=100, fsync=False, encoder=codec.Encoder())
+        for i in range(5):
+            writer.append([{'action': 'read', 'index': i}, {'action': 'update', 'index': i}])
+
+        spool_shipper = shipper.SpoolShipper(
+            spool.SpoolReader(self.path), shipper.HttpShipper(self.collector.url), batch_size=3, fsync=False
+        )
+        self.assertEqual(spool_shipper.run_once(), 10)
+        self.assertEqual([event['index'] for event in self.collector.events], [i // 2 for i in range(10)])
+        self.assertTrue(all(len(batch) <= 4 for batch in self.collector.batches))
+        # only the last segment is kept
+        reader = spool.SpoolReader(self.path)
+        self.assertEqual(len(reader.segments('writer-0000')), 1)
+        sequence, offset = spool_shipper.load_checkpoint('writer-0000')
+        self.assertEqual(sequence, reader.segments('writer-0000')[0])
+        self.assertEqual(offset, os.path.getsize(reader.segment_path('writer-0000', sequence)))
+
+        # nothing new
+        self.assertEqual(spool_shipper.run_once(), 0)
+        spool_shipper.stop()
+
+        # a restarted shipper continues at the checkpoint within the segment and decodes its dictionary again
+        writer.segment_max_bytes = 1024 * 1024
+        writer.append([{'action': 'read', 'index': 5}])
+        writer.close()
+        spool_shipper = shipper.SpoolShipper(
+            spool.SpoolReader(self.path), shipper.HttpShipper(self.collector.url), fsync=False
+        )
+        self.assertEqual(spool_shipper.run_once(), 1)
+        self.assertEqual(self.collector.events[-1], {'action': 'read', 'index': 5})
+        spool_shipper.stop()
+
+    def test_spool_shipper_collector_down(self):
+        writer = spool.SpoolWriter(self.path, fsync=False, encoder=codec.JsonEncoder())
+        writer.append([{'action': 'read'}])
+        writer.close()
+        self.collector.statuses = [503] * 2
+        spool_shipper = shipper.SpoolShipper(
+            spool.SpoolReader(self.path),
+            shipper.HttpShipper(self.collector.url, max_retries=1, backoff_base=0.001),
+            fsync=False
+        )
+        self.assertRaises(IOError, spool_shipper.run_once)
+        self.assertEqual(spool_shipper.load_checkpoint('writer-0000'), (0, 0))
+        self.assertEqual(spool_shipper.run_once(), 1)
+        self.assertEqual(self.collector.events, [{'action': 'read'}])
+        spool_shipper.stop()
+        # the batch is shipped again with the same idempotency key
+        self.assertEqual(len(self.collector.keys), 3)
+        self.assertEqual(len(set(self.collector.keys)), 1)
+        self.assertIn(':writer-0000:1:0-', self.collector.keys[0])
+
+    def test_spool_shipper_rejected(self):
+        writer = spool.SpoolWriter(self.path, fsync=False, encoder=codec.JsonEncoder())
+        writer.append([{'action': 'read'}, {'action': 'update'}])
+        writer.close()
+        metric_client = mock.Mock()
+        spool_shipper = shipper.SpoolShipper(
+            spool.SpoolReader(self.path), shipper.HttpShipper(self.collector.url), fsync=False,
+            metric_client=metric_client
+        )
+        dead_letter_path = os.path.join(self.path, 'writer-0000', shipper.DEAD_LETTER_FILE)
+
+        # the checkpoint doesn't move past a rejected batch that could not be dead-lettered
+        os.makedirs(dead_letter_path)
+        self.collector.statuses = [400]
+        self.assertRaises((IOError, OSError), spool_shipper.run_once)
+        self.assertEqual(spool_shipper.load_checkpoint('writer-0000'), (0, 0))
+        self.assertEqual(spool_shipper.dead_lettered, 0)
+        os.rmdir(dead_letter_path)
+
+        self.collector.statuses = [400]
+        self.assertEqual(spool_shipper.run_once(), 0)
+        self.assertEqual(self.collector.events, [])
+        with open(dead_letter_path) as f:
+            self.assertEqual([json.loads(line) for line in f], [{'action': 'read'}, {'action': 'update'}])
+        self.assertEqual(spool_shipper.dead_lettered, 2)
+        metric_client.increment.assert_called_once_with('cadf_events_dead_lettered_total', 2)
+        sequence, offset = spool_shipper.load_checkpoint('writer-0000')
+        self.assertEqual(offset, os.path.getsize(spool_shipper.reader.segment_path('writer-0000', sequence)))
+        spool_shipper.stop()
+
+    def test_single_shipper_per_spool(self):
+        os.makedirs(os.path.join(self.path, 'writer-0000'))
+        first = shipper.SpoolShipper(spool.SpoolReader(self.path), shipper.HttpShipper(self.collector.url))
+        second = shipper.SpoolShipper(spool.SpoolReader(self.path), shipper.HttpShipper(self.collector.url))
+        self.assertTrue(first.claim())
+        self.assertFalse(second.claim())
+        first.stop()
+        self.assertTrue(second.claim())
+        second.stop()
+
+    def test_main(self):
+        writer = spool.SpoolWriter(self.path, fsync=False, encoder=codec.Encoder())
+        writer.append([{'action': 'read'}])
+        writer.close()
+
+        other = shipper.SpoolShipper(spool.SpoolReader(self.path), shipper.HttpShipper(self.collector.url))
+        self.assertTrue(other.claim())
+        self.assertEqual(shipper.main([self.path, self.collector.url, '--once']), 1)
+        other.stop()
+        self.assertEqual(shipper.main([self.path, self.collector.url, '--once']), 0)
+        self.assertEqual(self.collector.events, [{'action': 'read'}])
+
+    def test_join(self):
+        spool_shipper = shipper.SpoolShipper(
+            spool.SpoolReader(self.path), shipper.HttpShipper(self.collector.url), interval=0.01
+        )
+        self.assertTrue(spool_shipper.join(0))
+        spool_shipper.ensure_started()
+        self.assertFalse(spool_shipper.join(0.05))
+        threading.Timer(0.05, spool_shipper.stop).start()
+        self.assertTrue(spool_shipper.join(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from watcher import shm
+
+
+def _increment_in_child(path, key, count):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            store = shm.SharedStore(path)
+            for _ in range(count):
+                store.add(key, 1)
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+
+class TestSharedMemory(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_merge_across_processes(self):
+        _increment_in_child(self.path, 'requests', 10)
+        _increment_in_child(self.path, 'requests', 5)
+        _increment_in_child(self.path, 'other', 1)
+
+        merged = shm.SharedStore(self.path).merged()
+        self.assertEqual(merged, {'requests': 15.0, 'other': 1.0})
+        # a restarted worker reclaims the region of the dead one
+        self.assertEqual(
+            sorted(f for f in os.listdir(self.path) if f.startswith(shm.REGION_PREFIX)),
+            ['worker-0000']
+        )
+
+    def test_increment_without_lock(self):
+        store = shm.SharedStore(self.path, initial_slots=2)
+        store.add('requests', 1)
+        store._lock = mock.MagicMock()
+        store.add('requests', 2)
+        self.assertFalse(store._lock.__enter__.called)
+
+        # growing the region takes the lock
+        store.add_to_slot(10, 1)
+        self.assertTrue(store._lock.__enter__.called)
+        self.assertEqual(store.merged(), {'requests': 3.0})
+
+    def test_worker_slot(self):
+        first = shm.WorkerSlot(self.path)
+        second = shm.WorkerSlot(self.path)
+        self.assertEqual(first.index(), 0)
+        self.assertEqual(second.index(), 1)
+        self.assertEqual(first.index(), 0)
+
+        # a restarted worker takes over the index of the dead one
+        first.close()
+        restarted = shm.WorkerSlot(self.path)
+        self.assertEqual(restarted.index(), 0)
+        restarted.close()
+        second.close()
+
+        self.assertRaises(IOError, shm.WorkerSlot(self.path, max_workers=0).index)
+
+    def test_region_growth(self):
+        store = shm.SharedStore(self.path, initial_slots=2)
+        for index in range(50):
+            store.add('key{0}'.format(index), index)
+        merged = store.merged()
+        self.assertEqual(len(merged), 50)
+        self.assertEqual(merged['key49'], 49.0)
+
+    def test_slot_table_full(self):
+        store = shm.SharedStore(self.path, max_slots=1)
+        store.add('a', 1)
+        store.add('b', 1)
+        self.assertEqual(store.merged(), {'a': 1.0})
+        self.assertEqual(store.dropped, 1)
+        self.assertTrue(store.full)
+
+        # further misses neither lock nor read the keys file
+        with mock.patch.object(store, '_refresh_keys') as refresh_keys:
+            store.add('c', 1)
+            counter = shm.SharedCounter(store, 'api_requests_total', '')
+            counter.inc(['action:read'])
+            counter.inc(['action:read'])
+        refresh_keys.assert_not_called()
+        self.assertEqual(store.dropped, 4)
+
+        # another process finds the table full as well
+        other = shm.SharedStore(self.path, max_slots=1)
+        self.assertIsNone(other.slot('b'))
+        self.assertTrue(other.full)
+
+    def test_label_value_with_tab(self):
+        registry = shm.SharedRegistry(self.path)
+        counter = registry.counter('api_requests_total', 'total count of api requests')
+        histogram = registry.histogram('api_requests_duration_seconds', 'request latency in seconds', buckets=[1])
+        counter.inc(['path:/v2.1/\tservers'])
+        histogram.observe(['path:/v2.1/\tservers'], 0.5)
+
+        text = registry.render()
+        self.assertIn('api_requests_total{path="/v2.1/\tservers"} 1.0', text)
+        self.assertIn('api_requests_duration_seconds_bucket{path="/v2.1/\tservers",le="1.0"} 1', text)
+        self.assertIn('api_requests_duration_seconds_sum{path="/v2.1/\tservers"} 0.5', text)
+
+    def test_registry_render(self):
+        registry = shm.SharedRegistry(self.path, namespace='openstack_watcher')
+        counter = registry.counter('api_requests_total', 'total count of api requests')
+        histogram = registry.histogram('api_requests_duration_seconds', 'request latency in seconds', buckets=[0.1, 1])
+        counter.inc(['action:read'])
+        counter.inc(['action:read'])
+        histogram.observe(['action:read'], 0.05)
+        histogram.observe(['action:read'], 2)
+
+        text = registry.render()
+        self.assertIn('openstack_watcher_api_requests_total{action="read"} 2.0', text)
+        self.assertIn('openstack_watcher_api_requests_duration_seconds_bucket{action="read",le="0.1"} 1', text)
+        self.assertIn('openstack_watcher_api_requests_duration_seconds_bucket{action="read",le="+Inf"} 2', text)
+        self.assertIn('openstack_watcher_api_requests_duration_seconds_count{action="read"} 2', text)
+        self.assertIn('openstack_watcher_api_requests_duration_seconds_sum{action="read"} 2.05', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
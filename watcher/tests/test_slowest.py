@@ -0,0 +1,90 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import unittest
+
+from webob import Request
+
+from watcher import slowest
+from watcher.watcher import OpenStackWatcherMiddleware
+
+
+class TestSlowestRequests(unittest.TestCase):
+    def test_top_k(self):
+        slowest_requests = slowest.SlowestRequests(k=2, interval=60, logger=mock.Mock())
+        now = slowest_requests._interval_start
+        for index, duration in enumerate([0.1, 0.5, 0.3, 0.05]):
+            slowest_requests.observe('service/compute/servers', duration, 'req-{0}'.format(index), now=now)
+        slowest_requests.observe('service/compute/flavors', 0.2, 'req-4', now=now)
+
+        current = slowest_requests.to_dict()['current']['requests']
+        self.assertEqual([e['request_id'] for e in current['service/compute/servers']], ['req-1', 'req-2'])
+        self.assertEqual([e['request_id'] for e in current['service/compute/flavors']], ['req-4'])
+
+    def test_rotate(self):
+        logger = mock.Mock()
+        slowest_requests = slowest.SlowestRequests(k=1, interval=60, logger=logger)
+        now = slowest_requests._interval_start
+        slowest_requests.observe('service/compute/servers', 0.5, 'req-1', 'project-1', 'read/list', now=now)
+        slowest_requests.observe('service/compute/servers', 0.1, 'req-2', now=now + 61)
+
+        result = slowest_requests.to_dict()
+        self.assertEqual(result['previous']['requests']['service/compute/servers'][0]['request_id'], 'req-1')
+        self.assertEqual(result['current']['requests']['service/compute/servers'][0]['request_id'], 'req-2')
+        logger.info.assert_called_once_with(
+            'slowest requests of service/compute/servers: req-1 (read/list, project project-1) 0.500s'
+        )
+
+    def test_max_keys(self):
+        slowest_requests = slowest.SlowestRequests(max_keys=1)
+        self.assertTrue(slowest_requests.observe('a', 0.1))
+        self.assertFalse(slowest_requests.observe('b', 0.1))
+        self.assertEqual(slowest_requests.dropped, 1)
+
+    def test_middleware(self):
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain'), ('X-Openstack-Request-Id', 'req-abc')])
+            return [b'ok']
+
+        watcher = OpenStackWatcherMiddleware(
+            app,
+            {
+                'service_type': 'compute',
+                'slowest_requests_enabled': 'true',
+                'prometheus_enabled': 'true',
+                'prometheus_exemplars_enabled': 'true'
+            }
+        )
+        watcher.metric_client = mock.Mock()
+        req = Request.blank('/v2.1/servers')
+        req.headers['X-Project-Id'] = 'project-1'
+        req.get_response(watcher)
+
+        # other tenants' requests are only shown to the allowed addresses
+        self.assertEqual(Request.blank('/watcher/slowest', remote_addr='10.0.0.1').get_response(watcher).status_int, 403)
+        resp = Request.blank('/watcher/slowest', remote_addr='127.0.0.1').get_response(watcher)
+        entry = resp.json['current']['requests']['service/compute/servers'][0]
+        self.assertEqual(entry['request_id'], 'req-abc')
+        self.assertEqual(entry['initiator_project_id'], 'project-1')
+        self.assertEqual(entry['action'], 'read')
+
+        resp = Request.blank(
+            '/watcher/metrics', remote_addr='127.0.0.1', headers={'Accept': 'application/openmetrics-text'}
+        ).get_response(watcher)
+        self.assertIn('# {request_id="req-abc"}', resp.text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from watcher import codec
+from watcher import events
+from watcher import spool
+
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_scan(self):
+        data = spool.frame(b'first') + spool.frame(b'second')
+        records, corrupt = spool.scan(data)
+        self.assertEqual([payload for _, payload in records], [b'first', b'second'])
+        self.assertEqual(records[-1][0], len(data))
+        self.assertFalse(corrupt)
+
+        # incomplete frame
+        records, corrupt = spool.scan(data[:-1])
+        self.assertEqual([payload for _, payload in records], [b'first'])
+        self.assertFalse(corrupt)
+
+        # corrupt frame
+        records, corrupt = spool.scan(data[:-1] + b'X')
+        self.assertEqual([payload for _, payload in records], [b'first'])
+        self.assertTrue(corrupt)
+
+    def test_append_and_read(self):
+        writer = spool.SpoolWriter(self.path, segment_max_bytes=50, fsync=False)
+        self.assertTrue(writer.append([b'a' * 20, b'b' * 20]))
+        self.assertTrue(writer.append([b'c' * 20]))
+        writer.close()
+
+        reader = spool.SpoolReader(self.path)
+        self.assertEqual(reader.writers(), ['writer-0000'])
+        # the first segment was full after the first group
+        self.assertEqual(reader.segments('writer-0000'), [1, 2])
+        self.assertEqual([p for _, p in reader.read('writer-0000', 1)], [b'a' * 20, b'b' * 20])
+        records = reader.read('writer-0000', 2)
+        self.assertEqual([p for _, p in records], [b'c' * 20])
+        self.assertEqual(reader.read('writer-0000', 2, offset=records[-1][0]), [])
+
+    def test_writers_claim_distinct_directories(self):
+        first = spool.SpoolWriter(self.path, fsync=False)
+        second = spool.SpoolWriter(self.path, fsync=False)
+        try:
+            first.append([b'1'])
+            second.append([b'2'])
+            self.assertNotEqual(first.writer_path, second.writer_path)
+        finally:
+            first.close()
+            second.close()
+
+    def test_recovery(self):
+        writer = spool.SpoolWriter(self.path, fsync=False)
+        writer.append([b'complete'])
+        segment_path = os.path.join(writer.writer_path, spool.segment_name(writer.sequence))
+        writer.close()
+        # simulate a crash while writing the next frame
+        with open(segment_path, 'ab') as f:
+            f.write(spool.frame(b'incomplete')[:6])
+
+        logger = mock.Mock()
+        writer = spool.SpoolWriter(self.path, fsync=False, logger=logger)
+        writer.append([b'next'])
+        writer.close()
+
+        self.assertTrue(logger.warning.called)
+        reader = spool.SpoolReader(self.path)
+        self.assertEqual([p for _, p in reader.read('writer-0000', 1)], [b'complete'])
+        self.assertEqual(os.path.getsize(segment_path), len(spool.frame(b'complete')))
+        self.assertEqual([p for _, p in reader.read('writer-0000', 2)], [b'next'])
+
+    def test_max_bytes(self):
+        writer = spool.SpoolWriter(self.path, max_bytes=40, fsync=False)
+        self.assertTrue(writer.append([b'a' * 20]))
+        self.assertFalse(writer.append([b'b' * 20]))
+        self.assertEqual(writer.dropped, 1)
+        writer.close()
+
+    def test_failed_append(self):
+        writer = spool.SpoolWriter(self.path, fsync=False)
+        self.assertTrue(writer.append([b'first']))
+        segment = writer._segment
+
+        class TornFile(object):
+            def write(self, data):
+                segment.write(data[:len(data) // 2])
+                segment.flush()
+                raise IOError('no space left on device')
+
+            def close(self):
+                segment.close()
+
+        writer._segment = TornFile()
+        reader = spool.SpoolReader(self.path)
+        self.assertFalse(writer.append([b'lost', b'lost']))
+        self.assertEqual(writer.dropped, 2)
+        # a reader might consume the complete frames of the torn group before the next append
+        records = reader.read('writer-0000', 1)
+        self.assertEqual([p for _, p in records], [b'first', b'lost'])
+        self.assertTrue(writer.append([b'second']))
+        writer.close()
+
+        # the segment with the torn group is not truncated below the offset of the reader. the next group is appended
+        # to a new segment
+        self.assertEqual(reader.read('writer-0000', 1, offset=records[-1][0]), [])
+        self.assertEqual(reader.read('writer-0000', 1), records)
+        self.assertEqual(reader.segments('writer-0000'), [1, 2])
+        self.assertEqual([p for _, p in reader.read('writer-0000', 2)], [b'second'])
+
+    def test_remove(self):
+        writer = spool.SpoolWriter(self.path, segment_max_age=0, fsync=False)
+        writer.append([b'a'])
+        writer.append([b'b'])
+        writer.close()
+        reader = spool.SpoolReader(self.path)
+        reader.remove('writer-0000', 1)
+        self.assertEqual(reader.segments('writer-0000'), [2])
+
+    def test_spool_sink(self):
+        sink = events.SpoolSink(spool.SpoolWriter(self.path, fsync=False, encoder=codec.JsonEncoder()))
+        sink.write([{'action': 'read'}, {'action': 'update'}])
+        sink.close()
+        records = spool.SpoolReader(self.path).read('writer-0000', 1)
+        self.assertEqual([json.loads(p.decode('utf-8'))['action'] for _, p in records], ['read', 'update'])
+
+
+if __name__ == '__main__':
+    unittest.main()
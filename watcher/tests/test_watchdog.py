@@ -0,0 +1,97 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import threading
+import time
+import unittest
+
+from webob import Request
+
+from . import fake
+from watcher import inflight
+from watcher import watchdog
+from watcher.watcher import OpenStackWatcherMiddleware
+
+
+def _stuck_in_action(registry, started, release):
+    info = registry.register(inflight.RequestInfo(
+        'POST', '/v2.1/servers/0123456789abcdef0123456789abcdef/action', action='update/reboot',
+        target_type_uri='service/compute/servers/server/action', initiator_project_id='p1', start=time.time() - 60
+    ))
+    started.set()
+    release.wait(5)
+    registry.unregister(info)
+
+
+class TestWatchdog(unittest.TestCase):
+    def test_capture_once(self):
+        registry = inflight.InflightRegistry()
+        registry.register(inflight.RequestInfo('GET', '/v2.1/servers', action='read/list'))
+        started = threading.Event()
+        release = threading.Event()
+        thread = threading.Thread(target=_stuck_in_action, args=(registry, started, release))
+        thread.start()
+        logger = mock.Mock()
+        try:
+            started.wait(5)
+            w = watchdog.SlowRequestWatchdog(registry, threshold=30, max_entries=1, logger=logger)
+            w.check()
+            w.check()
+        finally:
+            release.set()
+            thread.join()
+
+        self.assertEqual(w.captured, 1)
+        entry = w.entries[0]
+        self.assertEqual(entry['action'], 'update/reboot')
+        self.assertEqual(entry['initiator_project_id'], 'p1')
+        self.assertGreaterEqual(entry['duration'], 60)
+        self.assertIn('_stuck_in_action', entry['stack'])
+        self.assertEqual(logger.warning.call_count, 1)
+
+        # finished requests are forgotten
+        w.check()
+        self.assertEqual(len(w._captured_ids), 0)
+
+    def test_debug_info(self):
+        watcher = OpenStackWatcherMiddleware(
+            fake.FakeApp(),
+            {
+                'service_type': 'compute',
+                'watchdog_enabled': 'true',
+                'watchdog_log_stacks': 'false',
+                'debug_enabled': 'true'
+            }
+        )
+        info = watcher.inflight.register(inflight.RequestInfo(
+            'POST', '/v2.1/servers/0123456789abcdef0123456789abcdef/action', action='update/reboot',
+            target_type_uri='service/compute/servers/server/action', start=time.time() - 60
+        ))
+        try:
+            watcher.watchdog.check()
+        finally:
+            watcher.inflight.unregister(info)
+
+        resp = Request.blank('/watcher/debug', remote_addr='127.0.0.1').get_response(watcher)
+        self.assertEqual(resp.status_int, 200)
+        slow_requests = resp.json['slow_requests']
+        self.assertEqual(slow_requests['captured'], 1)
+        self.assertEqual(slow_requests['entries'][0]['action'], 'update/reboot')
+        self.assertEqual(slow_requests['entries'][0]['target_type_uri'], 'service/compute/servers/server/action')
+        self.assertIn('test_debug_info', slow_requests['entries'][0]['stack'])
+
+
+if __name__ == '__main__':
+    unittest.main()
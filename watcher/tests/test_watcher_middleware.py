@@ -12,6 +12,7 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import mock
 import six
 import unittest
 
@@ -82,6 +83,55 @@ class TestWatcherMiddleware(unittest.TestCase):
             "should be 'unknown' as the service catalog contains no project scoped endpoint url"
         )
 
+    def test_cpu_time_of_streamed_response(self):
+        def streaming_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            # burn some CPU while streaming
+            return (six.b(str(sum(range(100000)))) for _ in range(3))
+
+        watcher = OpenStackWatcherMiddleware(
+            streaming_app,
+            {
+                'service_type': 'compute',
+                'cpu_time_metric_enabled': 'true'
+            }
+        )
+        watcher.metric_client = mock.Mock()
+
+        app_iter = watcher(Request.blank('/v2.1/servers').environ, lambda status, headers, exc_info=None: None)
+        self.assertFalse(
+            [c for c in watcher.metric_client.timing.call_args_list if c[0][0] == 'api_requests_cpu_seconds'],
+            "the CPU time must not be emitted before the response was closed"
+        )
+        list(app_iter)
+        app_iter.close()
+
+        name, value = watcher.metric_client.timing.call_args[0]
+        self.assertEqual(name, 'api_requests_cpu_seconds')
+        self.assertGreaterEqual(value, 0)
+        self.assertIn('status:200', watcher.metric_client.timing.call_args[1]['tags'])
+
+    def test_overhead_budget(self):
+        watcher = OpenStackWatcherMiddleware(
+            fake.FakeApp(),
+            {
+                'service_type': 'compute',
+                'overhead_metric_enabled': 'true',
+                'overhead_budget_us': '0.001'
+            }
+        )
+        watcher.metric_client = mock.Mock()
+        Request.blank('/v2.1/servers').get_response(watcher)
+
+        overhead = [c for c in watcher.metric_client.timing.call_args_list if c[0][0] == 'watcher_overhead_seconds']
+        self.assertEqual(len(overhead), 1)
+        self.assertGreater(overhead[0][0][1], 0)
+        watcher.metric_client.increment.assert_any_call(
+            'watcher_overhead_budget_exceeded_total',
+            tags=['service_name:service/compute', 'service:compute', 'action:read',
+                  'target_type_uri:service/compute/servers', 'status:200']
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
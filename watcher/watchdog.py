@@ -0,0 +1,86 @@
+# Copyright 2018 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import logging
+import sys
+import time
+import traceback
+
+from . import common
+
+
+class SlowRequestWatchdog(common.PeriodicThread):
+    """
+    watches the requests in flight. once a request exceeds the threshold, the stack of the thread handling it
+    is captured once and stored along with the request's classification in a bounded ring buffer
+    """
+    def __init__(self, inflight, threshold=30, interval=1, max_entries=100, log_stacks=True,
+                 logger=logging.getLogger(__name__)):
+        """
+        :param inflight: the InflightRegistry
+        :param threshold: seconds after which a request is considered slow
+        :param interval: seconds between checks
+        :param max_entries: number of captured stacks kept
+        :param log_stacks: whether to log captured stacks
+        :param logger: the logger to use
+        """
+        super(SlowRequestWatchdog, self).__init__('watcher-watchdog', interval, logger)
+        self.inflight = inflight
+        self.threshold = threshold
+        self.log_stacks = log_stacks
+        self.entries = collections.deque(maxlen=max_entries)
+        self.captured = 0
+        # ids of the requests whose stack was already captured
+        self._captured_ids = set()
+
+    def run_once(self):
+        self.check()
+
+    def check(self, now=None):
+        """
+        capture the stacks of requests exceeding the threshold
+
+        :param now: the current time
+        """
+        now = now or time.time()
+        requests = self.inflight.snapshot()
+        in_flight_ids = set(id(info) for info in requests)
+        # forget requests that finished
+        self._captured_ids &= in_flight_ids
+
+        slow = [info for info in requests if now - info.start > self.threshold and id(info) not in self._captured_ids]
+        if not slow:
+            return
+        frames = sys._current_frames()
+        for info in slow:
+            self._captured_ids.add(id(info))
+            frame = frames.get(info.thread_ident)
+            entry = info.to_dict()
+            entry.update(
+                captured_at=now,
+                duration=now - info.start,
+                stack=''.join(traceback.format_stack(frame)) if frame is not None else None
+            )
+            self.entries.append(entry)
+            self.captured += 1
+            if self.log_stacks:
+                self.logger.warning(
+                    "request '{0} {1}' with action: {2}, target_type_uri: {3}, initiator_project_id: {4}, "
+                    "initiator_user_id: {5}, target_project_id: {6} in flight for {7:.1f}s:\n{8}".format(
+                        info.method, info.path, info.action, info.target_type_uri, info.initiator_project_id,
+                        info.initiator_user_id, info.target_project_id, entry['duration'], entry['stack']
+                    )
+                )
+        del frames
@@ -12,7 +12,11 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
+import json
 import logging
+import os
+import threading
 import time
 import yaml
 
@@ -20,12 +24,34 @@ from datadog.dogstatsd import DogStatsd
 from pycadf import cadftaxonomy as taxonomy
 from webob import Request
 
+from . import accesslog
+from . import aggregation
+from . import batching
 from . import cadf_strategy as strategies
+from . import capture
+from . import cardinality
+from . import codec
 from . import common
 from . import errors
+from . import eventlet_monitor
+from . import events
+from . import filters
+from . import gcmonitor
+from . import inflight
+from . import memprofiler
+from . import profiler
+from . import prometheus
+from . import sampling
+from . import shipper
+from . import shm
+from . import slowest
+from . import spool
+from . import watchdog
 
 logging.basicConfig(level=logging.ERROR, format='%(asctime)-15s %(message)s')
 
+_clock = getattr(time, 'perf_counter', time.time)
+
 
 # Map of service types and strategies to determine target type URI and action
 # Usually the base strategy is sufficient
@@ -107,11 +133,371 @@ class OpenStackWatcherMiddleware(object):
 
         self.strategy = strategy
 
+        # rules selecting the requests emitting CADF events and detail metrics
+        self.event_filter = None
+        event_filter_config = self.watcher_config.get('event_filters', [])
+        if event_filter_config:
+            self.event_filter = filters.EventFilter(event_filter_config, logger=self.logger)
+
         self.metric_client = DogStatsd(
             host=self.wsgi_config.get("statsd_host", "127.0.0.1"),
             port=int(self.wsgi_config.get("statsd_port", 9125)),
             namespace=self.wsgi_config.get("statsd_namespace", "openstack_watcher")
         )
+        # number of requests whose metrics could not be submitted
+        self.failed_metric_submissions = 0
+
+        # optionally aggregate the request durations locally instead of sending a timing per request
+        self.duration_aggregator = None
+        duration_aggregation = self.wsgi_config.get('duration_aggregation', 'none').lower()
+        if duration_aggregation != 'none':
+            self.duration_aggregator = aggregation.DistributionAggregator(
+                'api_requests_duration_seconds',
+                mode=duration_aggregation,
+                buckets=[float(b) for b in common.string_to_list(
+                    self.wsgi_config.get('duration_buckets', prometheus.DEFAULT_BUCKETS)
+                )],
+                relative_accuracy=float(self.wsgi_config.get('duration_sketch_relative_accuracy', 0.01)),
+                quantiles=[float(q) for q in common.string_to_list(
+                    self.wsgi_config.get('duration_sketch_quantiles', aggregation.DEFAULT_QUANTILES)
+                )],
+                flush_interval=float(self.wsgi_config.get('duration_flush_interval', 10)),
+                client=self.metric_client,
+                logger=self.logger
+            )
+
+        # whether to measure the CPU time of the thread handling the request
+        self.is_cpu_time_metric_enabled = common.string_to_bool(
+            self.wsgi_config.get('cpu_time_metric_enabled', 'False')
+        )
+        if self.is_cpu_time_metric_enabled and common.thread_cpu_time() is None:
+            self.logger.warning("thread CPU time is not supported on this platform. disabling cpu_time_metric_enabled")
+            self.is_cpu_time_metric_enabled = False
+        self.cpu_time_aggregator = None
+        if self.is_cpu_time_metric_enabled and self.duration_aggregator:
+            self.cpu_time_aggregator = aggregation.DistributionAggregator(
+                'api_requests_cpu_seconds',
+                mode=self.duration_aggregator.mode,
+                buckets=self.duration_aggregator.buckets,
+                relative_accuracy=self.duration_aggregator.relative_accuracy,
+                quantiles=self.duration_aggregator.quantiles,
+                flush_interval=self.duration_aggregator.flush_interval,
+                client=self.metric_client,
+                logger=self.logger
+            )
+
+        # headers set by a front-end containing the time a request was received, to measure the time it was queued
+        self.queue_time_headers = []
+        if common.string_to_bool(self.wsgi_config.get('queue_time_metric_enabled', 'False')):
+            self.queue_time_headers = [
+                'HTTP_' + header.upper().replace('-', '_') for header in common.string_to_list(
+                    self.wsgi_config.get('queue_time_headers', 'X-Request-Start,X-Queue-Start')
+                )
+            ]
+        self.queue_time_max_seconds = float(self.wsgi_config.get('queue_time_max_seconds', 300))
+
+        # whether to emit the time the middleware spends classifying a request. overhead_budget_us > 0 logs and counts
+        # requests exceeding it
+        self.is_overhead_metric_enabled = common.string_to_bool(
+            self.wsgi_config.get('overhead_metric_enabled', 'False')
+        )
+        self.overhead_budget = float(self.wsgi_config.get('overhead_budget_us', 0)) / 1000000
+
+        # optionally sample metrics per metric name and CADF action, adaptively under load
+        self.sampler = None
+        metric_sample_rates = common.string_to_dict(self.wsgi_config.get('metric_sample_rates', ''))
+        action_sample_rates = common.string_to_dict(self.wsgi_config.get('action_sample_rates', ''))
+        adaptive_sampling_threshold = float(self.wsgi_config.get('adaptive_sampling_threshold', 0))
+        metric_sample_rate = float(self.wsgi_config.get('metric_sample_rate', 1.0))
+        if metric_sample_rates or action_sample_rates or adaptive_sampling_threshold > 0 or metric_sample_rate < 1:
+            self.sampler = sampling.Sampler(
+                default_rate=metric_sample_rate,
+                metric_rates=dict((k, float(v)) for k, v in metric_sample_rates.items()),
+                action_rates=dict((k, float(v)) for k, v in action_sample_rates.items()),
+                adaptive_threshold=adaptive_sampling_threshold,
+                adaptive_min_rate=float(self.wsgi_config.get('adaptive_sampling_min_rate', 0.01))
+            )
+
+        # optionally limit the number of distinct project, domain, user ids per metric
+        self.cardinality_governor = None
+        metric_cardinality_limit = int(self.wsgi_config.get('metric_cardinality_limit', 0))
+        metric_cardinality_limits = dict(
+            (k, int(v)) for k, v in common.string_to_dict(self.wsgi_config.get('metric_cardinality_limits', '')).items()
+        )
+        if metric_cardinality_limit > 0 or metric_cardinality_limits:
+            self.cardinality_governor = cardinality.CardinalityGovernor(
+                metric_cardinality_limit,
+                budget_overrides=metric_cardinality_limits,
+                labels=common.string_to_list(
+                    self.wsgi_config.get('cardinality_limited_labels', cardinality.DEFAULT_LIMITED_LABELS)
+                ),
+                rebalance_interval=float(self.wsgi_config.get('cardinality_rebalance_interval', 60))
+            )
+
+        # paths answered by the middleware itself without calling the wrapped app, only to clients from the allowed
+        # addresses (REMOTE_ADDR). debug_allowed_addresses is the former name of the option
+        self.admin_handlers = {}
+        self.admin_allowed_addresses = frozenset(common.string_to_list(self.wsgi_config.get(
+            'admin_allowed_addresses', self.wsgi_config.get('debug_allowed_addresses', '127.0.0.1,::1')
+        )))
+
+        # optionally keep metrics in-process and expose them in the prometheus format
+        self.prometheus_registry = None
+        if common.string_to_bool(self.wsgi_config.get('prometheus_enabled', 'False')):
+            # aggregate the metrics of all worker processes of a prefork WSGI server in shared memory
+            prometheus_multiprocess_dir = self.wsgi_config.get('prometheus_multiprocess_dir', None)
+            if prometheus_multiprocess_dir:
+                self.prometheus_registry = shm.SharedRegistry(
+                    prometheus_multiprocess_dir,
+                    namespace=self.wsgi_config.get("statsd_namespace", "openstack_watcher"),
+                    max_slots=int(self.wsgi_config.get('prometheus_multiprocess_max_slots', 65536))
+                )
+            else:
+                self.prometheus_registry = prometheus.Registry(
+                    namespace=self.wsgi_config.get("statsd_namespace", "openstack_watcher")
+                )
+            self.prometheus_requests_total = self.prometheus_registry.counter(
+                'api_requests_total', 'total count of api requests'
+            )
+            self.prometheus_requests_duration = self.prometheus_registry.histogram(
+                'api_requests_duration_seconds', 'request latency in seconds',
+                buckets=[float(b) for b in common.string_to_list(
+                    self.wsgi_config.get('prometheus_buckets', prometheus.DEFAULT_BUCKETS)
+                )]
+            )
+            if self.is_cpu_time_metric_enabled:
+                self.prometheus_requests_cpu_time = self.prometheus_registry.histogram(
+                    'api_requests_cpu_seconds', 'CPU time of the thread handling the request in seconds',
+                    buckets=self.prometheus_requests_duration.buckets
+                )
+            self.admin_handlers[self.wsgi_config.get('prometheus_path', '/watcher/metrics')] = \
+                self.serve_prometheus_metrics
+        # whether to attach the request id to the duration histogram as OpenMetrics exemplar
+        self.is_prometheus_exemplars_enabled = common.string_to_bool(
+            self.wsgi_config.get('prometheus_exemplars_enabled', 'False')
+        )
+
+        is_profiler_enabled = common.string_to_bool(self.wsgi_config.get('profiler_enabled', 'False'))
+        is_watchdog_enabled = common.string_to_bool(self.wsgi_config.get('watchdog_enabled', 'False'))
+        is_gc_monitor_enabled = common.string_to_bool(self.wsgi_config.get('gc_monitor_enabled', 'False'))
+        if is_gc_monitor_enabled and not gcmonitor.GCMonitor.is_supported():
+            self.logger.warning("gc.callbacks requires python >= 3.3. disabling gc_monitor_enabled")
+            is_gc_monitor_enabled = False
+
+        is_eventlet_monitor_enabled = common.string_to_bool(self.wsgi_config.get('eventlet_lag_monitor_enabled', 'False'))
+        if is_eventlet_monitor_enabled and not eventlet_monitor.HubLagMonitor.is_supported():
+            self.logger.warning("eventlet is not installed. disabling eventlet_lag_monitor_enabled")
+            is_eventlet_monitor_enabled = False
+
+        is_allocation_sampling_enabled = common.string_to_bool(
+            self.wsgi_config.get('allocation_sampling_enabled', 'False')
+        )
+        if is_allocation_sampling_enabled and not memprofiler.AllocationSampler.is_supported():
+            self.logger.warning("tracemalloc requires python >= 3.4. disabling allocation_sampling_enabled")
+            is_allocation_sampling_enabled = False
+
+        # whether to emit the number of requests in flight per action and target type URI
+        self.is_inflight_metric_enabled = common.string_to_bool(
+            self.wsgi_config.get('inflight_metric_enabled', 'False')
+        )
+        # every worker process emits its own gauge, tagged with an index that is reused by a restarted worker
+        self.worker_slot = None
+        if self.is_inflight_metric_enabled:
+            self.worker_slot = shm.WorkerSlot(self.wsgi_config.get(
+                'inflight_worker_dir', '/dev/shm/openstack-watcher-{0}-workers'.format(self.service_type)
+            ))
+
+        # registry of the requests in flight, required by the profiler, the watchdog and the monitors
+        self.inflight = None
+        if is_profiler_enabled or is_watchdog_enabled or is_gc_monitor_enabled or is_eventlet_monitor_enabled or \
+                self.is_inflight_metric_enabled:
+            self.inflight = inflight.InflightRegistry()
+
+        # threads started lazily in the process serving requests
+        self.background_threads = []
+
+        # flush the locally aggregated distributions
+        for aggregator in (self.duration_aggregator, self.cpu_time_aggregator):
+            if aggregator:
+                self.background_threads.append(aggregator)
+
+        # optionally sample the stacks of threads handling requests and aggregate them per action and target type URI
+        self.profiler = None
+        if is_profiler_enabled:
+            self.profiler = profiler.SamplingProfiler(
+                self.inflight,
+                interval=float(self.wsgi_config.get('profiler_interval', 0.1)),
+                max_depth=int(self.wsgi_config.get('profiler_max_depth', 64)),
+                max_stacks=int(self.wsgi_config.get('profiler_max_stacks', 10000)),
+                logger=self.logger
+            )
+            self.admin_handlers[self.wsgi_config.get('profiler_path', '/watcher/profile')] = self.serve_profile
+            self.background_threads.append(self.profiler)
+
+        # optionally capture the stacks of requests in flight for longer than the threshold
+        self.watchdog = None
+        if is_watchdog_enabled:
+            self.watchdog = watchdog.SlowRequestWatchdog(
+                self.inflight,
+                threshold=float(self.wsgi_config.get('watchdog_threshold', 30)),
+                interval=float(self.wsgi_config.get('watchdog_interval', 1)),
+                max_entries=int(self.wsgi_config.get('watchdog_max_entries', 100)),
+                log_stacks=common.string_to_bool(self.wsgi_config.get('watchdog_log_stacks', 'True')),
+                logger=self.logger
+            )
+            self.background_threads.append(self.watchdog)
+
+        # optionally measure garbage collection pauses and attribute them to the requests in flight
+        self.gc_monitor = None
+        if is_gc_monitor_enabled:
+            self.gc_monitor = gcmonitor.GCMonitor(
+                self.inflight,
+                min_generation=int(self.wsgi_config.get('gc_monitor_min_generation', 0))
+            )
+            self.gc_monitor.install()
+
+        # optionally measure the scheduling lag of the eventlet hub
+        self.eventlet_monitor = None
+        if is_eventlet_monitor_enabled:
+            self.eventlet_monitor = eventlet_monitor.HubLagMonitor(
+                self.inflight,
+                self.metric_client,
+                interval=float(self.wsgi_config.get('eventlet_lag_interval', 0.5)),
+                threshold=float(self.wsgi_config.get('eventlet_lag_threshold', 0.1)),
+                max_entries=int(self.wsgi_config.get('eventlet_lag_max_entries', 100)),
+                logger=self.logger
+            )
+            self.background_threads.append(self.eventlet_monitor)
+
+        # optionally trace the memory allocations of a fraction of requests per action and target type URI
+        self.allocation_sampler = None
+        if is_allocation_sampling_enabled:
+            self.allocation_sampler = memprofiler.AllocationSampler(
+                sample_rate=float(self.wsgi_config.get('allocation_sample_rate', 0.01)),
+                top_sites=int(self.wsgi_config.get('allocation_sampling_top_sites', 10)),
+                max_keys=int(self.wsgi_config.get('allocation_sampling_max_keys', 1000)),
+                dump_path=self.wsgi_config.get('allocation_sampling_dump_path'),
+                dump_interval=float(self.wsgi_config.get('allocation_sampling_dump_interval', 60)),
+                logger=self.logger
+            )
+            self.admin_handlers[self.wsgi_config.get('allocation_sampling_path', '/watcher/allocations')] = \
+                self.serve_allocations
+
+        # optionally keep the slowest requests per target type URI and interval along with their request id
+        self.slowest_requests = None
+        if common.string_to_bool(self.wsgi_config.get('slowest_requests_enabled', 'False')):
+            self.slowest_requests = slowest.SlowestRequests(
+                k=int(self.wsgi_config.get('slowest_requests_k', 5)),
+                interval=float(self.wsgi_config.get('slowest_requests_interval', 60)),
+                max_keys=int(self.wsgi_config.get('slowest_requests_max_keys', 1000)),
+                log=common.string_to_bool(self.wsgi_config.get('slowest_requests_log', 'True')),
+                logger=self.logger
+            )
+            self.admin_handlers[self.wsgi_config.get('slowest_requests_path', '/watcher/slowest')] = \
+                self.serve_slowest_requests
+
+        # optionally emit a CADF event per request. events are built and written in batches by a background thread
+        self.event_emitter = None
+        if common.string_to_bool(self.wsgi_config.get('cadf_events_enabled', 'False')):
+            event_sink = self.wsgi_config.get('cadf_events_sink', events.SINK_LOG)
+            if event_sink == events.SINK_FILE:
+                sink = events.FileSink(self.wsgi_config.get('cadf_events_path', '/var/log/watcher/events.log'))
+            elif event_sink == events.SINK_SPOOL:
+                sink = events.SpoolSink(spool.SpoolWriter(
+                    self.wsgi_config.get('cadf_events_spool_path', '/var/spool/watcher'),
+                    segment_max_bytes=int(self.wsgi_config.get('cadf_events_spool_segment_max_bytes', 64 * 1024 * 1024)),
+                    segment_max_age=float(self.wsgi_config.get('cadf_events_spool_segment_max_age', 300)),
+                    max_bytes=int(self.wsgi_config.get('cadf_events_spool_max_bytes', 1024 * 1024 * 1024)),
+                    fsync=common.string_to_bool(self.wsgi_config.get('cadf_events_spool_fsync', 'True')),
+                    encoder=self.get_spool_encoder(),
+                    logger=self.logger
+                ))
+            elif event_sink == events.SINK_HTTP:
+                sink = events.HttpSink(self.get_http_shipper())
+            else:
+                sink = events.LogSink(self.logger)
+            # collapse the events of identical requests with these actions, e.g. polling, per interval
+            event_aggregator = None
+            aggregated_actions = common.string_to_list(self.wsgi_config.get('cadf_events_aggregate_actions', ''))
+            if aggregated_actions:
+                event_aggregator = events.EventAggregator(
+                    aggregated_actions,
+                    interval=float(self.wsgi_config.get('cadf_events_aggregate_interval', 60)),
+                    max_keys=int(self.wsgi_config.get('cadf_events_aggregate_max_keys', 10000))
+                )
+            self.event_emitter = events.EventEmitter(
+                sink,
+                self.strategy.get_cadf_service_name(),
+                batch_size=int(self.wsgi_config.get('cadf_events_batch_size', 100)),
+                flush_interval=float(self.wsgi_config.get('cadf_events_flush_interval', 1)),
+                max_queue=int(self.wsgi_config.get('cadf_events_max_queue', 10000)),
+                drop_policy=self.wsgi_config.get('cadf_events_drop_policy', batching.DROP_NEWEST),
+                aggregator=event_aggregator,
+                logger=self.logger
+            )
+            self.background_threads.append(self.event_emitter)
+
+        # optionally write a JSON line per request with its CADF classification. lines are written in batches
+        self.access_log = None
+        if common.string_to_bool(self.wsgi_config.get('access_log_enabled', 'False')):
+            self.access_log = accesslog.AccessLog(
+                self.wsgi_config.get('access_log_path', '/var/log/watcher/access.log'),
+                self.strategy.get_cadf_service_name(),
+                max_bytes=int(self.wsgi_config.get('access_log_max_bytes', 100 * 1024 * 1024)),
+                backup_count=int(self.wsgi_config.get('access_log_backup_count', 5)),
+                batch_size=int(self.wsgi_config.get('access_log_batch_size', 500)),
+                flush_interval=float(self.wsgi_config.get('access_log_flush_interval', 1)),
+                max_queue=int(self.wsgi_config.get('access_log_max_queue', 10000)),
+                logger=self.logger
+            )
+            self.background_threads.append(self.access_log)
+
+        # optionally record sampled requests as a corpus to replay
+        self.capture = None
+        if common.string_to_bool(self.wsgi_config.get('capture_enabled', 'False')):
+            self.capture = capture.Capture(
+                self.wsgi_config.get('capture_path', '/var/lib/watcher/capture.jsonl.gz'),
+                sample_rate=float(self.wsgi_config.get('capture_sample_rate', 1)),
+                max_per_second=float(self.wsgi_config.get('capture_max_per_second', 10)),
+                max_bytes=int(self.wsgi_config.get('capture_max_bytes', 100 * 1024 * 1024)),
+                headers=common.string_to_list(
+                    self.wsgi_config.get('capture_headers', capture.DEFAULT_HEADERS)
+                ),
+                redacted_headers=common.string_to_list(
+                    self.wsgi_config.get('capture_redacted_headers', capture.DEFAULT_REDACTED_HEADERS)
+                ),
+                redacted_query_parameters=common.string_to_list(
+                    self.wsgi_config.get(
+                        'capture_redacted_query_parameters', capture.DEFAULT_REDACTED_QUERY_PARAMETERS
+                    )
+                ),
+                max_body_bytes=int(self.wsgi_config.get('capture_max_body_bytes', 4096)),
+                logger=self.logger
+            )
+            self.background_threads.append(self.capture)
+
+        # optionally ship the events of the spool to the collector. only one process sharing the spool ships
+        self.spool_shipper = None
+        if common.string_to_bool(self.wsgi_config.get('cadf_events_spool_ship_enabled', 'False')):
+            self.spool_shipper = shipper.SpoolShipper(
+                spool.SpoolReader(self.wsgi_config.get('cadf_events_spool_path', '/var/spool/watcher'), logger=self.logger),
+                self.get_http_shipper(),
+                batch_size=int(self.wsgi_config.get('cadf_events_spool_ship_batch_size', 500)),
+                interval=float(self.wsgi_config.get('cadf_events_spool_ship_interval', 1)),
+                fsync=common.string_to_bool(self.wsgi_config.get('cadf_events_spool_fsync', 'True')),
+                metric_client=self.metric_client,
+                logger=self.logger
+            )
+            self.background_threads.append(self.spool_shipper)
+
+        # optionally answer with the internal state of the middleware as JSON
+        self.unknown_paths = None
+        if common.string_to_bool(self.wsgi_config.get('debug_enabled', 'False')):
+            # recent requests whose target type URI or action could not be determined
+            self.unknown_paths = collections.deque(maxlen=int(self.wsgi_config.get('debug_max_unknown_paths', 100)))
+            # only counted if the debug endpoint is enabled as the paths of every request are mapped
+            self.strategy.regex_hits = {}
+            self.admin_handlers[self.wsgi_config.get('debug_path', '/watcher/debug')] = self.serve_debug
 
     @classmethod
     def factory(cls, global_config, **local_config):
@@ -129,9 +515,21 @@ class OpenStackWatcherMiddleware(object):
         :param environ: the WSGI environment dict
         :param start_response: WSGI callable
         """
+        admin_handler = self.admin_handlers.get(environ.get('PATH_INFO'))
+        if admin_handler:
+            if environ.get('REMOTE_ADDR') not in self.admin_allowed_addresses:
+                start_response('403 Forbidden', [('Content-Type', 'text/plain'), ('Content-Length', '0')])
+                return [b'']
+            return admin_handler(environ, start_response)
 
         # capture start timestamp
         start = time.time()
+        overhead_start = None
+        if self.is_overhead_metric_enabled:
+            overhead_start = _clock()
+        cpu_start = None
+        if self.is_cpu_time_metric_enabled:
+            cpu_start = common.thread_cpu_time()
         labels = []
         detail_labels = []
 
@@ -194,28 +592,7 @@ class OpenStackWatcherMiddleware(object):
             environ['WATCHER.SERVICE_TYPE'] = self.service_type
             environ['WATCHER.CADF_SERVICE_NAME'] = self.strategy.get_cadf_service_name()
 
-            # labels applied to all metrics emitted by this middleware
-            labels.append("service_name:{0}".format(self.strategy.get_cadf_service_name()))
-            labels.append("service:{0}".format(self.service_type))
-            labels.append("action:{0}".format(cadf_action))
-            labels.append("target_type_uri:{0}".format(target_type_uri))
-
-            # additional labels not needed in all metrics
-            detail_labels.append("initiator_project_id:{0}".format(initiator_project_id))
-            detail_labels.append("initiator_domain_id:{0}".format(initiator_domain_id))
-            detail_labels = labels + detail_labels
-
-            # include the target project id in metric
-            if self.is_include_target_project_id_in_metric:
-                detail_labels.append(
-                    "target_project_id:{0}".format(target_project_id)
-                )
-
-            # include initiator user id
-            if self.is_include_initiator_user_id_in_metric:
-                detail_labels.append(
-                    "initiator_user_id:{0}".format(initiator_user_id)
-                )
+            labels, detail_labels = self.get_labels(environ)
 
             # if swift request: determine target.container_id based on request path
             if common.is_swift_request(req.path) or self.service_type == 'object-store':
@@ -234,6 +611,42 @@ class OpenStackWatcherMiddleware(object):
             # accessing req.path on not correct encoded request path causing this
             self.logger.debug("failed to determine CADF attributes: UnicodeDecodeError")
 
+        if self.unknown_paths is not None:
+            if common.is_none_or_unknown(environ.get('WATCHER.TARGET_TYPE_URI')) or \
+                    common.is_none_or_unknown(environ.get('WATCHER.ACTION')):
+                self.unknown_paths.append('{0} {1}'.format(environ.get('REQUEST_METHOD'), environ.get('PATH_INFO')))
+
+        # time spent by the middleware classifying the request
+        overhead = None
+        if overhead_start is not None:
+            overhead = _clock() - overhead_start
+
+        request_info = None
+        if self.inflight is not None:
+            request_info = self.inflight.register(inflight.RequestInfo(
+                environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'),
+                action=environ.get('WATCHER.ACTION', taxonomy.UNKNOWN),
+                target_type_uri=environ.get('WATCHER.TARGET_TYPE_URI', taxonomy.UNKNOWN),
+                initiator_project_id=environ.get('WATCHER.INITIATOR_PROJECT_ID', taxonomy.UNKNOWN),
+                initiator_user_id=environ.get('WATCHER.INITIATOR_USER_ID', taxonomy.UNKNOWN),
+                target_project_id=environ.get('WATCHER.TARGET_PROJECT_ID', taxonomy.UNKNOWN),
+                start=start
+            ))
+        inflight_labels = None
+        if self.is_inflight_metric_enabled:
+            inflight_labels = list(labels) + ['worker:{0}'.format(self.get_worker_index())]
+            self.emit_inflight(request_info, inflight_labels)
+
+        for background_thread in self.background_threads:
+            background_thread.ensure_started()
+
+        is_allocation_traced = self.allocation_sampler is not None and self.allocation_sampler.start()
+
+        is_captured = self.capture is not None and self.capture.should_capture(start)
+        captured_body = None
+        if is_captured:
+            captured_body = self.capture.read_body(req)
+
         # capture the response status
         response_wrapper = {}
 
@@ -242,8 +655,22 @@ class OpenStackWatcherMiddleware(object):
                 response_wrapper.update(status=status, headers=headers, exc_info=exc_info)
                 return start_response(status, headers, exc_info)
 
-            return self.app(environ, _start_response_wrapper)
+            app_iter = self.app(environ, _start_response_wrapper)
+        except Exception:
+            if request_info is not None:
+                self.inflight.unregister(request_info)
+            if inflight_labels is not None:
+                self.emit_inflight(request_info, inflight_labels)
+            if self.access_log:
+                self.log_access(
+                    environ, start, time.time() - start, response_wrapper.get('headers'), None, response_wrapper.get('status')
+                )
+            raise
         finally:
+            # tracing is stopped once the application returned, as a server might never close the response
+            allocations = None
+            if is_allocation_traced:
+                allocations = self.stop_allocation_tracing(environ)
             try:
                 self.metric_client.open_buffer()
 
@@ -256,15 +683,567 @@ class OpenStackWatcherMiddleware(object):
                 labels.append("status:{0}".format(status_code))
                 detail_labels.append("status:{0}".format(status_code))
 
-                self.metric_client.timing(
-                    'api_requests_duration_seconds', int(round(1000 * (time.time() - start))), tags=labels
-                )
-                self.metric_client.increment('api_requests_total', tags=detail_labels)
+                decision = filters.DEFAULT_DECISION
+                if self.event_filter:
+                    decision = self.event_filter.match(
+                        environ.get('WATCHER.ACTION', taxonomy.UNKNOWN),
+                        environ.get('WATCHER.TARGET_TYPE_URI', taxonomy.UNKNOWN),
+                        environ.get('WATCHER.INITIATOR_PROJECT_ID', taxonomy.UNKNOWN),
+                        status_code
+                    )
+                    if not decision.detail_metrics:
+                        detail_labels = list(labels)
+                is_event_emitted = self.event_emitter is not None and decision.events
+
+                duration = time.time() - start
+                request_id = None
+                if self.slowest_requests or self.is_prometheus_exemplars_enabled or is_event_emitted:
+                    request_id = self.get_request_id_from_headers(response_wrapper.get('headers'))
+
+                self.emit_request_metrics(environ, labels, detail_labels, duration, request_id)
+
+                if allocations is not None:
+                    self.emit_allocations(labels, *allocations)
+
+                if self.slowest_requests:
+                    self.slowest_requests.observe(
+                        environ.get('WATCHER.TARGET_TYPE_URI', taxonomy.UNKNOWN), duration, request_id,
+                        environ.get('WATCHER.INITIATOR_PROJECT_ID', taxonomy.UNKNOWN),
+                        environ.get('WATCHER.ACTION', taxonomy.UNKNOWN)
+                    )
+
+                if is_event_emitted:
+                    self.emit_event(environ, start, duration, status_code, request_id)
+
+                if is_captured:
+                    self.capture_request(environ, start, duration, status_code, captured_body)
+
+                # time the request was queued before the worker picked it up
+                queue_duration = self.get_queue_duration(environ, start)
+                if queue_duration is not None:
+                    self.metric_client.timing(
+                        'api_requests_queue_duration_seconds', int(round(1000 * queue_duration)), tags=labels
+                    )
+
+                if overhead is not None:
+                    self.emit_overhead(labels, environ, overhead)
+
+                # garbage collection pauses of the process since the last request finished
+                if self.gc_monitor:
+                    for generation, pause in self.gc_monitor.drain():
+                        self.metric_client.timing(
+                            'gc_pause_seconds', 1000 * pause, tags=['generation:{0}'.format(generation)]
+                        )
             except Exception as e:
+                self.failed_metric_submissions += 1
                 self.logger.debug("failed to submit metrics for %s: %s" % (str(labels), str(e)))
             finally:
                 self.metric_client.close_buffer()
 
+        # callbacks invoked once the server closed the response, which is after a streamed response was sent
+        close_callbacks = []
+        if cpu_start is not None:
+            thread_ident = threading.current_thread().ident
+            close_callbacks.append(
+                lambda: self.emit_cpu_time(labels, environ.get('WATCHER.ACTION'), cpu_start, thread_ident)
+            )
+        if self.gc_monitor and request_info is not None:
+            close_callbacks.append(lambda: self.emit_gc_attribution(labels, request_info))
+        if request_info is not None:
+            close_callbacks.append(lambda: self.inflight.unregister(request_info))
+        if inflight_labels is not None:
+            close_callbacks.append(lambda: self.emit_inflight(request_info, inflight_labels))
+        if self.access_log:
+            # after the response was sent. a streamed response might also start it only when iterated
+            close_callbacks.append(lambda: self.log_access(
+                environ, start, time.time() - start, response_wrapper.get('headers'), closing.bytes_sent,
+                response_wrapper.get('status')
+            ))
+
+        if close_callbacks:
+            closing = common.ClosingIterable(
+                app_iter, lambda: self.run_close_callbacks(close_callbacks), count_bytes=self.access_log is not None
+            )
+            return closing
+        return app_iter
+
+    def get_labels(self, environ):
+        """
+        get the labels of the metrics of a request
+
+        :param environ: the WSGI environment dict with the CADF attributes of the request
+        :return: the labels applied to all metrics and the labels of the detail metrics, both without status
+        """
+        # labels applied to all metrics emitted by this middleware
+        labels = [
+            "service_name:{0}".format(self.strategy.get_cadf_service_name()),
+            "service:{0}".format(self.service_type),
+            "action:{0}".format(environ.get('WATCHER.ACTION')),
+            "target_type_uri:{0}".format(environ.get('WATCHER.TARGET_TYPE_URI'))
+        ]
+
+        # additional labels not needed in all metrics
+        detail_labels = labels + [
+            "initiator_project_id:{0}".format(environ.get('WATCHER.INITIATOR_PROJECT_ID')),
+            "initiator_domain_id:{0}".format(environ.get('WATCHER.INITIATOR_DOMAIN_ID'))
+        ]
+
+        # include the target project id in metric
+        if self.is_include_target_project_id_in_metric:
+            detail_labels.append("target_project_id:{0}".format(environ.get('WATCHER.TARGET_PROJECT_ID')))
+
+        # include initiator user id
+        if self.is_include_initiator_user_id_in_metric:
+            detail_labels.append("initiator_user_id:{0}".format(environ.get('WATCHER.INITIATOR_USER_ID')))
+        return labels, detail_labels
+
+    def emit_request_metrics(self, environ, labels, detail_labels, duration, request_id):
+        """
+        emit the duration and count of a request via statsd and to the prometheus registry
+
+        :param environ: the WSGI environment dict
+        :param labels: the labels of the request including the status
+        :param detail_labels: the labels of the detail metrics including the status
+        :param duration: the duration in seconds
+        :param request_id: the request id set by the service or None
+        """
+        # statsd scales sampled counts and timings back up by the sample rate
+        duration_sample_rate = total_sample_rate = 1
+        if self.sampler:
+            action = environ.get('WATCHER.ACTION')
+            duration_sample_rate = self.sampler.rate('api_requests_duration_seconds', action)
+            total_sample_rate = self.sampler.rate('api_requests_total', action)
+
+        if self.duration_aggregator:
+            self.duration_aggregator.observe(labels, duration)
+        else:
+            self.metric_client.timing(
+                'api_requests_duration_seconds', int(round(1000 * duration)), tags=labels,
+                sample_rate=duration_sample_rate
+            )
+
+        if self.cardinality_governor:
+            detail_labels, collapsed_labels = self.cardinality_governor.limit('api_requests_total', detail_labels)
+            for label in collapsed_labels:
+                self.metric_client.increment(
+                    'cardinality_collapsed_total', tags=['metric:api_requests_total', 'label:{0}'.format(label)]
+                )
+        self.metric_client.increment('api_requests_total', tags=detail_labels, sample_rate=total_sample_rate)
+
+        if self.prometheus_registry:
+            exemplar = None
+            if self.is_prometheus_exemplars_enabled and request_id:
+                exemplar = ['request_id:{0}'.format(request_id)]
+            self.prometheus_requests_duration.observe(labels, duration, exemplar)
+            self.prometheus_requests_total.inc(detail_labels)
+
+    def emit_gc_attribution(self, labels, request_info):
+        """
+        emit the garbage collection pauses suffered by a request and the collections it triggered
+
+        :param labels: the labels of the request
+        :param request_info: the RequestInfo of the request
+        """
+        if request_info.gc_pause > 0:
+            self.metric_client.timing('api_requests_gc_pause_seconds', 1000 * request_info.gc_pause, tags=labels)
+        if request_info.gc_collections > 0:
+            self.metric_client.increment('api_requests_gc_collections_total', request_info.gc_collections, tags=labels)
+
+    def stop_allocation_tracing(self, environ):
+        """
+        stop tracing the memory allocations of the request
+
+        :param environ: the WSGI environment dict
+        :return: tuple of peak and net allocations in bytes or None if they could not be determined
+        """
+        try:
+            return self.allocation_sampler.stop(
+                environ.get('WATCHER.ACTION', taxonomy.UNKNOWN),
+                environ.get('WATCHER.TARGET_TYPE_URI', taxonomy.UNKNOWN)
+            )
+        except Exception as e:
+            self.logger.debug("failed to trace allocations: {0}".format(str(e)))
+            return None
+
+    def emit_allocations(self, labels, peak, net):
+        """
+        emit the peak and net allocations of the request
+
+        :param labels: the labels of the request
+        :param peak: peak allocations in bytes
+        :param net: allocations in bytes not freed when the application returned
+        """
+        try:
+            self.metric_client.histogram('api_requests_memory_peak_bytes', peak, tags=labels)
+            self.metric_client.histogram('api_requests_memory_net_bytes', net, tags=labels)
+        except Exception as e:
+            self.logger.debug("failed to submit allocations for %s: %s" % (str(labels), str(e)))
+
+    def get_http_shipper(self):
+        """
+        get a shipper of events to the collector at cadf_events_http_url
+
+        :return: the shipper.HttpShipper
+        """
+        return shipper.HttpShipper(
+            self.wsgi_config.get('cadf_events_http_url', 'http://localhost:8080/events'),
+            pool_size=int(self.wsgi_config.get('cadf_events_http_pool_size', 4)),
+            timeout=float(self.wsgi_config.get('cadf_events_http_timeout', 10)),
+            gzip=common.string_to_bool(self.wsgi_config.get('cadf_events_http_gzip', 'True')),
+            max_retries=int(self.wsgi_config.get('cadf_events_http_max_retries', 5)),
+            backoff_base=float(self.wsgi_config.get('cadf_events_http_backoff_base', 0.5)),
+            backoff_max=float(self.wsgi_config.get('cadf_events_http_backoff_max', 30)),
+            logger=self.logger
+        )
+
+    def get_spool_encoder(self):
+        """
+        get the encoder of spooled events according to cadf_events_spool_format
+
+        :return: codec.Encoder or codec.JsonEncoder
+        """
+        spool_format = self.wsgi_config.get('cadf_events_spool_format', 'json')
+        if spool_format == 'binary':
+            return codec.Encoder(
+                compress=common.string_to_bool(self.wsgi_config.get('cadf_events_spool_compression', 'True'))
+            )
+        if spool_format != 'json':
+            self.logger.warning("unknown cadf_events_spool_format '{0}'. using json".format(spool_format))
+        return codec.JsonEncoder()
+
+    def emit_event(self, environ, start, duration, status_code, request_id):
+        """
+        queue the CADF attributes of the request to be emitted as event
+
+        :param environ: the WSGI environment dict
+        :param start: time the request was received
+        :param duration: the duration in seconds
+        :param status_code: the response status code
+        :param request_id: the request id set by the service
+        """
+        self.event_emitter.emit(events.EventRecord(
+            start, duration, environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'), status_code,
+            environ.get('WATCHER.ACTION', taxonomy.UNKNOWN),
+            environ.get('WATCHER.TARGET_TYPE_URI', taxonomy.UNKNOWN),
+            environ.get('WATCHER.TARGET_PROJECT_ID', taxonomy.UNKNOWN),
+            environ.get('WATCHER.INITIATOR_PROJECT_ID', taxonomy.UNKNOWN),
+            environ.get('WATCHER.INITIATOR_DOMAIN_ID', taxonomy.UNKNOWN),
+            environ.get('WATCHER.INITIATOR_USER_ID', taxonomy.UNKNOWN),
+            environ.get('WATCHER.INITIATOR_HOST_ADDRESS', taxonomy.UNKNOWN),
+            request_id
+        ))
+
+    def capture_request(self, environ, start, duration, status_code, body):
+        """
+        queue the captured request
+
+        :param environ: the WSGI environment dict
+        :param start: time the request was received
+        :param duration: the duration in seconds
+        :param status_code: the response status code
+        :param body: the captured body or None
+        """
+        self.capture.capture(capture.CaptureRecord(
+            start, environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'), self.capture.get_query_string(environ),
+            self.capture.get_headers(environ), body, common.parse_content_length(environ.get('CONTENT_LENGTH')),
+            status_code, duration, environ.get('WATCHER.ACTION', taxonomy.UNKNOWN),
+            environ.get('WATCHER.TARGET_TYPE_URI', taxonomy.UNKNOWN)
+        ))
+
+    def log_access(self, environ, start, duration, headers, response_bytes, status=None):
+        """
+        queue the access log line of the request
+
+        :param environ: the WSGI environment dict
+        :param start: time the request was received
+        :param duration: seconds until the response was sent
+        :param headers: list of (header, value) tuples of the response
+        :param response_bytes: number of bytes of the response body sent or None if unknown
+        :param status: the response status line or None if the application failed before starting the response
+        """
+        status_code = status.split()[0] if status else taxonomy.UNKNOWN
+        self.access_log.log(accesslog.AccessRecord(
+            start, environ.get('REMOTE_ADDR'), environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'), status_code,
+            duration, common.parse_content_length(environ.get('CONTENT_LENGTH')), response_bytes,
+            self.get_request_id_from_headers(headers),
+            environ.get('WATCHER.ACTION', taxonomy.UNKNOWN),
+            environ.get('WATCHER.TARGET_TYPE_URI', taxonomy.UNKNOWN),
+            environ.get('WATCHER.TARGET_PROJECT_ID', taxonomy.UNKNOWN),
+            environ.get('WATCHER.INITIATOR_PROJECT_ID', taxonomy.UNKNOWN),
+            environ.get('WATCHER.INITIATOR_DOMAIN_ID', taxonomy.UNKNOWN),
+            environ.get('WATCHER.INITIATOR_USER_ID', taxonomy.UNKNOWN)
+        ))
+
+    def emit_overhead(self, labels, environ, overhead):
+        """
+        emit the time spent classifying the request and count it if it exceeded the budget
+
+        :param labels: the labels of the request
+        :param environ: the WSGI environment dict
+        :param overhead: the overhead in seconds
+        """
+        self.metric_client.timing('watcher_overhead_seconds', 1000 * overhead, tags=labels)
+        if 0 < self.overhead_budget < overhead:
+            self.metric_client.increment('watcher_overhead_budget_exceeded_total', tags=labels)
+            self.logger.info(
+                "classifying {0} {1} took {2:.0f}us, exceeding the budget of {3:.0f}us".format(
+                    environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'), 1000000 * overhead,
+                    1000000 * self.overhead_budget
+                )
+            )
+
+    def emit_inflight(self, request_info, labels):
+        """
+        emit the number of requests in flight in this process with the same action and target type URI as the given
+        request
+
+        :param request_info: the RequestInfo of the request
+        :param labels: the labels of the request without status
+        """
+        try:
+            self.metric_client.gauge(
+                'api_requests_inflight', self.inflight.count(request_info.action, request_info.target_type_uri),
+                tags=labels
+            )
+        except Exception as e:
+            self.logger.debug("failed to submit requests in flight for %s: %s" % (str(labels), str(e)))
+
+    def get_worker_index(self):
+        """
+        get the index of this worker process among the workers of the service
+
+        :return: the index or 'unknown' if no worker slot could be claimed
+        """
+        try:
+            return self.worker_slot.index()
+        except (IOError, OSError) as e:
+            self.logger.debug("failed to claim a worker slot: {0}".format(str(e)))
+            return taxonomy.UNKNOWN
+
+    def get_queue_duration(self, environ, start):
+        """
+        get the time a request was queued from a header set by the front-end
+
+        :param environ: the WSGI environment dict
+        :param start: time the middleware received the request
+        :return: the queue duration in seconds or None
+        """
+        for header in self.queue_time_headers:
+            received = common.parse_request_start_header(environ.get(header))
+            if received is None:
+                continue
+            queue_duration = start - received
+            # ignore clock skew between front-end and worker and nonsense values
+            if queue_duration < 0:
+                return 0.0
+            if queue_duration > self.queue_time_max_seconds:
+                return None
+            return queue_duration
+        return None
+
+    def run_close_callbacks(self, callbacks):
+        """
+        run the callbacks registered for the end of a request
+
+        :param callbacks: list of callables
+        """
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                self.logger.debug("close callback failed: %s" % str(e))
+
+    def emit_cpu_time(self, labels, action, cpu_start, thread_ident):
+        """
+        emit the CPU time consumed by the current thread since cpu_start
+
+        :param labels: the labels of the request
+        :param action: the CADF action of the request
+        :param cpu_start: thread CPU time at the beginning of the request
+        :param thread_ident: ident of the thread that started the request
+        """
+        # the CPU time of another thread is meaningless
+        if threading.current_thread().ident != thread_ident:
+            self.logger.debug("response closed by another thread. not emitting CPU time for %s" % str(labels))
+            return
+        try:
+            cpu_time = common.thread_cpu_time() - cpu_start
+            if self.cpu_time_aggregator:
+                self.cpu_time_aggregator.observe(labels, cpu_time)
+            else:
+                sample_rate = 1
+                if self.sampler:
+                    sample_rate = self.sampler.rate('api_requests_cpu_seconds', action)
+                self.metric_client.timing(
+                    'api_requests_cpu_seconds', int(round(1000 * cpu_time)), tags=labels, sample_rate=sample_rate
+                )
+            if self.prometheus_registry:
+                self.prometheus_requests_cpu_time.observe(labels, cpu_time)
+        except Exception as e:
+            self.logger.debug("failed to submit CPU time for %s: %s" % (str(labels), str(e)))
+
+    def serve_prometheus_metrics(self, environ, start_response):
+        """
+        answer a scrape with the metrics of the in-process registry.
+        the OpenMetrics format is used if the scraper accepts it
+
+        :param environ: the WSGI environment dict
+        :param start_response: WSGI callable
+        :return: the response body
+        """
+        openmetrics = 'application/openmetrics-text' in environ.get('HTTP_ACCEPT', '')
+        body = self.prometheus_registry.render(openmetrics).encode('utf-8')
+        start_response('200 OK', [
+            ('Content-Type', prometheus.CONTENT_TYPE_OPENMETRICS if openmetrics else prometheus.CONTENT_TYPE_TEXT),
+            ('Content-Length', str(len(body)))
+        ])
+        return [body]
+
+    def serve_profile(self, environ, start_response):
+        """
+        answer with the collapsed stacks of the sampling profiler. '?reset=true' clears them
+
+        :param environ: the WSGI environment dict
+        :param start_response: WSGI callable
+        :return: the response body
+        """
+        reset = common.string_to_bool(Request(environ).GET.get('reset', 'False'))
+        body = self.profiler.collapsed(reset).encode('utf-8')
+        start_response('200 OK', [
+            ('Content-Type', 'text/plain; charset=utf-8'),
+            ('Content-Length', str(len(body)))
+        ])
+        return [body]
+
+    def serve_allocations(self, environ, start_response):
+        """
+        answer with the allocations of the sampled requests as JSON. '?reset=true' clears them
+
+        :param environ: the WSGI environment dict
+        :param start_response: WSGI callable
+        :return: the response body
+        """
+        reset = common.string_to_bool(Request(environ).GET.get('reset', 'False'))
+        body = json.dumps(self.allocation_sampler.to_list(reset)).encode('utf-8')
+        start_response('200 OK', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body)))
+        ])
+        return [body]
+
+    def serve_slowest_requests(self, environ, start_response):
+        """
+        answer with the slowest requests per target type URI of the current and the previous interval as JSON
+
+        :param environ: the WSGI environment dict
+        :param start_response: WSGI callable
+        :return: the response body
+        """
+        body = json.dumps(self.slowest_requests.to_dict()).encode('utf-8')
+        start_response('200 OK', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body)))
+        ])
+        return [body]
+
+    def serve_debug(self, environ, start_response):
+        """
+        answer with the internal state of the middleware as JSON
+
+        :param environ: the WSGI environment dict
+        :param start_response: WSGI callable
+        :return: the response body
+        """
+        body = json.dumps(self.get_debug_info(), indent=2, sort_keys=True, default=str).encode('utf-8')
+        start_response('200 OK', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body)))
+        ])
+        return [body]
+
+    def get_debug_info(self):
+        """
+        collect the internal state of the middleware
+
+        :return: dict
+        """
+        queues = {}
+        dropped = {'failed_metric_submissions': self.failed_metric_submissions}
+        if self.duration_aggregator:
+            queues['duration_aggregator'] = self.duration_aggregator.pending()
+        if self.cpu_time_aggregator:
+            queues['cpu_time_aggregator'] = self.cpu_time_aggregator.pending()
+        if self.inflight is not None:
+            queues['inflight'] = len(self.inflight)
+        if self.gc_monitor:
+            queues['gc_monitor'] = len(self.gc_monitor.pending)
+        if self.cardinality_governor:
+            dropped['cardinality_collapsed'] = self.cardinality_governor.stats()
+        if self.event_emitter:
+            queues['cadf_events'] = len(self.event_emitter.writer.queue)
+            dropped['cadf_events'] = self.event_emitter.writer.dropped
+            if self.event_emitter.aggregator:
+                queues['cadf_events_aggregated'] = len(self.event_emitter.aggregator.window)
+        if self.access_log:
+            queues['access_log'] = len(self.access_log.writer.queue)
+            dropped['access_log'] = self.access_log.writer.dropped
+        if self.capture:
+            queues['capture'] = len(self.capture.writer.queue)
+            dropped['capture'] = self.capture.writer.dropped
+        if self.spool_shipper:
+            dropped['cadf_events_rejected'] = self.spool_shipper.shipper.rejected
+            dropped['cadf_events_dead_lettered'] = self.spool_shipper.dead_lettered
+        if isinstance(self.prometheus_registry, shm.SharedRegistry):
+            dropped['prometheus_shared_table_full'] = self.prometheus_registry.store.dropped
+        if self.profiler:
+            dropped['profiler_truncated_stacks'] = self.profiler.stacks.get(profiler.TRUNCATED, 0)
+
+        info = {
+            'version': common.get_version(),
+            'pid': os.getpid(),
+            'service_type': self.service_type,
+            'config': {
+                'wsgi': self.wsgi_config,
+                'watcher': self.watcher_config,
+                'strategy': {
+                    'name': self.strategy.name,
+                    'target_type_uri_prefix': self.strategy.target_type_uri_prefix,
+                    'path_keywords': self.strategy.path_keywords,
+                    'keyword_exclusions': self.strategy.keyword_exclusions,
+                    'regex_mapping': self.strategy.regex_mapping,
+                },
+                'admin_paths': sorted(self.admin_handlers.keys()),
+            },
+            'regex_hits': dict(self.strategy.regex_hits),
+            'sampling_factor': self.sampler.factor if self.sampler else None,
+            'queues': queues,
+            'dropped': dropped,
+            'unknown_paths': list(self.unknown_paths),
+        }
+        if self.watchdog:
+            # stacks of the requests that exceeded the watchdog_threshold
+            info['slow_requests'] = {'captured': self.watchdog.captured, 'entries': list(self.watchdog.entries)}
+        if self.eventlet_monitor:
+            # the last stalls of the eventlet hub along with the requests in flight
+            info['eventlet_hub_stalls'] = {
+                'stalls': self.eventlet_monitor.stalls,
+                'max_lag': self.eventlet_monitor.max_lag,
+                'entries': list(self.eventlet_monitor.entries),
+            }
+        return info
+
+    def get_request_id_from_headers(self, headers):
+        """
+        get the request id set by the service from the response headers
+
+        :param headers: list of (header, value) tuples
+        :return: the request id or None
+        """
+        for header, value in headers or []:
+            if header.lower() in ('x-openstack-request-id', 'x-compute-request-id'):
+                return value
+        return None
+
     def get_safe_from_environ(self, environ, key, default=taxonomy.UNKNOWN):
         """
         get value for a key from the environ dict ensuring it's never None or an empty string